@@ -0,0 +1 @@
+# Benchmarks of route_distances against local stub servers
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# Compares two benchmark results: python -m benchmarks.compare OLD NEW
+
+import argparse
+import json
+import sys
+
+# Default relative change in throughput or p99 latency reported as a
+# regression
+DEFAULT_THRESHOLD = 0.1
+
+def load(path):
+    """ Loads a results file, keyed by (backend, scenario, concurrency) """
+
+    with open(path) as f:
+        report = json.load(f)
+    return dict(
+        ((result["backend"], result["scenario"], result["concurrency"]),
+         result)
+        for result in report["results"]
+    )
+
+def compare(old, new, threshold = DEFAULT_THRESHOLD):
+    """ Compares two sets of results
+
+    Args:
+        old: Results loaded by load.
+        new: Results loaded by load.
+        threshold: The relative change counted as a regression.
+
+    Returns:
+        A list of (key, throughput ratio, p99 ratio, regressed) tuples for
+            every key in both sets, where ratios are new / old.
+    """
+
+    rows = []
+
+    for key in sorted(set(old) & set(new)):
+        throughput = new[key]["throughput"] / old[key]["throughput"]
+        p99 = None
+        if (old[key]["p99"] and new[key]["p99"] is not None):
+            p99 = new[key]["p99"] / old[key]["p99"]
+        regressed = (throughput < 1 - threshold
+                     or (p99 is not None and p99 > 1 + threshold))
+        rows.append((key, throughput, p99, regressed))
+
+    return rows
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(
+        prog = "python -m benchmarks.compare",
+        description = "Compare two benchmark results files. Exits with "
+                      "status 1 if any scenario regressed."
+    )
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type = float,
+                        default = DEFAULT_THRESHOLD,
+                        help = "relative change counted as a regression")
+    args = parser.parse_args(argv)
+
+    rows = compare(load(args.old), load(args.new), args.threshold)
+
+    print("%-12s %-22s %5s %12s %10s" % ("backend", "scenario", "conc",
+                                         "throughput", "p99"))
+    for ((backend, scenario, concurrency), throughput, p99,
+         regressed) in rows:
+        print("%-12s %-22s %5d %+11.1f%% %s%s" % (
+            backend, scenario, concurrency, (throughput - 1) * 100,
+            "%+9.1f%%" % ((p99 - 1) * 100) if p99 is not None else
+                "%10s" % "-",
+            "  REGRESSION" if regressed else ""
+        ))
+
+    if (any(row[3] for row in rows)):
+        sys.exit(1)
+
+if (__name__ == "__main__"):
+    main()
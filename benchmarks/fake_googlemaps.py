@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# Stand-in for googlemaps.Client that answers without network access
+
+import random
+import threading
+import time
+
+import googlemaps
+import requests
+
+from . import stubs
+
+class FakeClient(object):
+    """ Answers distance_matrix calls the way googlemaps.Client would
+
+    Assign an instance to GoogleMapsDistances.gmaps to benchmark the class
+    without sending requests to Google.
+
+    Attributes:
+        latency: The number of seconds every call is delayed by.
+        error_rate: The fraction of calls that raise
+            googlemaps.exceptions.HTTPError(503).
+        calls: The number of calls made.
+        elements: The number of elements requested.
+        session: A requests.Session, as GoogleMapsDistances mounts its
+            connection pool and hooks on the client's session.
+    """
+
+    def __init__(self, latency = 0, error_rate = 0, seed = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = 0
+        self.elements = 0
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+
+    def distance_matrix(self, origins, destinations, mode = None,
+                        units = None, departure_time = None, **kwargs):
+        """ Returns a Distance Matrix API response for (lat, long) points """
+
+        if (isinstance(origins, tuple) and not isinstance(origins[0], tuple)):
+            origins = [origins]
+        if (isinstance(destinations, tuple)
+                and not isinstance(destinations[0], tuple)):
+            destinations = [destinations]
+
+        with self.lock:
+            self.calls += 1
+            self.elements += len(origins) * len(destinations)
+            fail = self.random.random() < self.error_rate
+
+        if (self.latency > 0):
+            time.sleep(self.latency)
+        if (fail):
+            raise googlemaps.exceptions.HTTPError(503)
+
+        rows = []
+        for origin in origins:
+            elements = []
+            for destination in destinations:
+                (distance, duration) = stubs.route_length(
+                    (origin[1], origin[0]), (destination[1], destination[0])
+                )
+                elements.append({
+                    "status": "OK",
+                    "distance": {"value": int(distance)},
+                    "duration": {"value": int(duration)}
+                })
+            rows.append({"elements": elements})
+
+        return {"status": "OK", "rows": rows}
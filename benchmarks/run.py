@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+# Benchmark runner: python -m benchmarks.run --output results.json
+#
+# Every backend is benchmarked against a local stub server (or, for Google, a
+# fake client), so results depend only on this package and the machine, and
+# can be compared between commits with python -m benchmarks.compare.
+
+import argparse
+import asyncio
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+import route_distances
+from route_distances import distances
+
+from . import fake_googlemaps
+from . import stubs
+
+try:
+    from route_distances import aio
+except ImportError:
+    aio = None
+
+# Backends benchmarked by default
+BACKENDS = ["google", "graphhopper", "osrm", "otp", "valhalla"]
+
+# Default concurrency levels of batch scenarios
+DEFAULT_CONCURRENCY = [1, 8, 32]
+
+# Bounding box random coordinates are drawn from: (long, lat) corners
+BOUNDS = ((-71.2, 42.2), (-70.9, 42.5))
+
+# Classes benchmarked for each backend
+CLASSES = {
+    "google": distances.GoogleMapsDistances,
+    "graphhopper": distances.GraphHopperDistances,
+    "osrm": distances.OSRMDistances,
+    "otp": distances.OTPDistances,
+    "valhalla": distances.ValhallaDistances
+}
+
+ASYNC_CLASSES = {}
+if (aio is not None):
+    ASYNC_CLASSES = {
+        "graphhopper": aio.AsyncGraphHopperDistances,
+        "osrm": aio.AsyncOSRMDistances,
+        "otp": aio.AsyncOTPDistances,
+        "valhalla": aio.AsyncValhallaDistances
+    }
+
+# Run in a fresh interpreter by the startup scenario: imports the package and
+# builds one backend, printing the seconds taken
+STARTUP_CODE = """
+import json, sys, time
+start = time.perf_counter()
+import route_distances
+route_distances.get_backend(sys.argv[1], **json.loads(sys.argv[2]))
+print(time.perf_counter() - start)
+"""
+
+class LatencyRecorder(route_distances.Hooks):
+    """ Collects the latency of every route attempt """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+
+    def on_route(self, backend, mode, outcome, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+def random_points(count, seed):
+    """ Returns count (long, lat) points drawn from BOUNDS """
+
+    generator = random.Random(seed)
+    return [
+        (generator.uniform(BOUNDS[0][0], BOUNDS[1][0]),
+         generator.uniform(BOUNDS[0][1], BOUNDS[1][1]))
+        for i in range(count)
+    ]
+
+def random_pairs(count, seed):
+    """ Returns count (orig_long, orig_lat, dest_long, dest_lat) pairs """
+
+    points = random_points(count * 2, seed)
+    return [points[i] + points[i + 1] for i in range(0, count * 2, 2)]
+
+def percentile(values, fraction):
+    """ Returns a percentile of a list of values, or None if it is empty """
+
+    if (len(values) == 0):
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+class Backend(object):
+    """ A stub server, or fake Google client, and the classes that use it """
+
+    def __init__(self, name, latency, error_rate, seed):
+        self.name = name
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+        self.server = None
+        if (name != "google"):
+            self.server = stubs.StubServer(name, latency, error_rate, seed)
+
+    def calculator(self, hooks = (), lean = False, workers = 1):
+        """ Builds an instance of the backend's class """
+
+        kwargs = {
+            "fail_fast": False,
+            "hooks": hooks,
+            "lean": lean,
+            "pool_maxsize": max(workers, distances.DEFAULT_POOL_MAXSIZE),
+            "retry_policy": route_distances.RetryPolicy(base_delay = 0.001,
+                                                        max_delay = 0.01)
+        }
+
+        if (self.server is None):
+            # Without rate limits, so the fake client's speed is measured
+            calculator = distances.GoogleMapsDistances(
+                api_key = "AIza" + "0" * 35, requests_per_period = None,
+                request_delay = 0, **kwargs
+            )
+            calculator.gmaps = fake_googlemaps.FakeClient(
+                self.latency, self.error_rate, self.seed
+            )
+            return calculator
+
+        return CLASSES[self.name](self.server.entrypoint, **kwargs)
+
+    def async_calculator(self, hooks = (), lean = False, workers = 1):
+        """ Builds an instance of the backend's asyncio class, or None """
+
+        if (self.name not in ASYNC_CLASSES):
+            return None
+        return ASYNC_CLASSES[self.name](
+            self.server.entrypoint, fail_fast = False, hooks = hooks,
+            lean = lean, max_in_flight = workers,
+            retry_policy = route_distances.RetryPolicy(base_delay = 0.001,
+                                                       max_delay = 0.01)
+        )
+
+    def close(self):
+        if (self.server is not None):
+            self.server.close()
+
+def measure(function, memory):
+    """ Runs a scenario, timing it and optionally measuring its memory
+
+    The memory is measured in a second run under tracemalloc, so tracing does
+    not slow down the timed run.
+
+    Returns:
+        A tuple (seconds, peak_memory_bytes, result of the timed run).
+    """
+
+    gc.collect()
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+
+    peak = None
+    if (memory):
+        gc.collect()
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return (seconds, peak, result)
+
+def scenarios(backend, args):
+    """ Yields (scenario, concurrency, operations, function) tuples
+
+    Each function runs the scenario once and returns a tuple (latencies,
+    errors) of per-operation latencies in seconds and the number of failed
+    operations.
+    """
+
+    pairs = random_pairs(args.operations, args.seed)
+
+    def startup():
+        if (backend.server is None):
+            kwargs = {"api_key": "AIza" + "0" * 35}
+        else:
+            kwargs = {"entrypoint": backend.server.entrypoint}
+        # Import this checkout of the package rather than an installed one
+        env = dict(os.environ, PYTHONPATH = os.pathsep.join(
+            [os.path.dirname(os.path.dirname(route_distances.__file__))]
+            + os.environ.get("PYTHONPATH", "").split(os.pathsep)
+        ))
+
+        latencies = []
+        errors = 0
+        for i in range(args.startup_runs):
+            try:
+                latencies.append(float(subprocess.check_output(
+                    [sys.executable, "-c", STARTUP_CODE, backend.name,
+                     json.dumps(kwargs)], env = env
+                )))
+            except (subprocess.CalledProcessError, ValueError):
+                errors += 1
+        return (latencies, errors)
+
+    if (args.startup_runs > 0):
+        yield ("startup", 1, args.startup_runs, startup)
+
+    def sequential(method_name):
+        def run():
+            calculator = backend.calculator()
+            method = getattr(calculator, method_name)
+            latencies = []
+            errors = 0
+            for pair in pairs:
+                start = time.perf_counter()
+                try:
+                    result = method(*pair, mode = "drive")
+                except Exception:
+                    result = False
+                latencies.append(time.perf_counter() - start)
+                errors += not result
+            calculator.close()
+            return (latencies, errors)
+        return run
+
+    yield ("route", 1, len(pairs), sequential("route"))
+    yield ("distance", 1, len(pairs), sequential("distance"))
+
+    for workers in args.concurrency:
+        for lean in (False, True):
+            def batch(workers = workers, lean = lean):
+                recorder = LatencyRecorder()
+                calculator = backend.calculator([recorder], lean, workers)
+                results = calculator.distance_batch(pairs, mode = "drive",
+                                                    workers = workers)
+                calculator.close()
+                return (recorder.latencies,
+                        sum(1 for result in results if not result))
+
+            yield ("distance_batch_lean" if lean else "distance_batch",
+                   workers, len(pairs), batch)
+
+    if (aio is not None and backend.name in ASYNC_CLASSES):
+        for workers in args.concurrency:
+            def async_batch(workers = workers):
+                recorder = LatencyRecorder()
+
+                async def main():
+                    calculator = backend.async_calculator([recorder], False,
+                                                          workers)
+                    try:
+                        return await calculator.distance_batch(
+                            pairs, mode = "drive"
+                        )
+                    finally:
+                        await calculator.close()
+
+                results = asyncio.run(main())
+                return (recorder.latencies,
+                        sum(1 for result in results if not result))
+
+            yield ("async_distance_batch", workers, len(pairs), async_batch)
+
+    if (hasattr(CLASSES[backend.name], "build_chain_request")):
+        chain = random_points(args.chain_length, args.seed)
+
+        def route_chain():
+            calculator = backend.calculator()
+            start = time.perf_counter()
+            try:
+                result = calculator.route_chain(chain, mode = "drive")
+                errors = 0 if result else len(chain) - 1
+            except Exception:
+                errors = len(chain) - 1
+            latency = time.perf_counter() - start
+            calculator.close()
+            return ([latency], errors)
+
+        yield ("route_chain", 1, len(chain) - 1, route_chain)
+
+    if (hasattr(CLASSES[backend.name], "matrix")):
+        size = args.matrix_size
+        origins = random_points(size, args.seed)
+        destinations = random_points(size, args.seed + 1)
+
+        def matrix():
+            calculator = backend.calculator()
+            start = time.perf_counter()
+            try:
+                result = calculator.matrix(origins, destinations,
+                                           mode = "drive")
+                errors = sum(cell is None for row in result["duration"]
+                             for cell in row)
+            except Exception:
+                errors = size * size
+            latency = time.perf_counter() - start
+            calculator.close()
+            return ([latency], errors)
+
+        yield ("matrix", 1, size * size, matrix)
+
+def git_commit():
+    """ Returns the commit the package is checked out at, or None """
+
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr = subprocess.DEVNULL,
+            cwd = sys.path[0] or "."
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args, log = print):
+    """ Runs every scenario for every selected backend
+
+    Returns:
+        A dictionary with "meta" and "results" keys, ready to be written as
+            JSON.
+    """
+
+    results = []
+
+    for name in args.backends:
+        backend = Backend(name, args.latency, args.error_rate, args.seed)
+        try:
+            for (scenario, concurrency, operations, function) in scenarios(
+                    backend, args):
+                (seconds, peak, (latencies, errors)) = measure(
+                    function, args.memory
+                )
+                result = {
+                    "backend": name,
+                    "scenario": scenario,
+                    "concurrency": concurrency,
+                    "operations": operations,
+                    "seconds": seconds,
+                    "throughput": operations / seconds,
+                    "p50": percentile(latencies, 0.5),
+                    "p99": percentile(latencies, 0.99),
+                    "peak_memory_bytes": peak,
+                    "errors": errors
+                }
+                results.append(result)
+                log("%-12s %-22s x%-3d %10.1f ops/s  p50 %s  p99 %s" % (
+                    name, scenario, concurrency, result["throughput"],
+                    "%.2fms" % (result["p50"] * 1000)
+                    if result["p50"] is not None else "-",
+                    "%.2fms" % (result["p99"] * 1000)
+                    if result["p99"] is not None else "-"
+                ))
+        finally:
+            backend.close()
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "settings": {
+                "operations": args.operations,
+                "matrix_size": args.matrix_size,
+                "chain_length": args.chain_length,
+                "startup_runs": args.startup_runs,
+                "concurrency": args.concurrency,
+                "latency": args.latency,
+                "error_rate": args.error_rate,
+                "seed": args.seed
+            }
+        },
+        "results": results
+    }
+
+def parse_args(argv = None):
+    """ Parses command line arguments
+
+    Args:
+        argv: A list of arguments, or None to use sys.argv.
+
+    Returns:
+        An argparse.Namespace object.
+    """
+
+    parser = argparse.ArgumentParser(
+        prog = "python -m benchmarks.run",
+        description = "Benchmark route_distances against local stub servers."
+    )
+    parser.add_argument("--output", help = "JSON file to write results to")
+    parser.add_argument("--backends", nargs = "+", default = BACKENDS,
+                        choices = BACKENDS)
+    parser.add_argument("--concurrency", nargs = "+", type = int,
+                        default = DEFAULT_CONCURRENCY,
+                        help = "worker counts of batch scenarios")
+    parser.add_argument("--operations", type = int, default = 500,
+                        help = "pairs routed per scenario")
+    parser.add_argument("--matrix-size", type = int, default = 50,
+                        help = "origins and destinations in the matrix "
+                               "scenario")
+    parser.add_argument("--chain-length", type = int, default = 50,
+                        help = "stops in the route_chain scenario")
+    parser.add_argument("--startup-runs", type = int, default = 10,
+                        help = "fresh interpreters timed importing the "
+                               "package and building a backend")
+    parser.add_argument("--latency", type = float, default = 0,
+                        help = "seconds every stub request is delayed by")
+    parser.add_argument("--error-rate", type = float, default = 0,
+                        help = "fraction of stub requests that fail")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--no-memory", dest = "memory",
+                        action = "store_false",
+                        help = "skip the tracemalloc run of each scenario")
+
+    return parser.parse_args(argv)
+
+def main(argv = None):
+    args = parse_args(argv)
+    report = run(args, log = lambda message: print(message, flush = True))
+
+    if (args.output):
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent = 2)
+
+if (__name__ == "__main__"):
+    main()
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# Local HTTP servers imitating the responses of each self-hosted backend
+
+import datetime
+import http.server
+import json
+import math
+import random
+import threading
+import time
+import urllib.parse
+
+# Backends StubServer can imitate
+BACKENDS = ["graphhopper", "osrm", "otp", "valhalla"]
+
+# Ratio of route distance to straight-line distance in stub responses
+DETOUR_FACTOR = 1.3
+
+# Speed, in meters per second, of routes in stub responses
+SPEED = 10.0
+
+# Seconds between the departures of OTP stub itineraries
+OTP_HEADWAY = 600
+
+# Size, in characters, of the geometry and instructions padding of a full
+# (not lean) stub response, roughly that of a short real route
+RESPONSE_PADDING = 2048
+
+def haversine(long1, lat1, long2, lat2):
+    """ Returns the great-circle distance between two points, in meters """
+
+    (long1, lat1, long2, lat2) = map(math.radians, (long1, lat1, long2, lat2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((long2 - long1) / 2) ** 2)
+    return 2 * 6371008.8 * math.asin(math.sqrt(min(a, 1)))
+
+def route_length(origin, destination):
+    """ Returns the (distance, duration) of a stub route between two (long,
+    lat) points """
+
+    distance = haversine(origin[0], origin[1], destination[0],
+                         destination[1]) * DETOUR_FACTOR
+    return (distance, distance / SPEED)
+
+def isochrone_radius(cutoff):
+    """ Returns the half-width, in degrees, of the square a stub isochrone
+    covers for a cutoff in seconds """
+
+    return cutoff * SPEED / DETOUR_FACTOR / 111320
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """ Answers requests the way the server's backend would """
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, which Nagle's algorithm would
+    # hold up until the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, content, status = 200):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self, body = None):
+        server = self.server
+        server.count_request()
+
+        if (server.latency > 0):
+            time.sleep(server.latency)
+        if (server.should_fail()):
+            return self.send_json({"error": "Stub error"}, 503)
+
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        segments = url.path.strip("/").split("/")
+        # OTP's endpoints live under /otp/routers/<router>/
+        if (server.backend == "otp" and len(segments) > 3):
+            segments = segments[3:]
+        handler = getattr(self, "%s_%s" % (server.backend, segments[0]),
+                          None)
+        if (handler is None):
+            return self.send_json({"error": "Not found"}, 404)
+        self.send_json(handler(url.path, query, body))
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.handle_request(json.loads(self.rfile.read(length) or b"{}"))
+
+    def padding(self, query):
+        """ Stands in for geometry and instructions unless they were turned
+        off """
+
+        lean = (query.get("overview") == ["false"]
+                or query.get("instructions") == ["false"])
+        return "" if lean else "x" * RESPONSE_PADDING
+
+    def osrm_route(self, path, query, body):
+        points = [tuple(map(float, point.split(",")))
+                  for point in path.split("/")[-1].split(";")]
+        legs = [route_length(points[i], points[i + 1])
+                for i in range(len(points) - 1)]
+        return {
+            "code": "Ok",
+            "routes": [{
+                "distance": sum(leg[0] for leg in legs),
+                "duration": sum(leg[1] for leg in legs),
+                "geometry": self.padding(query),
+                "legs": [{"distance": leg[0], "duration": leg[1]}
+                         for leg in legs]
+            }]
+        }
+
+    def osrm_table(self, path, query, body):
+        points = [tuple(map(float, point.split(",")))
+                  for point in path.split("/")[-1].split(";")]
+        sources = [int(i) for i in query["sources"][0].split(";")]
+        destinations = [int(i) for i in query["destinations"][0].split(";")]
+        cells = [[route_length(points[i], points[j]) for j in destinations]
+                 for i in sources]
+        return {
+            "code": "Ok",
+            "durations": [[cell[1] for cell in row] for row in cells],
+            "distances": [[cell[0] for cell in row] for row in cells]
+        }
+
+    def otp_plan(self, path, query, body):
+        (from_lat, from_long) = map(float, query["fromPlace"][0].split(","))
+        (to_lat, to_long) = map(float, query["toPlace"][0].split(","))
+        (distance, duration) = route_length((from_long, from_lat),
+                                            (to_long, to_lat))
+
+        # Vehicles leave every OTP_HEADWAY seconds; the requested date and
+        # time are in this machine's time zone
+        if ("date" in query and "time" in query):
+            departure = datetime.datetime.strptime(
+                "%s %s" % (query["date"][0], query["time"][0]),
+                "%Y-%m-%d %H:%M"
+            ).timestamp()
+        else:
+            departure = time.time()
+        first = math.ceil(departure / OTP_HEADWAY) * OTP_HEADWAY
+        count = int(query.get("numItineraries", ["3"])[0])
+        window = query.get("searchWindow")
+
+        itineraries = []
+        for i in range(count):
+            start = first + i * OTP_HEADWAY
+            if (window is not None and start > departure + int(window[0])):
+                break
+            itineraries.append({
+                "duration": duration,
+                "startTime": start * 1000,
+                "endTime": (start + duration) * 1000,
+                "legs": [{"distance": distance / 2, "transitLeg": True,
+                          "legGeometry": self.padding(query)},
+                         {"distance": distance / 2}]
+            })
+
+        return {"plan": {"itineraries": itineraries}}
+
+    def otp_isochrone(self, path, query, body):
+        (lat, long) = map(float, query["fromPlace"][0].split(","))
+
+        # Like OTP, one MultiPolygon feature per cutoff, largest first
+        features = []
+        for cutoff in sorted(map(int, query.get("cutoffSec", [])),
+                             reverse = True):
+            radius = isochrone_radius(cutoff)
+            ring = [[long - radius, lat - radius],
+                    [long + radius, lat - radius],
+                    [long + radius, lat + radius],
+                    [long - radius, lat + radius],
+                    [long - radius, lat - radius]]
+            features.append({
+                "type": "Feature",
+                "properties": {"time": cutoff},
+                "geometry": {"type": "MultiPolygon",
+                             "coordinates": [[ring]] if radius > 0 else []}
+            })
+
+        return {"type": "FeatureCollection", "features": features}
+
+    def valhalla_route(self, path, query, body):
+        points = [(location["lon"], location["lat"])
+                  for location in body["locations"]]
+        legs = [route_length(points[i], points[i + 1])
+                for i in range(len(points) - 1)]
+        lean = (body.get("directions_options", {}).get("directions_type")
+                == "none")
+        return {
+            "trip": {
+                "legs": [{"summary": {"length": leg[0] / 1000,
+                                      "time": leg[1]},
+                          "shape": "" if lean else "x" * RESPONSE_PADDING}
+                         for leg in legs],
+                "summary": {"length": sum(leg[0] for leg in legs) / 1000,
+                            "time": sum(leg[1] for leg in legs)}
+            }
+        }
+
+    def valhalla_sources_to_targets(self, path, query, body):
+        return {
+            "sources_to_targets": [
+                [
+                    {
+                        "from_index": i,
+                        "to_index": j,
+                        "distance": route_length(
+                            (source["lon"], source["lat"]),
+                            (target["lon"], target["lat"])
+                        )[0] / 1000,
+                        "time": route_length(
+                            (source["lon"], source["lat"]),
+                            (target["lon"], target["lat"])
+                        )[1]
+                    }
+                    for (j, target) in enumerate(body["targets"])
+                ]
+                for (i, source) in enumerate(body["sources"])
+            ]
+        }
+
+    def graphhopper_route(self, path, query, body):
+        points = [tuple(reversed([float(x) for x in point.split(",")]))
+                  for point in query["point"]]
+        legs = [route_length(points[i], points[i + 1])
+                for i in range(len(points) - 1)]
+        path = {
+            "distance": sum(leg[0] for leg in legs),
+            "time": sum(leg[1] for leg in legs) * 1000,
+            "points": self.padding(query)
+        }
+        details = query.get("details", [])
+        if ("leg_distance" in details):
+            path.setdefault("details", {})["leg_distance"] = [
+                [i, i + 1, leg[0]] for (i, leg) in enumerate(legs)
+            ]
+        if ("leg_time" in details):
+            path.setdefault("details", {})["leg_time"] = [
+                [i, i + 1, leg[1] * 1000] for (i, leg) in enumerate(legs)
+            ]
+        return {"paths": [path]}
+
+    def graphhopper_matrix(self, path, query, body):
+        # GET requests take lat,long strings; POST requests [long, lat] lists
+        if (body is not None):
+            origins = [tuple(point) for point in body["from_points"]]
+            destinations = [tuple(point) for point in body["to_points"]]
+        else:
+            origins = [tuple(reversed([float(x) for x in point.split(",")]))
+                       for point in query["from_point"]]
+            destinations = [
+                tuple(reversed([float(x) for x in point.split(",")]))
+                for point in query["to_point"]
+            ]
+        cells = [[route_length(origin, destination)
+                  for destination in destinations] for origin in origins]
+        return {
+            "times": [[round(cell[1]) for cell in row] for row in cells],
+            "distances": [[round(cell[0]) for cell in row] for row in cells]
+        }
+
+class StubServer(http.server.ThreadingHTTPServer):
+    """ A local server imitating one backend, in a background thread
+
+    Routes are straight lines lengthened by DETOUR_FACTOR and travelled at
+    SPEED, so results are deterministic.
+
+    Attributes:
+        backend: One of BACKENDS.
+        latency: The number of seconds every request is delayed by.
+        error_rate: The fraction of requests answered with HTTP 503.
+        requests: The number of requests received.
+        entrypoint: The "host:port" of the server.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, backend, latency = 0, error_rate = 0, seed = 0):
+        """ Initializes the StubServer class and starts serving
+
+        Args:
+            backend: One of BACKENDS.
+            latency: The number of seconds to delay every request by.
+            error_rate: The fraction of requests to fail.
+            seed: The seed of the random number generator that picks which
+                requests fail.
+        """
+
+        if (backend not in BACKENDS):
+            raise ValueError("Unknown backend: %s" % backend)
+
+        http.server.ThreadingHTTPServer.__init__(self, ("127.0.0.1", 0),
+                                                 StubHandler)
+        self.backend = backend
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.entrypoint = "127.0.0.1:%d" % self.server_address[1]
+
+        self.thread = threading.Thread(target = self.serve_forever,
+                                       daemon = True)
+        self.thread.start()
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def should_fail(self):
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def close(self):
+        """ Stops the server """
+
+        self.shutdown()
+        self.server_close()
@@ -1,2 +1,75 @@
-from .distances import *
-from .staticmaps import *
+from .backends import (available_backends, get_backend, get_backend_class,
+                       register_backend)
+
+# Public names, and the submodule each is imported from on first access, so
+# that importing the package does not import googlemaps, numpy, requests or
+# shapely until a backend or class that needs them is used
+_EXPORTS = {
+    "Accessibility": "accessibility",
+    "AccessibilityEngine": "accessibility",
+    "RouteCache": "cache",
+    "DEFAULT_ENTRYPOINT": "distances",
+    "DEFAULT_GRAPHHOPPER_MAX_MATRIX_LOCATIONS": "distances",
+    "DEFAULT_MAX_SPEEDS": "distances",
+    "DEFAULT_MAX_URL_LENGTH": "distances",
+    "DEFAULT_NEAREST_BATCH_SIZE": "distances",
+    "DEFAULT_OSRM_MAX_TABLE_SIZE": "distances",
+    "DEFAULT_OSRM_MAX_VIAROUTE_SIZE": "distances",
+    "DEFAULT_POOL_CONNECTIONS": "distances",
+    "DEFAULT_POOL_MAXSIZE": "distances",
+    "DEFAULT_SWEEP_ITINERARIES": "distances",
+    "DEFAULT_SWEEP_STEP": "distances",
+    "DEFAULT_TIMEOUT": "distances",
+    "DEFAULT_VALHALLA_MAX_LOCATIONS": "distances",
+    "DEFAULT_VALHALLA_MAX_MATRIX_LOCATIONS": "distances",
+    "DEFAULT_VALHALLA_MAX_MATRIX_LOCATION_PAIRS": "distances",
+    "DEFAULT_WORKERS": "distances",
+    "Distances": "distances",
+    "EARTH_RADIUS": "distances",
+    "GOOGLE_MAX_DESTINATIONS": "distances",
+    "GOOGLE_MAX_ELEMENTS": "distances",
+    "GOOGLE_MAX_ORIGINS": "distances",
+    "GoogleMapsDistances": "distances",
+    "GraphHopperDistances": "distances",
+    "MAX_ATTEMPTS": "distances",
+    "OSRMDistances": "distances",
+    "OTPDistances": "distances",
+    "ResponseText": "distances",
+    "ValhallaDistances": "distances",
+    "haversine": "distances",
+    "json_loads": "distances",
+    "logger": "distances",
+    "matrix_tile_shape": "distances",
+    "matrix_tiles": "distances",
+    "EntrypointPool": "entrypoints",
+    "Isochrones": "isochrones",
+    "MatrixStore": "matrixstore",
+    "Hooks": "metrics",
+    "Metrics": "metrics",
+    "DepartureProfiles": "profiles",
+    "RateLimiter": "ratelimit",
+    "RouteRecord": "records",
+    "RouteRecords": "records",
+    "CircuitBreaker": "retry",
+    "CircuitOpenError": "retry",
+    "RetryPolicy": "retry",
+    "Constructor": "staticmaps"
+}
+
+__all__ = sorted(list(_EXPORTS) + ["available_backends", "get_backend",
+                                   "get_backend_class", "register_backend"])
+
+def __getattr__(name):
+    if (name not in _EXPORTS):
+        raise AttributeError("module %r has no attribute %r" % (__name__,
+                                                                name))
+
+    import importlib
+
+    value = getattr(importlib.import_module("." + _EXPORTS[name], __name__),
+                    name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# Command line entry point: python -m route_distances INPUT OUTPUT ...
+
+import argparse
+import datetime
+import logging
+
+try:
+    from . import backends
+    from . import cache
+    from . import distances
+    from . import jobs
+except:
+    import backends
+    import cache
+    import distances
+    import jobs
+
+def parse_args(argv = None):
+    """ Parses command line arguments
+
+    Args:
+        argv: A list of arguments, or None to use sys.argv.
+
+    Returns:
+        An argparse.Namespace object.
+    """
+
+    parser = argparse.ArgumentParser(
+        prog = "route_distances",
+        description = "Route every origin-destination pair in a CSV or JSON "
+                      "Lines file, writing results incrementally. Rerunning "
+                      "an interrupted job resumes after its last checkpoint."
+    )
+    parser.add_argument("input",
+                        help = "CSV or JSON Lines file with orig_long, "
+                               "orig_lat, dest_long, dest_lat and optionally "
+                               "id fields")
+    parser.add_argument("output", help = "CSV or JSON Lines file to write")
+    parser.add_argument("--backend", default = "osrm",
+                        choices = backends.available_backends())
+    parser.add_argument("--entrypoint", default = distances.DEFAULT_ENTRYPOINT,
+                        help = "host:port of a self-hosted backend, or a "
+                               "comma-separated list of replicas to spread "
+                               "requests across")
+    parser.add_argument("--api-key", help = "Google Maps API key")
+    parser.add_argument("--client-id", help = "Google Maps client ID")
+    parser.add_argument("--client-secret", help = "Google Maps client secret")
+    parser.add_argument("--mode", default = "walk",
+                        choices = ["bike", "drive", "transit", "walk"])
+    parser.add_argument("--departure-time",
+                        type = datetime.datetime.fromisoformat,
+                        help = "ISO 8601 departure time, for backends that "
+                               "support it")
+    parser.add_argument("--workers", type = int,
+                        default = distances.DEFAULT_WORKERS,
+                        help = "number of pairs to route concurrently")
+    parser.add_argument("--checkpoint-every", type = int,
+                        default = jobs.DEFAULT_CHECKPOINT_EVERY,
+                        help = "number of pairs between checkpoints")
+    parser.add_argument("--input-format", choices = ["csv", "jsonl"])
+    parser.add_argument("--output-format", choices = ["csv", "jsonl"])
+    parser.add_argument("--cache", metavar = "PATH",
+                        help = "SQLite file to cache results in")
+    parser.add_argument("--timeout", type = float,
+                        default = distances.DEFAULT_TIMEOUT)
+    parser.add_argument("--verbose", action = "store_true")
+
+    return parser.parse_args(argv)
+
+def build_calculator(args):
+    """ Builds the Distances instance described by command line arguments
+
+    Args:
+        args: An argparse.Namespace object returned by parse_args.
+
+    Returns:
+        An instance of a Distances subclass.
+    """
+
+    backend_kwargs = {
+        "timeout": args.timeout,
+        "verbose": args.verbose,
+        "fail_fast": True,
+        "pool_maxsize": max(args.workers, distances.DEFAULT_POOL_MAXSIZE)
+    }
+    if (args.cache):
+        backend_kwargs["cache"] = cache.RouteCache(args.cache)
+
+    if (args.backend == "google"):
+        return backends.get_backend(
+            "google",
+            api_key = args.api_key,
+            client_id = args.client_id,
+            client_secret = args.client_secret,
+            **backend_kwargs
+        )
+
+    entrypoint = args.entrypoint
+    if ("," in entrypoint):
+        entrypoint = [replica.strip() for replica in entrypoint.split(",")]
+
+    return backends.get_backend(args.backend, entrypoint,
+                                **backend_kwargs)
+
+def main(argv = None):
+    """ Runs a job described by command line arguments
+
+    Args:
+        argv: A list of arguments, or None to use sys.argv.
+    """
+
+    args = parse_args(argv)
+    if (args.verbose):
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        distances.logger.addHandler(handler)
+        distances.logger.setLevel(logging.DEBUG)
+    calculator = build_calculator(args)
+
+    route_kwargs = {}
+    if (args.departure_time):
+        route_kwargs["departure_time"] = args.departure_time
+
+    try:
+        jobs.run_job(
+            calculator, args.input, args.output,
+            mode = args.mode,
+            workers = args.workers,
+            checkpoint_every = args.checkpoint_every,
+            input_format = args.input_format,
+            output_format = args.output_format,
+            log = print,
+            **route_kwargs
+        )
+    finally:
+        calculator.close()
+
+if (__name__ == "__main__"):
+    main()
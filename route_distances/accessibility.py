@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# Which destinations are reachable from each of many origins, from isochrones
+
+import collections
+import concurrent.futures
+import logging
+
+import numpy
+import shapely
+
+try:
+    from . import distances
+    from . import isochrones
+except:
+    import distances
+    import isochrones
+
+logger = logging.getLogger("route_distances")
+
+class Accessibility(object):
+    """ Sparse origin to reachable destinations result
+
+    The result is stored like a compressed sparse row matrix with one row per
+    origin: the destinations reachable from origin i are
+    indices[indptr[i]:indptr[i + 1]], in increasing order, and times holds the
+    smallest cutoff each of them is within.
+
+    Attributes:
+        origins: A numpy array of (long, lat) origins, with shape (n, 2).
+        cutoffs: The sorted list of cutoffs, in seconds.
+        num_destinations: The number of destinations.
+        indptr: A numpy array of n + 1 offsets into indices and times.
+        indices: A numpy array of destination indices.
+        times: A numpy array of cutoffs, in seconds.
+        errors: A dictionary mapping the indices of origins whose isochrones
+            could not be generated to the exception raised, or None if the
+            backend returned no isochrones. These origins reach nothing.
+    """
+
+    def __init__(self, origins, cutoffs, num_destinations, indptr, indices,
+                 times, errors = None):
+        self.origins = origins
+        self.cutoffs = cutoffs
+        self.num_destinations = num_destinations
+        self.indptr = indptr
+        self.indices = indices
+        self.times = times
+        self.errors = errors if errors is not None else {}
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __getitem__(self, origin):
+        """ Returns the (indices, times) of the destinations an origin reaches
+        """
+
+        (start, end) = (self.indptr[origin], self.indptr[origin + 1])
+        return (self.indices[start:end], self.times[start:end])
+
+    def counts(self, cutoff = None):
+        """ Counts the destinations reachable from each origin
+
+        Args:
+            cutoff: A cutoff, in seconds, or None to use the largest cutoff.
+
+        Returns:
+            A numpy array with one count per origin.
+        """
+
+        if (cutoff is None):
+            return numpy.diff(self.indptr)
+
+        rows = numpy.repeat(numpy.arange(len(self)), numpy.diff(self.indptr))
+        return numpy.bincount(rows[self.times <= cutoff],
+                              minlength = len(self))
+
+    def to_scipy(self):
+        """ Returns the result as a scipy.sparse.csr_matrix of times
+
+        Requires scipy.
+        """
+
+        from scipy import sparse
+
+        return sparse.csr_matrix((self.times, self.indices, self.indptr),
+                                 shape = (len(self), self.num_destinations))
+
+class AccessibilityEngine(object):
+    """ Finds the destinations reachable from many origins using isochrones
+
+    The destinations are indexed once in a shapely STRtree. For each origin,
+    isochrones for every cutoff are generated with a single request to the
+    calculator, and all of them are queried against the tree at once.
+
+    Attributes:
+        calculator: An OTPDistances instance, or any object with a compatible
+            isochrones method.
+        destinations: A numpy array of (long, lat) destinations, with shape
+            (n, 2).
+        tree: A shapely.STRtree of the destination points.
+        cache: A cache.RouteCache object isochrones are cached in, or None.
+    """
+
+    def __init__(self, calculator, destinations, cache = None):
+        """ Initializes the AccessibilityEngine class
+
+        Args:
+            calculator: An OTPDistances instance.
+            destinations: An array-like of (long, lat) pairs.
+            cache: A cache.RouteCache object to cache isochrones in, so
+                repeated runs over the same origins do not regenerate them.
+                It may be the calculator's own cache.
+        """
+
+        self.calculator = calculator
+        self.destinations = numpy.asarray(destinations,
+                                          dtype = float).reshape(-1, 2)
+        self.tree = shapely.STRtree(shapely.points(self.destinations))
+        self.cache = cache
+
+    def isochrones(self, origin, cutoffs, mode = "walk",
+                   departure_time = None):
+        """ Generates, or looks up in self.cache, the isochrones of an origin
+
+        Args:
+            origin: A (long, lat) pair.
+            cutoffs: A sorted list of cutoffs, in seconds.
+            mode: A key of the calculator's mode_map.
+            departure_time: A datetime.datetime object, or None.
+
+        Returns:
+            An isochrones.Isochrones object, or False if there are errors.
+        """
+
+        key = None
+        if (self.cache is not None):
+            key = self.cache.key(
+                "%s.isochrones" % type(self.calculator).__name__,
+                getattr(self.calculator, "entrypoint", None), mode, origin,
+                departure_time, {"cutoffs": cutoffs}
+            )
+            features = self.cache.get(key)
+            if (features is not None):
+                return isochrones.Isochrones.from_geojson(origin, features,
+                                                          cutoffs)
+
+        result = self.calculator.isochrones(origin[0], origin[1], cutoffs,
+                                            mode = mode,
+                                            departure_time = departure_time)
+
+        if (result and key is not None):
+            self.cache.put(key, result.to_geojson(), raw = True)
+
+        return result
+
+    def reachable(self, bands):
+        """ Finds the destinations within a set of isochrones
+
+        Args:
+            bands: An isochrones.Isochrones object.
+
+        Returns:
+            A tuple of numpy arrays (indices, times): the indices of the
+                reachable destinations in increasing order, and the smallest
+                cutoff each is within.
+        """
+
+        (band, destination) = self.tree.query(bands.geometries,
+                                              predicate = "contains")
+        times = numpy.asarray(bands.cutoffs, dtype = float)[band]
+
+        # Keep the smallest cutoff of each destination found in several bands
+        order = numpy.lexsort((times, destination))
+        destination = destination[order]
+        times = times[order]
+        first = numpy.ones(len(destination), dtype = bool)
+        first[1:] = destination[1:] != destination[:-1]
+
+        return (destination[first], times[first])
+
+    def _origin_item(self, origin, cutoffs, mode, departure_time):
+        """ Returns reachable destinations of an origin, or the exception or
+        False it failed with """
+
+        try:
+            bands = self.isochrones(origin, cutoffs, mode, departure_time)
+        except Exception as error:
+            logger.warning("Isochrones from %s failed: %r", origin, error)
+            return error
+
+        if (not bands):
+            return False
+        return self.reachable(bands)
+
+    def run(self, origins, cutoffs, mode = "walk", departure_time = None,
+            workers = distances.DEFAULT_WORKERS):
+        """ Finds the destinations reachable from every origin
+
+        Isochrones are generated concurrently on a thread pool and discarded
+        once the destinations within them are found, so only the sparse
+        result is kept in memory.
+
+        Args:
+            origins: An iterable of (long, lat) pairs.
+            cutoffs: An iterable of travel times, in seconds.
+            mode: A key of the calculator's mode_map.
+            departure_time: A datetime.datetime object, or None.
+            workers: The number of isochrone requests to make concurrently.
+
+        Returns:
+            An Accessibility object.
+        """
+
+        origins = numpy.asarray(origins, dtype = float).reshape(-1, 2)
+        cutoffs = sorted(set(int(cutoff) for cutoff in cutoffs))
+
+        indptr = numpy.zeros(len(origins) + 1, dtype = numpy.int64)
+        indices = []
+        times = []
+        errors = {}
+
+        def collect(index, result):
+            if (isinstance(result, tuple)):
+                indices.append(result[0])
+                times.append(result[1])
+                indptr[index + 1] = len(result[0])
+            else:
+                errors[index] = result if result is not False else None
+
+        pending = collections.deque()
+
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            for (index, origin) in enumerate(origins):
+                pending.append((index, executor.submit(
+                    self._origin_item, tuple(origin), cutoffs, mode,
+                    departure_time
+                )))
+                if (len(pending) >= workers * 2):
+                    (done, future) = pending.popleft()
+                    collect(done, future.result())
+
+            while (len(pending) > 0):
+                (done, future) = pending.popleft()
+                collect(done, future.result())
+
+        numpy.cumsum(indptr, out = indptr)
+
+        return Accessibility(
+            origins, cutoffs, len(self.destinations), indptr,
+            numpy.concatenate(indices) if indices else
+                numpy.zeros(0, dtype = numpy.int64),
+            numpy.concatenate(times) if times else numpy.zeros(0),
+            errors
+        )
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+# asyncio counterparts of the classes for self-hosted backends
+
+import aiohttp
+import asyncio
+import collections
+import functools
+import inspect
+import time
+
+try:
+    from . import distances
+    from . import metrics
+    from . import records
+    from . import retry
+except:
+    import distances
+    import metrics
+    import records
+    import retry
+
+# Default maximum number of requests an instance keeps in flight at once
+DEFAULT_MAX_IN_FLIGHT = 100
+
+class AsyncDistances():
+    """ Mixin that makes a Distances subclass route with asyncio
+
+    When mixed in ahead of a Distances subclass that implements
+    build_route_request and parse_route_response, route, distance, route_chain,
+    nearest and the batch methods become coroutines. They send the same
+    requests and parse the responses the same way as the blocking class, but
+    through an aiohttp.ClientSession. All other methods, such as matrix, are
+    inherited unchanged and still block.
+
+    Attributes:
+        max_in_flight: The maximum number of requests this instance keeps in
+            flight at once. Further requests wait for one to finish.
+        client_session: The aiohttp.ClientSession requests are sent through.
+            It is created on first use, inside the running event loop.
+    """
+
+    def __init__(self, *args, max_in_flight = DEFAULT_MAX_IN_FLIGHT,
+                 **kwargs):
+        """ Initializes the AsyncDistances mixin and the class it is mixed into
+
+        Args:
+            max_in_flight: The maximum number of requests to keep in flight at
+                once.
+        """
+
+        super().__init__(*args, **kwargs)
+        self.max_in_flight = max_in_flight
+        self._client_session = None
+        self._in_flight = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @property
+    def client_session(self):
+        """ The aiohttp.ClientSession used to send requests """
+
+        if (self._client_session is None or self._client_session.closed):
+            self._client_session = aiohttp.ClientSession(
+                connector = aiohttp.TCPConnector(limit = self.max_in_flight),
+                timeout = aiohttp.ClientTimeout(total = self.timeout)
+            )
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        return self._client_session
+
+    async def close(self):
+        """ Closes all connections held by this instance """
+
+        if (self._client_session is not None):
+            await self._client_session.close()
+        distances.Distances.close(self)
+
+    async def send_route_request(self, request, parse = None):
+        """ Sends a request built by self.build_route_request
+
+        Args:
+            request: A (method, url, request_json) tuple, with request_json
+                being None for requests without a JSON body.
+            parse: The function to parse the response with, taking the status
+                code and body, or None for self.parse_route_response.
+
+        Returns:
+            The result of parse for the response.
+
+        Raises:
+            aiohttp.ClientResponseError: The response's status code is one of
+                retry.RETRYABLE_STATUS_CODES.
+        """
+
+        (method, url, request_json) = request
+        client_session = self.client_session
+
+        if (request_json is None):
+            self.log("Sending request: %s", url)
+        else:
+            self.log("Sending request JSON to %s: %s", url, request_json)
+        pool = self.entrypoint_pool
+        tried = []
+
+        # As in Distances.http_request, a request that fails on one replica
+        # of a pool is moved to the next before self.distance retries it
+        while (True):
+            replica = pool.acquire(tried) if pool is not None else None
+            target = self.replica_url(url, replica)
+            # As in Distances.http_request, left as None if the request is
+            # abandoned, e.g. cancelled, for reasons unrelated to the replica
+            success = None
+            start = time.perf_counter()
+            try:
+                async with self._in_flight:
+                    start = time.perf_counter()
+                    async with client_session.request(
+                            method, target, json = request_json) as response:
+                        data = await response.read()
+                    self.emit("request", metrics.endpoint_label(target),
+                              response.status, time.perf_counter() - start)
+                failed = response.status in retry.RETRYABLE_STATUS_CODES
+                success = not failed
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                self.emit("request", metrics.endpoint_label(target), None,
+                          time.perf_counter() - start)
+                success = False
+                if (pool is None):
+                    raise
+                tried.append(replica)
+                if (len(tried) >= len(pool)):
+                    raise
+                continue
+            except aiohttp.ClientError:
+                success = False
+                raise
+            finally:
+                if (pool is not None):
+                    pool.release(replica, success)
+
+            self.log("Response: %s", distances.ResponseText(data))
+            if (pool is None):
+                break
+            tried.append(replica)
+            if (not failed or len(tried) >= len(pool)):
+                break
+
+        # Let self.distance retry responses from an overloaded backend
+        if (failed):
+            response.raise_for_status()
+
+        return (parse or self.parse_route_response)(response.status, data)
+
+    async def route(self, *args, **kwargs):
+        """ Routes the distance between two coordinates
+
+        Args:
+            The same as the route method of the class this is mixed into.
+
+        Returns:
+            The same as the route method of the class this is mixed into.
+        """
+
+        return await self.send_route_request(
+            self.build_route_request(*args, **kwargs)
+        )
+
+    def route_arguments(self, *args, **kwargs):
+        """ Matches arguments of self.route to its parameters
+
+        self.route only forwards its arguments to self.build_route_request, so
+        they are matched to the parameters of that instead.
+        """
+
+        arguments = inspect.signature(self.build_route_request).bind(*args,
+                                                                     **kwargs)
+        arguments.apply_defaults()
+        return dict(arguments.arguments)
+
+    async def distance(self, *args, **kwargs):
+        """ Frontend function for self.route
+
+        The asyncio counterpart of Distances.distance, retrying and caching
+        the same way but without blocking the event loop between retries.
+        """
+
+        exception = None
+        mode = None
+        if (self.hooks):
+            mode = self.route_arguments(*args, **kwargs).get("mode")
+
+        if (self.cache is not None):
+            key = self.cache_key(*args, **kwargs)
+            result = self.cache.get(key)
+            self.emit("cache", result is not None)
+            if (result is not None):
+                return result
+
+        for attempt in range(self.retry_policy.max_attempts):
+            start = time.perf_counter()
+            try:
+                if (attempt > 0):
+                    self.log("Retrying (attempt %d)", attempt + 1)
+                self.circuit_breaker.before_request()
+                result = await self.route(*args, **kwargs)
+                self.circuit_breaker.record_success()
+                self.emit("route", mode, "ok" if result else "no_route",
+                          time.perf_counter() - start)
+                # False may be a transient error answered as no route, so it
+                # is not cached
+                if (self.cache is not None and result):
+                    self.cache.put(key, result)
+                return result
+            except Exception as error:
+                exception = error
+                self.emit("route", mode, "error", time.perf_counter() - start)
+                delay = self.attempt_failed(error, attempt)
+                if (delay is None):
+                    break
+                self.emit("retry", mode, attempt, error, delay)
+                await asyncio.sleep(delay)
+
+        self.emit("failure", mode, exception)
+
+        if (self.fail_fast):
+            raise exception
+        else:
+            return False
+
+    async def call_with_retries(self, hook_mode, function, *args,
+                                **kwargs):
+        """ Awaits a coroutine function that sends requests, retrying it
+
+        The asyncio counterpart of Distances.call_with_retries.
+        """
+
+        for attempt in range(self.retry_policy.max_attempts):
+            start = time.perf_counter()
+            try:
+                if (attempt > 0):
+                    self.log("Retrying (attempt %d)", attempt + 1)
+                self.circuit_breaker.before_request()
+                result = await function(*args, **kwargs)
+                self.circuit_breaker.record_success()
+                self.emit("route", hook_mode, "ok" if result else "no_route",
+                          time.perf_counter() - start)
+                return result
+            except Exception as error:
+                self.emit("route", hook_mode, "error",
+                          time.perf_counter() - start)
+                delay = self.attempt_failed(error, attempt)
+                if (delay is None):
+                    self.emit("failure", hook_mode, error)
+                    raise
+                self.emit("retry", hook_mode, attempt, error, delay)
+                await asyncio.sleep(delay)
+
+    async def route_chain(self, points, mode = "walk", **kwargs):
+        """ Routes an ordered chain of stops, leg by leg
+
+        The asyncio counterpart of Distances.route_chain, sending the
+        requests for every run of points concurrently.
+
+        Args:
+            See Distances.route_chain, except for workers.
+
+        Returns:
+            See Distances.route_chain.
+        """
+
+        points = [tuple(point) for point in points]
+        if (len(points) < 2):
+            raise ValueError("A chain needs at least two points")
+
+        if (not hasattr(self, "build_chain_request")):
+            results = await self.distance_batch(
+                [points[i] + points[i + 1] for i in range(len(points) - 1)],
+                mode = mode, **kwargs
+            )
+            if (not all(results)):
+                return False
+            return self.chain_result([(result["distance"], result["duration"])
+                                      for result in results])
+
+        slices = self.chain_slices(points, mode)
+        results = await asyncio.gather(*[
+            self.call_with_retries(
+                mode, self.send_route_request,
+                self.build_chain_request(points[start:end + 1], mode,
+                                         **kwargs),
+                self.parse_chain_response
+            )
+            for (start, end) in slices
+        ])
+
+        legs = []
+        for ((start, end), slice_legs) in zip(slices, results):
+            if (not slice_legs):
+                return False
+            if (len(slice_legs) != end - start):
+                distances.logger.warning(
+                    "Expected %d legs from the backend, got %d", end - start,
+                    len(slice_legs)
+                )
+                return False
+            legs.extend(slice_legs)
+
+        return self.chain_result(legs)
+
+    async def nearest(self, orig_long, orig_lat, candidates, k = 1,
+                      mode = "walk", by = "duration", max_speed = None,
+                      batch_size = distances.DEFAULT_NEAREST_BATCH_SIZE,
+                      **kwargs):
+        """ Finds the k candidates with the shortest routes from an origin
+
+        The asyncio counterpart of Distances.nearest. Backends with a matrix
+        method are routed with it in the event loop's default executor, as it
+        blocks; the others are routed with self.distance_batch_iter.
+
+        Args:
+            See Distances.nearest, without workers.
+
+        Returns:
+            See Distances.nearest.
+        """
+
+        rounds = self._nearest_rounds(orig_long, orig_lat, candidates, k,
+                                      mode, by, max_speed, batch_size)
+        try:
+            destinations = next(rounds)
+            while (True):
+                if (hasattr(self, "matrix")):
+                    results = await asyncio.get_running_loop() \
+                        .run_in_executor(None, functools.partial(
+                            self._nearest_routes, orig_long, orig_lat,
+                            destinations, mode, None, kwargs
+                        ))
+                else:
+                    results = [result async for result in
+                               self.distance_batch_iter(
+                                   [(orig_long, orig_lat) + destination
+                                    for destination in destinations],
+                                   mode = mode, **kwargs
+                               )]
+                destinations = rounds.send(results)
+        except StopIteration as stop:
+            return stop.value
+
+    async def _distance_item(self, pair, mode, return_exceptions, kwargs):
+        """ Routes one pair of a batch without letting its errors escape """
+
+        try:
+            return await self.distance(*pair, mode = mode, **kwargs)
+        except Exception as error:
+            self.log("Failed to route %s: %s", pair, error)
+            if (return_exceptions):
+                return error
+            return False
+
+    async def distance_batch_iter(self, pairs, mode = "walk",
+                                  return_exceptions = False, **kwargs):
+        """ Routes many pairs of coordinates concurrently, yielding in order
+
+        The asyncio counterpart of Distances.distance_batch_iter. Concurrency
+        is bounded by self.max_in_flight rather than by a number of workers.
+
+        Args:
+            See Distances.distance_batch_iter.
+
+        Yields:
+            The result of self.distance for each pair, in the order of pairs.
+        """
+
+        pending = collections.deque()
+
+        try:
+            for pair in pairs:
+                pending.append(asyncio.ensure_future(self._distance_item(
+                    pair, mode, return_exceptions, kwargs
+                )))
+                if (len(pending) >= self.max_in_flight * 2):
+                    yield await pending.popleft()
+
+            while (len(pending) > 0):
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def distance_batch(self, pairs, mode = "walk",
+                             return_exceptions = False, **kwargs):
+        """ Routes many pairs of coordinates concurrently
+
+        Args:
+            See Distances.distance_batch_iter.
+
+        Returns:
+            See Distances.distance_batch.
+        """
+
+        if (self.lean):
+            return records.RouteRecords([
+                result async for result in self.distance_batch_iter(
+                    pairs, mode = mode, return_exceptions = return_exceptions,
+                    **kwargs
+                )
+            ])
+
+        return [
+            result async for result in self.distance_batch_iter(
+                pairs, mode = mode, return_exceptions = return_exceptions,
+                **kwargs
+            )
+        ]
+
+class AsyncOTPDistances(AsyncDistances, distances.OTPDistances):
+    """ OTPDistances with asyncio route, distance and batch methods """
+
+class AsyncOSRMDistances(AsyncDistances, distances.OSRMDistances):
+    """ OSRMDistances with asyncio route, distance and batch methods """
+
+class AsyncValhallaDistances(AsyncDistances, distances.ValhallaDistances):
+    """ ValhallaDistances with asyncio route, distance and batch methods """
+
+class AsyncGraphHopperDistances(AsyncDistances,
+                                distances.GraphHopperDistances):
+    """ GraphHopperDistances with asyncio route, distance and batch methods """
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# Registry of backend classes, imported only when a backend is first used
+
+import importlib
+import importlib.metadata
+import threading
+
+# Entry point group third-party packages register backends under, e.g. in
+# setup.py: entry_points = {"route_distances.backends":
+# ["mybackend = mypackage.module:MyDistances"]}
+ENTRY_POINT_GROUP = "route_distances.backends"
+
+# Built-in backends, as "module:class" strings relative to this package
+BUILTIN_BACKENDS = {
+    "google": ".distances:GoogleMapsDistances",
+    "graphhopper": ".distances:GraphHopperDistances",
+    "osrm": ".distances:OSRMDistances",
+    "otp": ".distances:OTPDistances",
+    "valhalla": ".distances:ValhallaDistances"
+}
+
+# Backends by name: a class once loaded, otherwise a "module:class" string or
+# an importlib.metadata.EntryPoint
+_registry = dict(BUILTIN_BACKENDS)
+_lock = threading.Lock()
+_entry_points_loaded = False
+
+def _load_entry_points():
+    """ Adds backends registered under ENTRY_POINT_GROUP to the registry
+
+    Only the entry points' names are read; the modules they point to are
+    imported when the backend is first requested. Backends registered with
+    register_backend take precedence over entry points of the same name.
+    """
+
+    global _entry_points_loaded
+
+    if (_entry_points_loaded):
+        return
+
+    try:
+        entry_points = importlib.metadata.entry_points(
+            group = ENTRY_POINT_GROUP
+        )
+    except TypeError:
+        # Before Python 3.10, entry_points takes no arguments and returns a
+        # dictionary of groups
+        entry_points = importlib.metadata.entry_points().get(
+            ENTRY_POINT_GROUP, []
+        )
+
+    for entry_point in entry_points:
+        _registry.setdefault(entry_point.name, entry_point)
+    _entry_points_loaded = True
+
+def _resolve(target):
+    """ Imports the class a registry entry points to """
+
+    if (isinstance(target, importlib.metadata.EntryPoint)):
+        return target.load()
+
+    (module, name) = target.split(":")
+    if (module.startswith(".")):
+        if (__package__):
+            module = importlib.import_module(module, __package__)
+        else:
+            # Imported as a top-level module rather than from the package
+            module = importlib.import_module(module[1:])
+    else:
+        module = importlib.import_module(module)
+
+    return getattr(module, name)
+
+def register_backend(name, backend):
+    """ Registers a backend under a name
+
+    Args:
+        name: The name the backend is selected by, e.g. in get_backend and the
+            --backend option of the command line interface.
+        backend: The backend's class, or a "module:class" string naming it so
+            that its module is only imported when the backend is first used.
+    """
+
+    with _lock:
+        _registry[name] = backend
+
+def available_backends():
+    """ Lists the names of every registered backend, without importing any
+
+    Returns:
+        A sorted list of names, including those registered through entry
+            points.
+    """
+
+    with _lock:
+        _load_entry_points()
+        return sorted(_registry)
+
+def get_backend_class(name):
+    """ Returns the class of a backend, importing it on first use
+
+    Args:
+        name: The name of a registered backend.
+
+    Returns:
+        The backend's class, usually a subclass of distances.Distances.
+
+    Raises:
+        ValueError: No backend is registered under name.
+    """
+
+    with _lock:
+        if (name not in _registry):
+            _load_entry_points()
+        if (name not in _registry):
+            raise ValueError("Unknown backend: %s (available: %s)" % (
+                name, ", ".join(sorted(_registry))
+            ))
+
+        backend = _registry[name]
+        if (isinstance(backend, (str, importlib.metadata.EntryPoint))):
+            backend = _registry[name] = _resolve(backend)
+
+    return backend
+
+def get_backend(name, *args, **kwargs):
+    """ Builds an instance of a backend, importing only what it needs
+
+    Args:
+        name: The name of a registered backend, e.g. "osrm".
+        *args: Arguments passed to the backend's class.
+        **kwargs: Keyword arguments passed to the backend's class.
+
+    Returns:
+        An instance of the backend's class.
+
+    Raises:
+        ValueError: No backend is registered under name.
+    """
+
+    return get_backend_class(name)(*args, **kwargs)
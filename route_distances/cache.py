@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# Two-tier cache of route results
+
+import collections
+import json
+import sqlite3
+import threading
+import time
+
+# Default number of results kept in memory
+DEFAULT_MAX_MEMORY_ENTRIES = 100000
+
+# Default number of results kept on disk
+DEFAULT_MAX_DISK_ENTRIES = 10000000
+
+# Default number of decimal places coordinates are rounded to; 5 decimal places
+# is about a meter
+DEFAULT_PRECISION = 5
+
+# Default width, in seconds, of the buckets departure times are grouped into
+DEFAULT_TIME_BUCKET = 300
+
+# Fraction of max_disk_entries evicted at once when the disk tier is full
+DISK_EVICTION_FRACTION = 0.1
+
+class RouteCache(object):
+    """ Caches route results in memory and, optionally, in an SQLite database
+
+    Results are looked up in an in-memory LRU tier first, then in the SQLite
+    tier, and results found on disk are promoted to memory. Only the distance
+    and duration of a result are stored, not the backend's full response.
+
+    Attributes:
+        path: The path of the SQLite database, or None if results are only
+            cached in memory.
+        max_memory_entries: The number of results kept in memory before the
+            least recently used ones are evicted.
+        max_disk_entries: The number of results kept on disk before the least
+            recently used ones are evicted.
+        ttl: The number of seconds a result stays valid, or None if results
+            never expire.
+        precision: The number of decimal places coordinates are rounded to
+            when building keys.
+        time_bucket: The width, in seconds, of the buckets departure times are
+            grouped into when building keys.
+        hits: The number of lookups answered from the cache.
+        misses: The number of lookups not answered from the cache.
+        memory_hits: The number of hits answered from the memory tier.
+        disk_hits: The number of hits answered from the disk tier.
+    """
+
+    def __init__(self, path = None,
+                 max_memory_entries = DEFAULT_MAX_MEMORY_ENTRIES,
+                 max_disk_entries = DEFAULT_MAX_DISK_ENTRIES, ttl = None,
+                 precision = DEFAULT_PRECISION,
+                 time_bucket = DEFAULT_TIME_BUCKET):
+        """ Initializes the RouteCache class
+
+        Args:
+            path: The path of the SQLite database to use as the disk tier. It is
+                created if it does not exist. If None, results are only cached
+                in memory.
+            max_memory_entries: The maximum number of results kept in memory.
+            max_disk_entries: The maximum number of results kept on disk.
+            ttl: The number of seconds a result stays valid, or None.
+            precision: The number of decimal places to round coordinates to.
+            time_bucket: The width, in seconds, of departure time buckets.
+        """
+
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.precision = precision
+        self.time_bucket = time_bucket
+
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+
+        self.lock = threading.Lock()
+        self.memory = collections.OrderedDict()
+        self.connection = None
+
+        if (path is not None):
+            self.connection = sqlite3.connect(path, check_same_thread = False,
+                                              isolation_level = None)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS routes ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS routes_accessed "
+                "ON routes (accessed)"
+            )
+            self.disk_entries = self.connection.execute(
+                "SELECT COUNT(*) FROM routes"
+            ).fetchone()[0]
+
+    def key(self, backend, entrypoint, mode, coords, departure_time = None,
+            extra = None):
+        """ Builds the key a route is cached under
+
+        Args:
+            backend: The name of the backend class.
+            entrypoint: The backend's entrypoint, or None.
+            mode: The mode of transportation.
+            coords: An iterable of coordinates, which are rounded to
+                self.precision decimal places.
+            departure_time: A datetime.datetime object, which is grouped into a
+                bucket self.time_bucket seconds wide, or None.
+            extra: A dictionary of any other arguments that affect the route,
+                or None.
+
+        Returns:
+            A string.
+        """
+
+        if (departure_time):
+            departure_time = int(departure_time.timestamp() // self.time_bucket)
+
+        return "|".join([
+            backend, str(entrypoint), str(mode),
+            ",".join(["%.*f" % (self.precision, coord) for coord in coords]),
+            str(departure_time),
+            json.dumps(extra, sort_keys = True, default = str) if extra else ""
+        ])
+
+    def get(self, key):
+        """ Looks up a cached result
+
+        Args:
+            key: A key built by self.key.
+
+        Returns:
+            The cached result, or None if there is no valid cached result.
+        """
+
+        now = time.time()
+
+        with self.lock:
+            if (key in self.memory):
+                (created, value) = self.memory[key]
+                if (self.ttl is None or now - created < self.ttl):
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return value
+                del self.memory[key]
+
+            if (self.connection is not None):
+                row = self.connection.execute(
+                    "SELECT value, created FROM routes WHERE key = ?", (key,)
+                ).fetchone()
+                if (row is not None):
+                    if (self.ttl is None or now - row[1] < self.ttl):
+                        self.connection.execute(
+                            "UPDATE routes SET accessed = ? WHERE key = ?",
+                            (now, key)
+                        )
+                        value = json.loads(row[0])
+                        self._remember(key, row[1], value)
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return value
+                    self.connection.execute("DELETE FROM routes WHERE key = ?",
+                                            (key,))
+                    self.disk_entries -= 1
+
+            self.misses += 1
+            return None
+
+    def put(self, key, value, raw = False):
+        """ Caches a result
+
+        Args:
+            key: A key built by self.key.
+            value: A result returned by a route method. Its "response" key, if
+                any, is not cached.
+            raw: A boolean that toggles whether value is cached as is instead
+                of as a route result. It must then be JSON serializable.
+        """
+
+        if (value and not raw):
+            value = {
+                "distance": value["distance"],
+                "duration": value["duration"]
+            }
+
+        now = time.time()
+
+        with self.lock:
+            self._remember(key, now, value)
+
+            if (self.connection is not None):
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO routes VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), now, now)
+                )
+                # Replacing a row overcounts; the count is corrected whenever
+                # it triggers an eviction
+                self.disk_entries += 1
+
+                if (self.disk_entries > self.max_disk_entries):
+                    self.connection.execute(
+                        "DELETE FROM routes WHERE key IN (SELECT key FROM "
+                        "routes ORDER BY accessed LIMIT ?)",
+                        (max(1, int(self.max_disk_entries
+                                    * DISK_EVICTION_FRACTION)),)
+                    )
+                    self.disk_entries = self.connection.execute(
+                        "SELECT COUNT(*) FROM routes"
+                    ).fetchone()[0]
+
+    def _remember(self, key, created, value):
+        """ Stores a result in the memory tier; self.lock must be held """
+
+        self.memory[key] = (created, value)
+        self.memory.move_to_end(key)
+        while (len(self.memory) > self.max_memory_entries):
+            self.memory.popitem(last = False)
+
+    def stats(self):
+        """ Returns a dictionary of hit and miss counters """
+
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self.memory)
+            }
+
+    def clear(self):
+        """ Removes every cached result """
+
+        with self.lock:
+            self.memory.clear()
+            if (self.connection is not None):
+                self.connection.execute("DELETE FROM routes")
+                self.disk_entries = 0
+
+    def close(self):
+        """ Closes the SQLite database, if any """
+
+        if (self.connection is not None):
+            self.connection.close()
+            self.connection = None
@@ -1,25 +1,207 @@
 #!/usr/bin/env python3
 
-from shapely import geometry
+import collections
+import concurrent.futures
 import datetime
-import googlemaps
+import inspect
 import json
+import logging
 import requests
+import requests.adapters
+import threading
 import time
 
 try:
+    from . import entrypoints
+    from . import metrics
+    from . import ratelimit
+    from . import records
+    from . import retry
     from . import staticmaps
 except:
+    import entrypoints
+    import metrics
+    import ratelimit
+    import records
+    import retry
     import staticmaps
 
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# Logger that every instance logs requests, responses and retries to
+logger = logging.getLogger("route_distances")
+
 # Default entrypoint to be used for non-Google services when none is defined
 DEFAULT_ENTRYPOINT = "localhost:8000"
 
 # Default timeout
 DEFAULT_TIMEOUT = 30
 
-# Number of attempts to make before abandoning a calculation
-MAX_ATTEMPTS = 5
+# Default number of attempts to make before abandoning a calculation
+MAX_ATTEMPTS = retry.DEFAULT_MAX_ATTEMPTS
+
+# Default number of worker threads used by Distances.distance_batch
+DEFAULT_WORKERS = 8
+
+# Default number of per-host connection pools kept by an instance's transport
+DEFAULT_POOL_CONNECTIONS = 10
+
+# Default maximum number of keep-alive connections kept open to a single host
+DEFAULT_POOL_MAXSIZE = 10
+
+# Default URL length limit for GET requests sent to self-hosted backends
+DEFAULT_MAX_URL_LENGTH = 8192
+
+# Default value of osrm-routed's --max-table-size option
+DEFAULT_OSRM_MAX_TABLE_SIZE = 100
+
+# Default value of osrm-routed's --max-viaroute-size option
+DEFAULT_OSRM_MAX_VIAROUTE_SIZE = 500
+
+# Per-request limits of the Google Maps Distance Matrix API
+GOOGLE_MAX_ORIGINS = 25
+GOOGLE_MAX_DESTINATIONS = 25
+GOOGLE_MAX_ELEMENTS = 100
+
+# Default values of Valhalla's service_limits.<costing>.max_matrix_locations and
+# max_matrix_location_pairs options
+DEFAULT_VALHALLA_MAX_MATRIX_LOCATIONS = 50
+DEFAULT_VALHALLA_MAX_MATRIX_LOCATION_PAIRS = 2500
+
+# Default maximum number of origins, and of destinations, in a GraphHopper
+# /matrix request
+DEFAULT_GRAPHHOPPER_MAX_MATRIX_LOCATIONS = 100
+
+# Default value of Valhalla's service_limits.<costing>.max_locations option,
+# the lowest of the defaults of the costings in mode_map
+DEFAULT_VALHALLA_MAX_LOCATIONS = 20
+
+# Mean radius of the Earth, in meters
+EARTH_RADIUS = 6371008.8
+
+# Default upper bounds, in meters per second, on the straight-line speed of a
+# route in each mode, used by Distances.nearest to rule out candidates
+DEFAULT_MAX_SPEEDS = {
+    "bike": 15,
+    "drive": 45,
+    "transit": 60,
+    "walk": 3
+}
+
+# Default number of candidates Distances.nearest routes in its first round
+DEFAULT_NEAREST_BATCH_SIZE = 25
+
+# Default number of seconds between departures in OTPDistances.departure_sweep
+DEFAULT_SWEEP_STEP = 300
+
+# Default number of itineraries OTPDistances.departure_sweep asks for per
+# request
+DEFAULT_SWEEP_ITINERARIES = 10
+
+def matrix_tile_shape(n_rows, n_cols, max_rows = None, max_cols = None,
+                      max_elements = None, max_locations = None):
+    """ Chooses the tile size that covers a matrix in the fewest requests
+
+    Args:
+        n_rows: The number of origins in the matrix.
+        n_cols: The number of destinations in the matrix.
+        max_rows: The maximum number of origins per request, or None.
+        max_cols: The maximum number of destinations per request, or None.
+        max_elements: The maximum number of origin-destination pairs per
+            request, or None.
+        max_locations: The maximum number of origins plus destinations per
+            request, or None.
+
+    Returns:
+        A (tile_rows, tile_cols) tuple.
+
+    Raises:
+        ValueError: The limits do not allow even a 1x1 tile.
+    """
+
+    best = None
+    best_requests = None
+
+    for rows in range(1, max(min(n_rows, max_rows or n_rows), 1) + 1):
+        cols = max(n_cols, 1)
+        if (max_cols is not None):
+            cols = min(cols, max_cols)
+        if (max_elements is not None):
+            cols = min(cols, max_elements // rows)
+        if (max_locations is not None):
+            cols = min(cols, max_locations - rows)
+        if (cols < 1):
+            break
+
+        # Prefer the fewest requests, then the fewest locations per request
+        requests_needed = -(-n_rows // rows) * -(-n_cols // cols)
+        if (best_requests is None or requests_needed < best_requests
+                or (requests_needed == best_requests
+                    and rows + cols < sum(best))):
+            best = (rows, cols)
+            best_requests = requests_needed
+
+    if (best is None):
+        raise ValueError("Matrix limits do not allow a single element")
+
+    return best
+
+def matrix_tiles(n_rows, n_cols, tile_rows, tile_cols):
+    """ Splits a matrix into tiles
+
+    Args:
+        n_rows: The number of rows in the matrix.
+        n_cols: The number of columns in the matrix.
+        tile_rows: The number of rows per tile.
+        tile_cols: The number of columns per tile.
+
+    Yields:
+        (row_start, row_end, col_start, col_end) tuples, with the end indices
+            being exclusive.
+    """
+
+    for row_start in range(0, n_rows, tile_rows):
+        for col_start in range(0, n_cols, tile_cols):
+            yield (row_start, min(row_start + tile_rows, n_rows),
+                   col_start, min(col_start + tile_cols, n_cols))
+
+def haversine(long, lat, longs, lats):
+    """ Great-circle distances from one point to many points
+
+    Args:
+        long: The longitude of the point.
+        lat: The latitude of the point.
+        longs: A numpy array of longitudes.
+        lats: A numpy array of latitudes.
+
+    Returns:
+        A numpy array of distances, in meters.
+    """
+
+    import numpy
+
+    (long, lat) = numpy.radians(long), numpy.radians(lat)
+    (longs, lats) = numpy.radians(longs), numpy.radians(lats)
+
+    a = (numpy.sin((lats - lat) / 2) ** 2
+         + numpy.cos(lat) * numpy.cos(lats)
+         * numpy.sin((longs - long) / 2) ** 2)
+    return 2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1)))
+
+class ResponseText(object):
+    """ Wraps a response body so it is only decoded if it is logged """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return self.data.decode(errors = "replace")
 
 class Distances():
     """ Base class for distance calculators
@@ -39,38 +221,306 @@ class Distances():
         verbose: A boolean describing whether or not verbose output should be
             enabled.
         timeout: An integer that describes how long until a route times out.
-        staticmaps: A staticmaps.Constructor object, only present if verbose is
-            true. This is used to visualize isochrones.
+        staticmaps: A staticmaps.Constructor object used to visualize
+            isochrones, or None if visualization is off.
+        adapter: A requests.adapters.HTTPAdapter holding this instance's pool of
+            keep-alive connections. It is shared by every thread's session.
+        cache: A cache.RouteCache object that self.distance looks results up
+            in before routing, or None.
+        retry_policy: A retry.RetryPolicy object that decides which failed
+            routes self.distance retries, and when.
+        circuit_breaker: A retry.CircuitBreaker object that stops
+            self.distance from sending requests while the backend is
+            unhealthy.
+        lean: A boolean describing whether results leave out the backend's
+            full response.
+        json_loads: The function used to parse JSON responses.
+        entrypoint_pool: An entrypoints.EntrypointPool that requests to
+            self.entrypoint are spread across, or None.
+        hooks: A list of metrics.Hooks objects notified of requests, route
+            attempts, retries, failures and cache lookups.
     """
 
     def __init__(self, timeout = DEFAULT_TIMEOUT, verbose = False,
-                 fail_fast = True):
+                 fail_fast = True, pool_connections = DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize = DEFAULT_POOL_MAXSIZE, pool_block = False,
+                 cache = None, retry_policy = None, lean = False,
+                 json_loads = None, hooks = (), visualize = None):
         """ Initializes Distances class and all child classes
 
         Args:
-            verbose: A boolean that toggles verbosity of output.
+            verbose: A boolean that toggles verbosity of output. It only
+                sets the default of visualize; messages are always logged at
+                DEBUG level, and configuring the route_distances logger is left
+                to the application.
             timeout: An integer that describes how long until a route times out.
             fail_fast: A boolean that toggles whether to raise an exception or
                 return False when a route fails to calculate. The exception is
                 the exception returned by the requests library.
+            pool_connections: The number of hosts to keep connection pools
+                for.
+            pool_maxsize: The maximum number of keep-alive connections kept
+                open to a single host. This should be at least the number of
+                threads sharing the instance.
+            pool_block: A boolean that toggles whether a request should wait for
+                a free connection when pool_maxsize connections to a host are
+                already in use, rather than opening an extra connection that is
+                discarded afterwards.
+            cache: A cache.RouteCache object to cache the results of
+                self.distance in. Several instances may share one cache.
+            retry_policy: A retry.RetryPolicy object. If None, a default
+                policy is used.
+            lean: A boolean that toggles whether results leave out the
+                backend's full response, which otherwise is kept in the
+                "response" key. Batches of lean results are returned as
+                records.RouteRecords objects. Where the backend supports it,
+                lean requests also ask it to leave out geometry and turn-by-turn
+                instructions.
+            json_loads: A function that parses JSON from bytes. Defaults to
+                orjson.loads if orjson is installed and json.loads otherwise.
+            hooks: An iterable of metrics.Hooks objects, such as a
+                metrics.Metrics object, to notify of routing events.
+            visualize: A boolean that toggles logging Google Static Maps
+                previews of isochrones. Defaults to verbose; pass False to
+                skip the work in verbose batch runs.
         """
 
         self.verbose = verbose
         self.timeout = timeout
         self.fail_fast = fail_fast
-
-        if (verbose):
+        self.cache = cache
+        self.retry_policy = retry_policy or retry.RetryPolicy()
+        self.circuit_breaker = self.retry_policy.circuit_breaker()
+        self.lean = lean
+        self.json_loads = json_loads or globals()["json_loads"]
+        self.entrypoint_pool = None
+        self.hooks = list(hooks)
+        self.staticmaps = None
+        if (visualize if visualize is not None else verbose):
             self.staticmaps = staticmaps.Constructor()
 
-    def log(self, string):
-        """ Prints a string if verbose mode is enabled
+        self.adapter = requests.adapters.HTTPAdapter(
+            pool_connections = pool_connections,
+            pool_maxsize = pool_maxsize,
+            pool_block = pool_block
+        )
+        self._sessions = threading.local()
+
+    @property
+    def session(self):
+        """ The requests.Session used by the calling thread
+
+        requests.Session objects are not safe to share between threads, so
+        each thread gets its own session. All of them are mounted on
+        self.adapter, so connections are still pooled and kept alive across
+        threads.
+        """
+
+        session = getattr(self._sessions, "session", None)
+        if (session is None):
+            session = requests.Session()
+            session.mount("http://", self.adapter)
+            session.mount("https://", self.adapter)
+            self._sessions.session = session
+        return session
+
+    def set_entrypoint(self, entrypoint):
+        """ Sets the entrypoint of a self-hosted backend
+
+        Args:
+            entrypoint: An entrypoint such as "host:port"; a list of
+                entrypoints of interchangeable replicas, or a dictionary
+                mapping them to weights; or an entrypoints.EntrypointPool.
+                Given several replicas, URLs are built with the first one as
+                self.entrypoint and each request is sent to the replica the
+                pool chooses.
+        """
+
+        if (isinstance(entrypoint, str)):
+            self.entrypoint = entrypoint
+            self.entrypoint_pool = None
+            return
+
+        if (not isinstance(entrypoint, entrypoints.EntrypointPool)):
+            entrypoint = entrypoints.EntrypointPool(entrypoint)
+        self.entrypoint_pool = entrypoint
+        self.entrypoint = entrypoint.entrypoints[0]
+
+    def replica_url(self, url, replica):
+        """ Points a URL built with self.entrypoint at another replica """
+
+        if (replica is None):
+            return url
+        return url.replace("//%s/" % self.entrypoint, "//%s/" % replica, 1)
+
+    def http_request(self, method, url, **kwargs):
+        """ Sends an HTTP request through this instance's connection pool
+
+        If self.entrypoint_pool is set, the request is sent to the replica it
+        chooses. A request that fails with a connection error or timeout, or
+        is answered with one of retry.RETRYABLE_STATUS_CODES, is moved to
+        another replica until every replica has been tried, before the error
+        reaches the caller's retry policy.
+
+        Args:
+            method: The HTTP method, e.g. "GET" or "POST".
+            url: The URL to send the request to.
+            **kwargs: Extra arguments passed to requests.Session.request. The
+                timeout defaults to self.timeout.
+
+        Returns:
+            A requests.Response object.
+        """
+
+        kwargs.setdefault("timeout", self.timeout)
+        pool = self.entrypoint_pool
+
+        if (pool is None):
+            return self.timed_request(method, url, **kwargs)
+
+        tried = []
+        while (True):
+            replica = pool.acquire(tried)
+            # Left as None if the request is abandoned for reasons that say
+            # nothing about the replica, e.g. KeyboardInterrupt
+            success = None
+            try:
+                response = self.timed_request(
+                    method, self.replica_url(url, replica), **kwargs
+                )
+                failed = response.status_code in retry.RETRYABLE_STATUS_CODES
+                success = not failed
+            except (requests.ConnectionError, requests.Timeout) as error:
+                success = False
+                tried.append(replica)
+                if (len(tried) >= len(pool)):
+                    raise
+                self.log("Request to %s failed, trying another replica: %r",
+                         replica, error)
+                continue
+            except requests.RequestException:
+                success = False
+                raise
+            finally:
+                pool.release(replica, success)
+
+            tried.append(replica)
+            if (not failed or len(tried) >= len(pool)):
+                return response
+            self.log("%s answered %d, trying another replica", replica,
+                     response.status_code)
+
+    def timed_request(self, method, url, **kwargs):
+        """ Sends one HTTP request with self.session, notifying self.hooks
+        """
+
+        if (not self.hooks):
+            return self.session.request(method, url, **kwargs)
+
+        start = time.perf_counter()
+        status = None
+        try:
+            response = self.session.request(method, url, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            self.emit("request", metrics.endpoint_label(url), status,
+                      time.perf_counter() - start)
+
+    def close(self):
+        """ Closes all pooled connections held by this instance """
+
+        self.adapter.close()
+
+    def send_route_request(self, request, parse = None):
+        """ Sends a request built by self.build_route_request
+
+        Subclasses for self-hosted backends implement build_route_request and
+        parse_route_response, and their route method is a front-end for this.
+        Keeping request construction and response parsing separate from the
+        transport lets other transports, such as the asyncio one in
+        route_distances.aio, reuse them.
+
+        Args:
+            request: A (method, url, request_json) tuple, with request_json
+                being None for requests without a JSON body.
+            parse: The function to parse the response with, taking the status
+                code and body, or None for self.parse_route_response.
+
+        Returns:
+            The result of parse for the response.
+
+        Raises:
+            requests.HTTPError: The response's status code is one of
+                retry.RETRYABLE_STATUS_CODES.
+        """
+
+        (method, url, request_json) = request
+
+        if (request_json is None):
+            self.log("Sending request: %s", url)
+        else:
+            self.log("Sending request JSON to %s: %s", url, request_json)
+        response = self.http_request(method, url, json = request_json)
+        data = response.content
+        self.log("Response: %s", ResponseText(data))
+
+        # Let self.distance retry responses from an overloaded backend
+        if (response.status_code in retry.RETRYABLE_STATUS_CODES):
+            response.raise_for_status()
+
+        return (parse or self.parse_route_response)(response.status_code,
+                                                    data)
+
+    def log(self, message, *args):
+        """ Logs a message to the route_distances logger at DEBUG level
+
+        The message is only formatted if the logger emits it, so passing large
+        values as args costs nothing when logging is disabled.
+
+        Args:
+            message: A %-style format string.
+            *args: The values to format message with.
+        """
+
+        logger.debug(message, *args)
+
+    def emit(self, event, *args):
+        """ Notifies self.hooks of an event
+
+        A hook that raises is logged and otherwise ignored, so hooks cannot
+        break routing.
+
+        Args:
+            event: The name of the event; the on_<event> method of every hook
+                is called.
+            *args: The arguments passed to the hooks after the backend name.
+        """
+
+        for hook in self.hooks:
+            try:
+                getattr(hook, "on_" + event)(type(self).__name__, *args)
+            except Exception:
+                logger.exception("Hook %r failed on %s", hook, event)
+
+    def route_result(self, distance, duration, response = None):
+        """ Builds the dictionary returned by a successful route
 
         Args:
-            string: A string to be printed if self.verbose is True.
+            distance: The distance of the route in meters.
+            duration: The duration of the route in seconds.
+            response: The backend's parsed response, left out if self.lean is
+                True.
+
+        Returns:
+            A dictionary with "distance", "duration" and, unless self.lean is
+                True, "response" keys.
         """
 
-        if (self.verbose):
-            print("%s %s" % (datetime.datetime.now().isoformat(), string))
+        if (self.lean):
+            return {"distance": distance, "duration": duration}
+        return {"distance": distance, "duration": duration,
+                "response": response}
 
     def map_mode(self, mode):
         """ Remaps an input mode into a mode usable by an API
@@ -89,36 +539,495 @@ class Distances():
         if (mode in self.mode_map):
             return self.mode_map[mode]
         else:
-            print("Invalid mode \"%s\"" % mode)
+            logger.warning("Invalid mode \"%s\"", mode)
             raise LookupError
 
+    def route_arguments(self, *args, **kwargs):
+        """ Matches arguments of self.route to its parameters
+
+        Args:
+            The same as self.route.
+
+        Returns:
+            A dictionary mapping parameter names to values, including
+                defaults.
+        """
+
+        arguments = inspect.signature(self.route).bind(*args, **kwargs)
+        arguments.apply_defaults()
+        return dict(arguments.arguments)
+
+    def cache_key(self, *args, **kwargs):
+        """ Builds the key self.cache stores the result of a route under
+
+        Args:
+            The same as self.route.
+
+        Returns:
+            A key built by self.cache.key.
+        """
+
+        arguments = self.route_arguments(*args, **kwargs)
+
+        coords = [arguments.pop(name) for name in
+                  list(arguments)[:4]]
+        mode = arguments.pop("mode", None)
+        departure_time = arguments.pop("departure_time", None)
+        arguments.pop("args", None)
+        arguments.pop("kwargs", None)
+
+        return self.cache.key(type(self).__name__,
+                              getattr(self, "entrypoint", None), mode, coords,
+                              departure_time, arguments)
+
     def distance(self, *args, **kwargs):
         """ Frontend function for self.route
 
         Wrapper function that sits between the end user and self.route, as
         defined by child classes. self.distance passes all arguments to
-        self.route and handles retries.
+        self.route and handles retries according to self.retry_policy. If
+        self.cache is set, results are looked up in and added to it; cached
+        results do not contain the backend's full response, and False results
+        are not cached.
 
         """
 
         exception = None
-
-        for attempt in range(MAX_ATTEMPTS):
+        mode = None
+        if (self.hooks):
+            mode = self.route_arguments(*args, **kwargs).get("mode")
+
+        if (self.cache is not None):
+            key = self.cache_key(*args, **kwargs)
+            result = self.cache.get(key)
+            self.emit("cache", result is not None)
+            if (result is not None):
+                return result
+
+        for attempt in range(self.retry_policy.max_attempts):
+            start = time.perf_counter()
             try:
                 if (attempt > 0):
-                    self.log("Retrying (attempt %d)" % (attempt + 1))
-                return self.route(*args, **kwargs)
+                    self.log("Retrying (attempt %d)", attempt + 1)
+                self.circuit_breaker.before_request()
+                result = self.route(*args, **kwargs)
+                self.circuit_breaker.record_success()
+                self.emit("route", mode, "ok" if result else "no_route",
+                          time.perf_counter() - start)
+                # False may be a transient error answered as no route, so it
+                # is not cached
+                if (self.cache is not None and result):
+                    self.cache.put(key, result)
+                return result
             except Exception as error:
                 exception = error
-                print("Error: %s" % error)
+                self.emit("route", mode, "error", time.perf_counter() - start)
+                delay = self.attempt_failed(error, attempt)
+                if (delay is None):
+                    break
+                self.emit("retry", mode, attempt, error, delay)
+                time.sleep(delay)
 
-        self.log("Max attempts reached (%d)" % MAX_ATTEMPTS)
+        self.emit("failure", mode, exception)
 
         if (self.fail_fast):
             raise exception
         else:
             return False
 
+    def attempt_failed(self, error, attempt):
+        """ Records a failed attempt of self.distance
+
+        Args:
+            error: The exception raised by the attempt.
+            attempt: The index of the attempt, starting at 0.
+
+        Returns:
+            The number of seconds to wait before the next attempt, or None if
+                no further attempts should be made.
+        """
+
+        self.log("Error: %s", error)
+
+        if (isinstance(error, retry.CircuitOpenError)):
+            return None
+
+        if (not self.retry_policy.is_retryable(error)):
+            self.circuit_breaker.release()
+            return None
+
+        self.circuit_breaker.record_failure()
+
+        if (attempt + 1 >= self.retry_policy.max_attempts):
+            self.log("Max attempts reached (%d)",
+                     self.retry_policy.max_attempts)
+            return None
+
+        return self.retry_policy.delay(attempt)
+
+    def _distance_item(self, pair, mode, return_exceptions, kwargs):
+        """ Routes one pair of a batch without letting its errors escape """
+
+        try:
+            return self.distance(*pair, mode = mode, **kwargs)
+        except Exception as error:
+            self.log("Failed to route %s: %s", pair, error)
+            if (return_exceptions):
+                return error
+            return False
+
+    def distance_batch_iter(self, pairs, mode = "walk",
+                            workers = DEFAULT_WORKERS,
+                            return_exceptions = False, **kwargs):
+        """ Routes many pairs of coordinates concurrently, yielding in order
+
+        Each pair is passed to self.distance on a thread pool, so it is
+        retried on its own and one failing pair does not abort the others.
+        At most a few times as many pairs as there are workers are read ahead
+        of the results, so pairs can be a generator over a large input.
+
+        Args:
+            pairs: An iterable of (orig_long, orig_lat, dest_long, dest_lat)
+                tuples or lists.
+            mode: A key of the self.mode_map dictionary that will be remapped to
+                a different string and passed to the API.
+            workers: The number of threads to route with. To avoid opening
+                extra connections, this should not exceed pool_maxsize.
+            return_exceptions: A boolean that toggles whether a pair that failed
+                with an exception yields that exception instead of False.
+            **kwargs: Extra arguments passed to self.route, e.g.
+                departure_time.
+
+        Yields:
+            The result of self.distance for each pair, in the order of pairs.
+        """
+
+        pending = collections.deque()
+
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            for pair in pairs:
+                pending.append(executor.submit(
+                    self._distance_item, pair, mode, return_exceptions, kwargs
+                ))
+                if (len(pending) >= workers * 2):
+                    yield pending.popleft().result()
+
+            while (len(pending) > 0):
+                yield pending.popleft().result()
+
+    def distance_batch(self, pairs, mode = "walk", workers = DEFAULT_WORKERS,
+                       return_exceptions = False, **kwargs):
+        """ Routes many pairs of coordinates concurrently
+
+        Args:
+            See self.distance_batch_iter.
+
+        Returns:
+            A list containing the result of self.distance for each pair, in the
+                order of pairs. Pairs that failed are False, or the exception
+                they raised if return_exceptions is True. If self.lean is True,
+                a records.RouteRecords object holding the same results is
+                returned instead of a list.
+        """
+
+        if (self.lean):
+            return records.RouteRecords(self.distance_batch_iter(
+                pairs, mode = mode, workers = workers,
+                return_exceptions = return_exceptions, **kwargs
+            ))
+
+        return list(self.distance_batch_iter(
+            pairs, mode = mode, workers = workers,
+            return_exceptions = return_exceptions, **kwargs
+        ))
+
+    def nearest(self, orig_long, orig_lat, candidates, k = 1, mode = "walk",
+                by = "duration", max_speed = None,
+                batch_size = DEFAULT_NEAREST_BATCH_SIZE,
+                workers = DEFAULT_WORKERS, **kwargs):
+        """ Finds the k candidates with the shortest routes from an origin
+
+        Candidates are ranked by straight-line distance, computed for all of
+        them at once, and routed nearest first in rounds that double in size.
+        A route is never shorter than the straight line, and never faster than
+        max_speed along it, so once the next unrouted candidate's straight-line
+        lower bound is no better than the k-th best route found, no remaining
+        candidate can enter the top k and routing stops. Candidates are routed
+        with self.matrix if the backend has one, and self.distance otherwise.
+
+        Args:
+            orig_long: The origin longitude.
+            orig_lat: The origin latitude.
+            candidates: An array-like of (long, lat) pairs.
+            k: The number of candidates to return.
+            mode: A key of the self.mode_map dictionary that will be remapped
+                to a different string and passed to the API.
+            by: "duration" or "distance", the result key to rank by.
+            max_speed: An upper bound, in meters per second, on the
+                straight-line speed of any route, used when ranking by
+                duration. Defaults to DEFAULT_MAX_SPEEDS[mode]. If a route is
+                faster, the answer may not be exact.
+            batch_size: The number of candidates routed in the first round.
+            workers: The number of threads to route with when the backend has
+                no matrix method.
+            **kwargs: Extra arguments passed to self.matrix or self.route,
+                e.g. departure_time.
+
+        Returns:
+            A list of up to k (index, result) tuples sorted by result[by],
+                where index is the candidate's position in candidates and
+                result is a dictionary with "distance" and "duration" keys.
+                Candidates with no route are left out.
+        """
+
+        rounds = self._nearest_rounds(orig_long, orig_lat, candidates, k,
+                                      mode, by, max_speed, batch_size)
+        try:
+            destinations = next(rounds)
+            while (True):
+                destinations = rounds.send(list(self._nearest_routes(
+                    orig_long, orig_lat, destinations, mode, workers, kwargs
+                )))
+        except StopIteration as stop:
+            return stop.value
+
+    def _nearest_rounds(self, orig_long, orig_lat, candidates, k, mode, by,
+                        max_speed, batch_size):
+        """ Plans the rounds of self.nearest, without routing
+
+        A generator that yields the list of (long, lat) destinations to route
+        in each round and is sent back their results, so that the blocking
+        and asyncio classes share one search.
+
+        Returns:
+            The list self.nearest returns, as the value of StopIteration.
+        """
+
+        if (by not in ("duration", "distance")):
+            raise ValueError("by must be \"duration\" or \"distance\"")
+
+        import numpy
+
+        candidates = numpy.asarray(candidates, dtype = float).reshape(-1, 2)
+        crow = haversine(orig_long, orig_lat, candidates[:, 0],
+                         candidates[:, 1])
+
+        order = numpy.argsort(crow, kind = "stable")
+        bounds = crow[order]
+        if (by == "duration"):
+            if (max_speed is None):
+                max_speed = DEFAULT_MAX_SPEEDS.get(mode,
+                                                   max(DEFAULT_MAX_SPEEDS
+                                                       .values()))
+            bounds = bounds / max_speed
+
+        found = []
+        routed = 0
+
+        while (routed < len(order)):
+            end = min(routed + batch_size, len(order))
+
+            if (len(found) >= k):
+                # Only candidates whose lower bound beats the k-th best route
+                # can still change the answer
+                kth = found[k - 1][0]
+                end = min(end, int(numpy.searchsorted(bounds, kth)))
+                if (end <= routed):
+                    break
+
+            batch = order[routed:end]
+            destinations = [tuple(candidates[index]) for index in batch]
+
+            results = yield destinations
+            for (index, result) in zip(batch, results):
+                if (result and result[by] is not None):
+                    found.append((result[by], int(index), result))
+
+            found.sort(key = lambda item: (item[0], item[1]))
+            routed = end
+            batch_size *= 2
+
+        self.log("Routed %d of %d candidates to find the nearest %d",
+                 routed, len(order), k)
+
+        return [(index, result) for (value, index, result) in found[:k]]
+
+    def _nearest_routes(self, orig_long, orig_lat, destinations, mode,
+                        workers, kwargs):
+        """ Routes an origin to a list of destinations for self.nearest """
+
+        if (hasattr(self, "matrix")):
+            matrix = self.matrix([(orig_long, orig_lat)], destinations,
+                                 mode = mode, **kwargs)
+            return [
+                self.route_result(distance, duration)
+                if distance is not None else False
+                for (distance, duration) in zip(matrix["distance"][0],
+                                                matrix["duration"][0])
+            ]
+
+        return self.distance_batch_iter(
+            [(orig_long, orig_lat) + destination
+             for destination in destinations],
+            mode = mode, workers = workers, **kwargs
+        )
+
+    def call_with_retries(self, hook_mode, function, *args, **kwargs):
+        """ Calls a function that sends requests, the way self.distance
+        retries self.route
+
+        Args:
+            hook_mode: The mode passed to self.hooks with the function's
+                events. It is named so that function may take a mode keyword
+                argument.
+            function: The function to call.
+            *args: Arguments passed to function.
+            **kwargs: Keyword arguments passed to function.
+
+        Returns:
+            The function's return value.
+
+        Raises:
+            Exception: The exception raised by the last attempt, once no
+                further attempts are allowed.
+        """
+
+        for attempt in range(self.retry_policy.max_attempts):
+            start = time.perf_counter()
+            try:
+                if (attempt > 0):
+                    self.log("Retrying (attempt %d)", attempt + 1)
+                self.circuit_breaker.before_request()
+                result = function(*args, **kwargs)
+                self.circuit_breaker.record_success()
+                self.emit("route", hook_mode, "ok" if result else "no_route",
+                          time.perf_counter() - start)
+                return result
+            except Exception as error:
+                self.emit("route", hook_mode, "error",
+                          time.perf_counter() - start)
+                delay = self.attempt_failed(error, attempt)
+                if (delay is None):
+                    self.emit("failure", hook_mode, error)
+                    raise
+                self.emit("retry", hook_mode, attempt, error, delay)
+                time.sleep(delay)
+
+    def chain_limit(self, mode):
+        """ The most points self.build_chain_request may put in one request
+
+        Args:
+            mode: The mode the chain is routed in.
+
+        Returns:
+            A number of points, or None for no limit.
+        """
+
+        return None
+
+    def chain_slices(self, points, mode):
+        """ Splits a chain into consecutive, overlapping runs of points
+
+        Runs share their end points, so their legs add up to the chain's, and
+        are as evenly sized as self.chain_limit allows.
+
+        Args:
+            points: A list of (long, lat) points.
+            mode: The mode the chain is routed in.
+
+        Returns:
+            A list of (start, end) indices into points, with end inclusive.
+        """
+
+        n_legs = len(points) - 1
+        limit = self.chain_limit(mode)
+        if (limit is None or limit > n_legs):
+            return [(0, n_legs)]
+        if (limit < 2):
+            raise ValueError("Chain limits do not allow a single leg")
+
+        n_slices = -(-n_legs // (limit - 1))
+        bounds = [n_legs * i // n_slices for i in range(n_slices + 1)]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def chain_result(self, legs):
+        """ Builds the dictionary returned by self.route_chain
+
+        Args:
+            legs: A list of (distance, duration) tuples, one per leg.
+
+        Returns:
+            A dictionary with the total "distance" and "duration", and a
+                "legs" list with a dictionary with "distance" and "duration"
+                keys per leg.
+        """
+
+        return {
+            "distance": sum(leg[0] for leg in legs),
+            "duration": sum(leg[1] for leg in legs),
+            "legs": [{"distance": leg[0], "duration": leg[1]} for leg in legs]
+        }
+
+    def route_chain(self, points, mode = "walk", workers = DEFAULT_WORKERS,
+                    **kwargs):
+        """ Routes an ordered chain of stops, leg by leg
+
+        Backends that implement build_chain_request route the chain with as
+        few multi-waypoint requests as self.chain_limit allows, retried like
+        self.distance. Other backends route every leg with
+        self.distance_batch.
+
+        Args:
+            points: An iterable of at least two (long, lat) points, in the
+                order they are visited.
+            mode: A key of the self.mode_map dictionary that will be remapped to
+                a different string and passed to the API.
+            workers: The number of legs routed concurrently by backends
+                without build_chain_request.
+            **kwargs: Extra arguments passed to self.build_chain_request or
+                self.route, e.g. avoid for Valhalla.
+
+        Returns:
+            A dictionary with the total "distance" and "duration" and a "legs"
+                list of per-leg "distance" and "duration" dictionaries, in
+                meters and seconds; False if any leg could not be routed.
+
+        Raises:
+            ValueError: There are fewer than two points.
+        """
+
+        points = [tuple(point) for point in points]
+        if (len(points) < 2):
+            raise ValueError("A chain needs at least two points")
+
+        if (not hasattr(self, "build_chain_request")):
+            results = self.distance_batch(
+                [points[i] + points[i + 1] for i in range(len(points) - 1)],
+                mode = mode, workers = workers, **kwargs
+            )
+            if (not all(results)):
+                return False
+            return self.chain_result([(result["distance"], result["duration"])
+                                      for result in results])
+
+        legs = []
+        for (start, end) in self.chain_slices(points, mode):
+            slice_legs = self.call_with_retries(
+                mode, self.send_route_request,
+                self.build_chain_request(points[start:end + 1], mode,
+                                         **kwargs),
+                self.parse_chain_response
+            )
+            if (not slice_legs):
+                return False
+            if (len(slice_legs) != end - start):
+                logger.warning("Expected %d legs from the backend, got %d",
+                               end - start, len(slice_legs))
+                return False
+            legs.extend(slice_legs)
+
+        return self.chain_result(legs)
+
 class GoogleMapsDistances(Distances):
     """ Subclass of Distances that uses the Google Maps Distances Matrix API as
     a backend
@@ -128,17 +1037,21 @@ class GoogleMapsDistances(Distances):
         for_work: Tells whether or not a Google Maps API for Work account was
             used to authenticate. This must be true to use the departure_time
             argument in the route function.
+        rate_limiter: A ratelimit.RateLimiter object that every request is
+            counted against, in elements.
+        request_limiter: A ratelimit.RateLimiter object that spaces requests
+            request_delay seconds apart regardless of their size, or None.
         period_start: The seconds in Unix time since the current scraping
             period started.
-        requests_this_period: The number of requests made in the current
+        requests_this_period: The number of elements requested in the current
             period.
-        request_delay: The number of seconds to sleep between requests.
     """
 
     def __init__(self, api_key = None, client_id = None, client_secret = None,
                  requests_this_period = 0, requests_per_period = 100000,
                  period_length = 60*60*24, request_delay = 0.5,
-                 *args, **kwargs):
+                 *args, requests_per_second = None, burst = None,
+                 rate_limit_state = None, rate_limiter = None, **kwargs):
         """ Initialize GoogleMapsDistances object
 
         Args:
@@ -155,9 +1068,25 @@ class GoogleMapsDistances(Distances):
                 https://developers.google.com/maps/premium/usage-limits, in the
                 Web service APIs section.
             period_length: The length of a period, the default being 24 hours.
-            request_delay: The number of seconds to sleep between requests.
+            request_delay: The minimum number of seconds between requests,
+                regardless of their number of elements. 0 disables it.
+            requests_per_second: The number of elements that can be requested
+                per second, e.g. your key's elements per second quota, or None
+                to only count elements against requests_per_period.
+            burst: The number of elements that can be requested at once
+                before the per-second limit applies. Defaults to one second's
+                worth.
+            rate_limit_state: The path of a file through which several
+                processes using the same key share one rate limit and quota.
+                The request_delay spacing is shared through the same path
+                with ".requests" appended.
+            rate_limiter: A ratelimit.RateLimiter object to use instead of
+                building one from the arguments above, e.g. to share one
+                limiter between instances.
         """
 
+        import googlemaps
+
         Distances.__init__(self, *args, **kwargs)
 
         if (api_key is not None):
@@ -169,11 +1098,30 @@ class GoogleMapsDistances(Distances):
                                            timeout = self.timeout)
             self.for_work = True
 
-        self.period_start = None
-        self.requests_this_period = requests_this_period
-        self.requests_per_period = requests_per_period
-        self.period_length = period_length
-        self.request_delay = request_delay
+        # Route the client's requests through the shared connection pool
+        self.gmaps.session.mount("https://", self.adapter)
+        self.gmaps.session.mount("http://", self.adapter)
+        self.gmaps.session.hooks["response"].append(self._response_hook)
+
+        self.request_limiter = None
+        if (request_delay):
+            self.request_limiter = ratelimit.RateLimiter(
+                rate = 1 / request_delay,
+                burst = 1,
+                state_path = (rate_limit_state + ".requests"
+                              if rate_limit_state is not None else None)
+            )
+
+        if (rate_limiter is None):
+            rate_limiter = ratelimit.RateLimiter(
+                rate = requests_per_second,
+                burst = burst,
+                quota = requests_per_period,
+                period_length = period_length,
+                period_used = requests_this_period,
+                state_path = rate_limit_state
+            )
+        self.rate_limiter = rate_limiter
 
         self.mode_map = {
             "bike": "bicycling",
@@ -182,34 +1130,49 @@ class GoogleMapsDistances(Distances):
             "walk": "walking"
         }
 
-    def rate_limit(self):
-        """ Handles rate limiting, holding up the script if necessary """
+    @property
+    def requests_this_period(self):
+        return self.rate_limiter.period_used
 
-        self.requests_this_period += 1
+    @requests_this_period.setter
+    def requests_this_period(self, value):
+        self.rate_limiter.period_used = value
 
-        # Don't sleep on the first request
-        if (self.period_start is None):
-            self.period_start = time.time()
-        else:
-            time.sleep(self.request_delay)
+    @property
+    def period_start(self):
+        return self.rate_limiter.period_start
 
-        if (self.requests_this_period >= self.requests_per_period):
-            next_period = self.period_start + self.period_length
-            time_until_next_period = next_period - time.time()
+    def rate_limit(self, elements = 1):
+        """ Handles rate limiting, holding up the script if necessary
 
-            print("Reached max requests per period (%d >= %d)" % (
-                self.requests_this_period, self.requests_per_period
-            ))
-            print("Sleeping %d seconds until next period (%s)" % (
-                time_until_next_period,
-                datetime.datetime.fromtimestamp(next_period).isoformat()
-            ))
+        Safe to call from several threads, and from several processes if
+        rate_limit_state was given.
+
+        Args:
+            elements: The number of elements the next request will be billed
+                as, i.e. its number of origins times its number of
+                destinations.
+        """
+
+        waited = 0
+        if (self.request_limiter is not None):
+            waited += self.request_limiter.acquire()
+        waited += self.rate_limiter.acquire(elements)
+        if (waited >= 1):
+            self.log("Waited %d seconds for rate limit (%d elements requested "
+                     "this period)", waited, self.requests_this_period)
+        self.emit("quota", elements, self.requests_this_period,
+                  self.rate_limiter.quota)
 
-            time.sleep(time_until_next_period)
+    def _response_hook(self, response, *args, **kwargs):
+        """ Notifies self.hooks of a request sent by self.gmaps
+
+        The latency is the time until the response's headers arrived.
+        """
 
-        if (time.time() >= self.period_start + self.period_length):
-            self.period_start = time.time()
-            self.requests_this_period = 0
+        if (self.hooks):
+            self.emit("request", metrics.endpoint_label(response.url),
+                      response.status_code, response.elapsed.total_seconds())
 
     def route(self, orig_long, orig_lat, dest_long, dest_lat, mode = "walk",
               departure_time = None):
@@ -266,19 +1229,22 @@ class GoogleMapsDistances(Distances):
                 mode = self.map_mode(mode)
             )
 
-        self.log("Response: %s" % result)
+        self.log("Response: %s", result)
         if (result["status"] == "OK"):
-            return {
-                "duration": result["rows"][0]["elements"][0]["duration"]["value"],
-                "distance": result["rows"][0]["elements"][0]["distance"]["value"],
-                "response": result
-            }
+            return self.route_result(
+                duration = result["rows"][0]["elements"][0]["duration"]["value"],
+                distance = result["rows"][0]["elements"][0]["distance"]["value"],
+                response = result
+            )
 
         return False
 
     def route_multi(self, orig_long, orig_lat, destinations, mode = "walk"):
         """ Routes the distance between one origin and multiple destinations
 
+        A one-row self.matrix, so destinations are split into requests the
+        API accepts and every request counts against the rate limit.
+
         Args:
             orig_long: The origin longitude.
             orig_lat: The origin latitude.
@@ -287,29 +1253,95 @@ class GoogleMapsDistances(Distances):
                 to a different string and passed to the API.
 
         Returns:
-            A list of dictionaries formatted like the output of self.distance().
+            A list with one dictionary formatted like the output of
+                self.distance() per destination, without the "response" key,
+                or False for destinations without a route.
+        """
+
+        matrix = self.matrix([(orig_long, orig_lat)], destinations, mode)
+
+        return [
+            self.route_result(distance, duration)
+            if status == "OK" else False
+            for (distance, duration, status) in zip(matrix["distance"][0],
+                                                    matrix["duration"][0],
+                                                    matrix["status"][0])
+        ]
+
+    def matrix(self, origins, destinations, mode = "walk",
+               departure_time = None):
+        """ Routes the distances between many origins and destinations
+
+        The matrix is packed into as few requests as the API's per-request
+        origin, destination and element limits allow. Every request counts
+        against the rate limit as its number of elements.
+
+        Args:
+            origins: An iterable containing (long, lat) tuples or lists.
+            destinations: An iterable containing (long, lat) tuples or lists.
+            mode: A key of the self.mode_map dictionary that will be remapped to
+                a different string and passed to the API.
+            departure_time: A datetime.datetime object; see self.route.
+
+        Returns:
+            A dictionary containing rows of durations in the "duration" key,
+                rows of distances in the "distance" key and rows of element
+                statuses in the "status" key, where row i, column j describes
+                the route from origins[i] to destinations[j]. Cells whose
+                status is not "OK" have a duration and distance of None.
+                Distance is in meters; duration is in seconds.
         """
 
-        self.log("Sending request to Google")
-        result = self.gmaps.distance_matrix(
-            origins = (orig_lat, orig_long),
-            destinations = [(coord[1], coord[0]) for coord in destinations],
-            units = "metric",
-            mode = self.map_mode(mode)
+        origins = list(origins)
+        destinations = list(destinations)
+
+        durations = [[None] * len(destinations) for origin in origins]
+        distances = [[None] * len(destinations) for origin in origins]
+        statuses = [[None] * len(destinations) for origin in origins]
+
+        request_args = {
+            "units": "metric",
+            "mode": self.map_mode(mode)
+        }
+        if (departure_time):
+            request_args["departure_time"] = departure_time
+
+        tile_rows, tile_cols = matrix_tile_shape(
+            len(origins), len(destinations),
+            max_rows = GOOGLE_MAX_ORIGINS,
+            max_cols = GOOGLE_MAX_DESTINATIONS,
+            max_elements = GOOGLE_MAX_ELEMENTS
         )
-        self.log("Response: %s" % result)
 
-        if (result["status"] == "OK"):
-            results = []
-            for element in result["rows"][0]["elements"]:
-                results.append({
-                    "duration": element["duration"]["value"],
-                    "distance": element["distance"]["value"],
-                    "response": element
-                })
-            return results
+        for (row_start, row_end, col_start, col_end) in matrix_tiles(
+                len(origins), len(destinations), tile_rows, tile_cols):
+            self.rate_limit((row_end - row_start) * (col_end - col_start))
 
-        return False
+            self.log("Sending %dx%d matrix request to Google",
+                     row_end - row_start, col_end - col_start)
+            result = self.gmaps.distance_matrix(
+                origins = [(coord[1], coord[0])
+                           for coord in origins[row_start:row_end]],
+                destinations = [(coord[1], coord[0])
+                                for coord in destinations[col_start:col_end]],
+                **request_args
+            )
+            self.log("Response: %s", result)
+
+            for (i, row) in enumerate(result["rows"]):
+                for (j, element) in enumerate(row["elements"]):
+                    statuses[row_start + i][col_start + j] = element["status"]
+                    if (element["status"] == "OK"):
+                        durations[row_start + i][col_start + j] = \
+                            element["duration"]["value"]
+                        distances[row_start + i][col_start + j] = \
+                            element["distance"]["value"]
+
+        return {
+            "duration": durations,
+            "distance": distances,
+            "status": statuses
+        }
 
 class OTPDistances(Distances):
     """ Subclass of Distances that uses OpenTripPlanner as a backend """
@@ -318,11 +1350,12 @@ class OTPDistances(Distances):
         """ Initializes the OTPDistances class
 
         Args:
-            entrypoint: The base URL containing the API entrypoint.
+            entrypoint: The base URL containing the API entrypoint, or
+                several replicas of it; see Distances.set_entrypoint.
         """
 
         Distances.__init__(self, *args, **kwargs)
-        self.entrypoint = entrypoint
+        self.set_entrypoint(entrypoint)
         self.mode_map = {
             "bike": "WALK,BICYCLE",
             "drive": "WALK,CAR",
@@ -351,6 +1384,22 @@ class OTPDistances(Distances):
                 seconds.
         """
 
+        return self.send_route_request(self.build_route_request(
+            from_long, from_lat, to_long, to_lat, mode, departure_time
+        ))
+
+    def build_route_request(self, from_long, from_lat, to_long, to_lat,
+                            mode = "walk", departure_time = None):
+        """ Builds the request sent by self.route
+
+        Args:
+            See self.route.
+
+        Returns:
+            A (method, url, request_json) tuple describing the request to send
+                to the API for self.route.
+        """
+
         url = ("http://%s/otp/routers/default/plan"
                "?fromPlace=%f,%f&toPlace=%f,%f&mode=%s" % (
             self.entrypoint,
@@ -366,25 +1415,252 @@ class OTPDistances(Distances):
                 "time=%s" % (departure_time.strftime("%H:%M"))
             ])
 
-        self.log("Sending request: %s" % url)
-        response = requests.get(url, timeout = self.timeout)
-        data = response.content.decode()
-        self.log("Response: %s" % data)
+        return ("GET", url, None)
 
-        if (response.status_code == 200):
-            content = json.loads(data)
+    def parse_route_response(self, status_code, data):
+        """ Parses the API's response to a request built for self.route
+
+        Args:
+            status_code: The HTTP status code of the response.
+            data: The body of the response as bytes.
+
+        Returns:
+            A dictionary containing the total duration in the "duration" key and
+                the total distance in the "distance" key if there are no errors;
+                False if there are errors. Distance is in meters; duration is in
+                seconds.
+        """
+
+        if (status_code == 200):
+            content = self.json_loads(data)
             if (not "error" in content):
-                return {
-                    "duration": content["plan"]["itineraries"][0]["duration"],
-                    "distance": sum([
+                return self.route_result(
+                    duration = content["plan"]["itineraries"][0]["duration"],
+                    distance = sum([
                         leg["distance"]
                         for leg in content["plan"]["itineraries"][0]["legs"]
                     ]),
-                    "response": content
-                }
+                    response = content
+                )
 
         return False
 
+    def plan_itineraries(self, from_long, from_lat, to_long, to_lat,
+                         mode = "transit", departure_time = None,
+                         num_itineraries = DEFAULT_SWEEP_ITINERARIES,
+                         search_window = None):
+        """ Requests several itineraries departing at or after a time
+
+        Args:
+            from_long: The origin longitude.
+            from_lat: The origin latitude.
+            to_long: The destination longitude.
+            to_lat: The destination latitude.
+            mode: A key of the self.mode_map dictionary that will be remapped to
+                a different string and passed to the API.
+            departure_time: A datetime.datetime object corresponding to the
+                earliest departure time.
+            num_itineraries: The number of itineraries to ask for.
+            search_window: The number of seconds after departure_time OTP 2
+                should search for departures in, or None to leave it to the
+                server.
+
+        Returns:
+            A list of (departure, arrival, transit) tuples, where departure and
+                arrival are POSIX timestamps in seconds and transit is False
+                for itineraries that use no transit, and so take as long
+                whenever they start; False if there are errors.
+
+        Raises:
+            requests.HTTPError: The response's status code is one of
+                retry.RETRYABLE_STATUS_CODES.
+        """
+
+        (method, url, request_json) = self.build_route_request(
+            from_long, from_lat, to_long, to_lat, mode, departure_time
+        )
+        url += "&numItineraries=%d" % num_itineraries
+        if (search_window is not None):
+            url += "&searchWindow=%d" % search_window
+
+        self.log("Sending request: %s", url)
+        response = self.http_request(method, url)
+        data = response.content
+        self.log("Response: %s", ResponseText(data))
+
+        if (response.status_code in retry.RETRYABLE_STATUS_CODES):
+            response.raise_for_status()
+        if (response.status_code != 200):
+            return False
+
+        content = self.json_loads(data)
+        if ("error" in content):
+            return False
+
+        return [
+            (itinerary["startTime"] / 1000, itinerary["endTime"] / 1000,
+             any(leg.get("transitLeg") for leg in itinerary["legs"]))
+            for itinerary in content["plan"]["itineraries"]
+        ]
+
+    def _sweep_pair(self, pair, departures, mode, num_itineraries,
+                    search_window):
+        """ Fills in one pair's travel time at every departure
+
+        Each response answers the departure it was requested for, and every
+        later departure whose best known arrival is no later than the end of
+        the window of departures the response covers: anything leaving after
+        that window cannot arrive earlier. The next request is sent for the
+        first departure still missing.
+
+        Returns:
+            A (durations, requests, error) tuple, where durations is a list of
+                travel times in seconds or NaN, and error is the exception
+                that stopped the sweep, or None.
+        """
+
+        timestamps = [departure.timestamp() for departure in departures]
+        durations = [float("nan")] * len(departures)
+        requests_sent = 0
+        i = 0
+
+        while (i < len(departures)):
+            try:
+                # The blocking retry loop, as plan_itineraries blocks even in
+                # the asyncio classes
+                itineraries = Distances.call_with_retries(
+                    self, mode, self.plan_itineraries, *pair, mode = mode,
+                    departure_time = departures[i],
+                    num_itineraries = num_itineraries,
+                    search_window = search_window
+                )
+            except Exception as error:
+                self.log("Failed to sweep %s at %s: %s", pair, departures[i],
+                         error)
+                return (durations, requests_sent + 1, error)
+            requests_sent += 1
+
+            if (not itineraries):
+                i += 1
+                continue
+
+            # The itineraries cover departures from timestamps[i] up to the
+            # search window's end or, without one, the last transit departure
+            transit = [(departure, arrival)
+                       for (departure, arrival, uses_transit) in itineraries
+                       if (uses_transit)]
+            walks = [arrival - departure
+                     for (departure, arrival, uses_transit) in itineraries
+                     if (not uses_transit)]
+            if (search_window is not None):
+                window_end = timestamps[i] + search_window
+            else:
+                window_end = max([timestamps[i]]
+                                 + [departure for (departure, arrival)
+                                    in transit])
+
+            j = i
+            while (j < len(departures)):
+                # Allow for OTP rounding departures to the second
+                arrivals = [arrival for (departure, arrival) in transit
+                            if (departure + 1 >= timestamps[j])]
+                arrivals += [timestamps[j] + walk for walk in walks]
+                arrival = min(arrivals) if arrivals else None
+                if (j > i and (arrival is None or arrival > window_end)):
+                    break
+                if (arrival is not None):
+                    durations[j] = arrival - timestamps[j]
+                j += 1
+            i = j
+
+        return (durations, requests_sent, None)
+
+    def departure_sweep(self, pairs, start, end, step = DEFAULT_SWEEP_STEP,
+                        mode = "transit",
+                        num_itineraries = DEFAULT_SWEEP_ITINERARIES,
+                        search_window = None, workers = DEFAULT_WORKERS):
+        """ Profiles travel times across a range of departure times
+
+        Rather than sending one request per pair and departure, as
+        self.route would, each request asks for num_itineraries itineraries
+        (and, for OTP 2, a search window), and the itineraries are used to
+        fill in every departure they answer exactly; requests are only sent
+        for departures still missing.
+
+        Departure times are sent to OTP as wall-clock times in the router's
+        time zone, and compared with the itineraries' timestamps through
+        datetime.datetime.timestamp, so naive datetimes must be in this
+        machine's local time zone and that must match the router's; otherwise
+        pass timezone-aware datetimes in the router's time zone.
+
+        Args:
+            pairs: One (orig_long, orig_lat, dest_long, dest_lat) pair, or an
+                iterable of them.
+            start: A datetime.datetime object of the first departure.
+            end: A datetime.datetime object no earlier than the last departure.
+            step: The number of seconds between departures, a multiple of 60.
+            mode: A key of the self.mode_map dictionary that will be remapped to
+                a different string and passed to the API.
+            num_itineraries: The number of itineraries to ask for per request.
+            search_window: The number of seconds of departures OTP 2 should
+                search per request, or None to leave it to the server.
+            workers: The number of pairs to sweep concurrently.
+
+        Returns:
+            A profiles.DepartureProfiles object, whose summary method returns
+                each pair's minimum, median and percentile travel times.
+
+        Raises:
+            ValueError: step is not a positive number of whole minutes, or
+                end is before start.
+        """
+
+        try:
+            from . import profiles
+        except:
+            import profiles
+        import numpy
+
+        if (step <= 0 or step % 60 != 0):
+            raise ValueError("step must be a positive multiple of 60 seconds")
+        if (end < start):
+            raise ValueError("end must not be before start")
+
+        pairs = list(pairs)
+        if (len(pairs) == 4 and not isinstance(pairs[0], (tuple, list))):
+            pairs = [tuple(pairs)]
+
+        departures = [
+            start + datetime.timedelta(seconds = offset)
+            for offset in range(0, int((end - start).total_seconds()) + 1,
+                                step)
+        ]
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers = max(1, min(workers, len(pairs)))) as executor:
+            results = list(executor.map(
+                lambda pair: self._sweep_pair(pair, departures, mode,
+                                              num_itineraries, search_window),
+                pairs
+            ))
+
+        errors = dict(
+            (index, error) for (index, (durations, requests_sent, error))
+            in enumerate(results) if (error is not None)
+        )
+        if (errors and self.fail_fast):
+            raise next(iter(errors.values()))
+
+        return profiles.DepartureProfiles(
+            pairs, departures,
+            numpy.array([durations for (durations, requests_sent, error)
+                         in results], dtype = float).reshape(len(pairs),
+                                                             len(departures)),
+            requests = sum(requests_sent for (durations, requests_sent, error)
+                           in results),
+            errors = errors
+        )
+
     def isochrone(self, from_long, from_lat, max_time = None,
                   max_distance = None, mode = "walk"):
         """ Generate an isochrone centered at a given point
@@ -415,28 +1691,24 @@ class OTPDistances(Distances):
         if (len(isochrone_args) == 0):
             raise AssertionError("Both max_distance and max_time are None")
 
-        url = ("http://%s/otp/routers/default/isochrone"
-               "?fromPlace=%f,%f&%s&mode=%s" % (
-            self.entrypoint,
-            from_lat, from_long,
-            "&".join(isochrone_args),
-            self.map_mode(mode)
-        ))
+        url = self.build_isochrone_url(from_long, from_lat, isochrone_args,
+                                       mode)
 
-        self.log("Sending request: %s" % url)
-        response = requests.get(url, timeout = self.timeout)
-        data = response.content.decode()
-        self.log("Response: %s" % data)
+        self.log("Sending request: %s", url)
+        response = self.http_request("GET", url)
+        data = response.content
+        self.log("Response: %s", ResponseText(data))
 
         if (response.status_code == 200):
-            content = json.loads(data)
+            content = self.json_loads(data)
             if ("features" in content):
                 geojson = content["features"][0]["geometry"]
 
                 if (len(geojson["coordinates"]) > 0):
 
-                    # Visualization
-                    if (self.verbose):
+                    # Visualization, only built if the preview would be logged
+                    if (self.staticmaps is not None
+                            and logger.isEnabledFor(logging.DEBUG)):
                         base = False
                         for multipolygon in geojson["coordinates"]:
                             for polygon in multipolygon:
@@ -456,8 +1728,8 @@ class OTPDistances(Distances):
                                         color = "0xff000066"
                                     )
 
-                        self.log("Preview with Google Static Maps API: %s"
-                                 % self.staticmaps.generate_url())
+                        self.log("Preview with Google Static Maps API: %s",
+                                 self.staticmaps.generate_url())
                         self.staticmaps.reset()
 
                     return geojson
@@ -466,18 +1738,116 @@ class OTPDistances(Distances):
 
         return False
 
+    def build_isochrone_url(self, from_long, from_lat, isochrone_args,
+                            mode = "walk", departure_time = None):
+        """ Builds the URL of an isochrone request
+
+        Args:
+            from_long: The origin longitude.
+            from_lat: The origin latitude.
+            isochrone_args: A list of "key=value" strings to add to the URL.
+            mode: A key of the self.mode_map dictionary that will be remapped
+                to a different string and passed to the API.
+            departure_time: A datetime.datetime object, or None.
+
+        Returns:
+            A string.
+        """
+
+        url = ("http://%s/otp/routers/default/isochrone"
+               "?fromPlace=%f,%f&%s&mode=%s" % (
+            self.entrypoint,
+            from_lat, from_long,
+            "&".join(isochrone_args),
+            self.map_mode(mode)
+        ))
+
+        if (departure_time):
+            url = "&".join([
+                url,
+                "date=%s" % (departure_time.strftime("%Y-%m-%d")),
+                "time=%s" % (departure_time.strftime("%H:%M"))
+            ])
+
+        return url
+
+    def isochrones(self, from_long, from_lat, cutoffs, mode = "walk",
+                   departure_time = None):
+        """ Generate nested isochrones for several travel times at once
+
+        All cutoffs are requested in a single request, and the result can test
+        many points for reachability at once; see isochrones.Isochrones.
+
+        Args:
+            from_long: The origin longitude.
+            from_lat: The origin latitude.
+            cutoffs: An iterable of travel times, in seconds, to generate
+                isochrones for, e.g. range(300, 3601, 300) for 5 to 60 minute
+                bands.
+            mode: A key of the self.mode_map dictionary that will be remapped
+                to a different string and passed to the API.
+            departure_time: A datetime.datetime object corresponding to the
+                desired departure time, or None.
+
+        Returns:
+            An isochrones.Isochrones object holding a shapely (Multi)Polygon
+                per cutoff if there are no errors; False if there are errors.
+        """
+
+        cutoffs = sorted(set(int(cutoff) for cutoff in cutoffs))
+        if (len(cutoffs) == 0):
+            raise AssertionError("No cutoffs given")
+
+        url = self.build_isochrone_url(
+            from_long, from_lat,
+            ["cutoffSec=%d" % cutoff for cutoff in cutoffs],
+            mode, departure_time
+        )
+
+        self.log("Sending request: %s", url)
+        response = self.http_request("GET", url)
+        data = response.content
+        self.log("Response: %s", ResponseText(data))
+
+        if (response.status_code == 200):
+            content = self.json_loads(data)
+            if ("features" in content):
+                try:
+                    from . import isochrones
+                except:
+                    import isochrones
+
+                return isochrones.Isochrones.from_geojson(
+                    (from_long, from_lat), content["features"], cutoffs
+                )
+
+        return False
+
 class OSRMDistances(Distances):
     """ Subclass of Distances that uses OSRM as a backend """
 
-    def __init__(self, entrypoint = DEFAULT_ENTRYPOINT, *args, **kwargs):
+    def __init__(self, entrypoint = DEFAULT_ENTRYPOINT, *args,
+                 max_table_size = DEFAULT_OSRM_MAX_TABLE_SIZE,
+                 max_viaroute_size = DEFAULT_OSRM_MAX_VIAROUTE_SIZE,
+                 max_url_length = DEFAULT_MAX_URL_LENGTH, **kwargs):
         """ Initializes the OSRMDistances class
 
         Args:
-            entrypoint: The base URL containing the API entrypoint.
+            entrypoint: The base URL containing the API entrypoint, or
+                several replicas of it; see Distances.set_entrypoint.
+            max_table_size: The server's --max-table-size option. A table
+                request may contain up to max_table_size squared
+                origin-destination pairs.
+            max_viaroute_size: The server's --max-viaroute-size option, the
+                most points a route request may contain.
+            max_url_length: The longest URL the server accepts.
         """
 
         Distances.__init__(self, *args, **kwargs)
-        self.entrypoint = entrypoint
+        self.set_entrypoint(entrypoint)
+        self.max_table_size = max_table_size
+        self.max_viaroute_size = max_viaroute_size
+        self.max_url_length = max_url_length
         self.mode_map = {
             "bike": "bike",
             "drive": "car",
@@ -503,6 +1873,21 @@ class OSRMDistances(Distances):
                 seconds.
         """
 
+        return self.send_route_request(self.build_route_request(
+            from_long, from_lat, to_long, to_lat, mode
+        ))
+
+    def build_route_request(self, from_long, from_lat, to_long, to_lat,
+                            mode = "walk"):
+        """ Builds the request sent by self.route
+
+        Args:
+            See self.route.
+
+        Returns:
+            A (method, url, request_json) tuple describing the request to send
+                to the API for self.route.
+        """
 
         url = ("http://%s/route/v1/%s/"
                "%f,%f;%f,%f" % (
@@ -511,34 +1896,202 @@ class OSRMDistances(Distances):
             from_long, from_lat, to_long, to_lat
         ))
 
-        self.log("Sending request: %s" % url)
-        response = requests.get(url, timeout = self.timeout)
-        data = response.content.decode()
-        self.log("Response: %s" % data)
+        if (self.lean):
+            url += "?overview=false"
 
-        if (response.status_code == 200):
-            content = json.loads(data)
+        return ("GET", url, None)
+
+    def parse_route_response(self, status_code, data):
+        """ Parses the API's response to a request built for self.route
+
+        Args:
+            status_code: The HTTP status code of the response.
+            data: The body of the response as bytes.
+
+        Returns:
+            A dictionary containing the total duration in the "duration" key and
+                the total distance in the "distance" key if there are no errors;
+                False if there are errors. Distance is in meters; duration is in
+                seconds.
+        """
+
+        if (status_code == 200):
+            content = self.json_loads(data)
             if (not "error" in content):
-                return {
-                    "distance": content["routes"][0]["distance"],
-                    "duration": content["routes"][0]["duration"],
-                    "response": content
-                }
+                return self.route_result(
+                    distance = content["routes"][0]["distance"],
+                    duration = content["routes"][0]["duration"],
+                    response = content
+                )
 
         return False
 
+    def chain_limit(self, mode):
+        """ The most points a /route request may contain
+
+        Args:
+            mode: The mode the chain is routed in.
+
+        Returns:
+            The smaller of self.max_viaroute_size and the number of points
+                that fit in self.max_url_length.
+        """
+
+        # Each point costs at most "-180.000000,-90.000000;"
+        base_length = len("http://%s/route/v1/%s/?overview=false" % (
+            self.entrypoint, self.map_mode(mode)
+        ))
+        return min(self.max_viaroute_size,
+                   (self.max_url_length - base_length) // 23)
+
+    def build_chain_request(self, points, mode = "walk"):
+        """ Builds the request sent by self.route_chain for a run of points
+
+        Args:
+            points: A list of (long, lat) points.
+            mode: A key of the self.mode_map dictionary that will be remapped to
+                a different string and passed to the API.
+
+        Returns:
+            A (method, url, request_json) tuple.
+        """
+
+        url = ("http://%s/route/v1/%s/%s?overview=false" % (
+            self.entrypoint,
+            self.map_mode(mode),
+            ";".join(["%f,%f" % (point[0], point[1]) for point in points])
+        ))
+
+        return ("GET", url, None)
+
+    def parse_chain_response(self, status_code, data):
+        """ Parses the API's response to a request built for self.route_chain
+
+        Args:
+            status_code: The HTTP status code of the response.
+            data: The body of the response as bytes.
+
+        Returns:
+            A list of (distance, duration) tuples, one per leg, if there are no
+                errors; False if there are errors.
+        """
+
+        if (status_code == 200):
+            content = self.json_loads(data)
+            if (content.get("code") == "Ok"):
+                return [(leg["distance"], leg["duration"])
+                        for leg in content["routes"][0]["legs"]]
+
+        return False
+
+    def matrix(self, origins, destinations, mode = "walk"):
+        """ Routes the distances between many origins and destinations
+
+        The matrix is split into tiles that fit the server's table size and URL
+        limits, with one /table request sent per tile.
+
+        Args:
+            origins: An iterable containing (long, lat) tuples or lists.
+            destinations: An iterable containing (long, lat) tuples or lists.
+            mode: A key of the self.mode_map dictionary that will be remapped to
+                a different string and passed to the API.
+
+        Returns:
+            A dictionary containing rows of durations in the "duration" key and
+                rows of distances in the "distance" key, where row i, column j
+                describes the route from origins[i] to destinations[j]. Cells
+                that could not be routed are None. Distance is in meters;
+                duration is in seconds.
+
+        Raises:
+            requests.HTTPError: A table request was rejected by the server.
+        """
+
+        origins = list(origins)
+        destinations = list(destinations)
+        profile = self.map_mode(mode)
+
+        durations = [[None] * len(destinations) for origin in origins]
+        distances = [[None] * len(destinations) for origin in origins]
+
+        # Each coordinate costs at most "-180.000000,-90.000000;" in the path
+        # plus its index in the sources or destinations parameter
+        base_length = len("http://%s/table/v1/%s/?sources=&destinations="
+                          "&annotations=duration,distance" % (self.entrypoint,
+                                                               profile))
+        location_length = 23 + len(str(len(origins) + len(destinations))) + 1
+
+        tile_rows, tile_cols = matrix_tile_shape(
+            len(origins), len(destinations),
+            max_elements = self.max_table_size ** 2,
+            max_locations = ((self.max_url_length - base_length)
+                             // location_length)
+        )
+
+        for (row_start, row_end, col_start, col_end) in matrix_tiles(
+                len(origins), len(destinations), tile_rows, tile_cols):
+            tile_origins = origins[row_start:row_end]
+            tile_destinations = destinations[col_start:col_end]
+            n_origins = len(tile_origins)
+
+            url = ("http://%s/table/v1/%s/%s"
+                   "?sources=%s&destinations=%s"
+                   "&annotations=duration,distance" % (
+                self.entrypoint,
+                profile,
+                ";".join(["%f,%f" % (coord[0], coord[1])
+                          for coord in tile_origins + tile_destinations]),
+                ";".join([str(i) for i in range(n_origins)]),
+                ";".join([str(i) for i in range(n_origins, n_origins
+                                                + len(tile_destinations))])
+            ))
+
+            self.log("Sending request: %s", url)
+            response = self.http_request("GET", url)
+            data = response.content
+            self.log("Response: %s", ResponseText(data))
+            response.raise_for_status()
+
+            content = self.json_loads(data)
+            for (i, row) in enumerate(content["durations"]):
+                durations[row_start + i][col_start:col_end] = row
+            for (i, row) in enumerate(content["distances"]):
+                distances[row_start + i][col_start:col_end] = row
+
+        return {
+            "duration": durations,
+            "distance": distances
+        }
+
 class ValhallaDistances(Distances):
     """ Subclass of Distances that uses Valhalla as a backend """
 
-    def __init__(self, entrypoint = DEFAULT_ENTRYPOINT, *args, **kwargs):
+    def __init__(self, entrypoint = DEFAULT_ENTRYPOINT, *args,
+                 max_matrix_locations = DEFAULT_VALHALLA_MAX_MATRIX_LOCATIONS,
+                 max_matrix_location_pairs =
+                     DEFAULT_VALHALLA_MAX_MATRIX_LOCATION_PAIRS,
+                 max_locations = DEFAULT_VALHALLA_MAX_LOCATIONS, **kwargs):
         """ Initializes the ValhallaDistances class
 
         Args:
-            entrypoint: The base URL containing the API entrypoint.
+            entrypoint: The base URL containing the API entrypoint, or
+                several replicas of it; see Distances.set_entrypoint.
+            max_matrix_locations: The server's max_matrix_locations service
+                limit, which caps the number of sources and the number of
+                targets in a matrix request. None disables the limit.
+            max_matrix_location_pairs: The server's max_matrix_location_pairs
+                service limit, which caps the number of source-target pairs in
+                a matrix request. None disables the limit.
+            max_locations: The server's max_locations service limit, which
+                caps the number of locations in a route request. None
+                disables the limit.
         """
 
         Distances.__init__(self, *args, **kwargs)
-        self.entrypoint = entrypoint
+        self.set_entrypoint(entrypoint)
+        self.max_matrix_locations = max_matrix_locations
+        self.max_matrix_location_pairs = max_matrix_location_pairs
+        self.max_locations = max_locations
         self.mode_map = {
             "bike": "bicycle",
             "drive": "auto",
@@ -546,6 +2099,18 @@ class ValhallaDistances(Distances):
             "walk": "pedestrian"
         }
 
+    def avoid_locations(self, avoid):
+        """ Converts locations to avoid into Valhalla's avoid_locations format
+
+        Args:
+            avoid: An array of (long, lat) pairs to be avoided.
+
+        Returns:
+            A list of location dictionaries.
+        """
+
+        return [{"lat": x[0], "lon": x[1]} for x in avoid]
+
     def route(self, from_long, from_lat, to_long, to_lat, mode = "walk",
                   avoid = []):
         """ Routes the distance between two coordinates
@@ -566,6 +2131,22 @@ class ValhallaDistances(Distances):
                 seconds.
         """
 
+        return self.send_route_request(self.build_route_request(
+            from_long, from_lat, to_long, to_lat, mode, avoid
+        ))
+
+    def build_route_request(self, from_long, from_lat, to_long, to_lat,
+                            mode = "walk", avoid = []):
+        """ Builds the request sent by self.route
+
+        Args:
+            See self.route.
+
+        Returns:
+            A (method, url, request_json) tuple describing the request to send
+                to the API for self.route.
+        """
+
         request_json = {
             "locations": [
                 {"lon": from_long, "lat": from_lat},
@@ -578,43 +2159,208 @@ class ValhallaDistances(Distances):
         }
 
         if (len(avoid) > 0):
-            request_json["avoid_locations"] = [
-                {"lat": x[0], "lon": x[1]} for x in avoid
-            ]
+            request_json["avoid_locations"] = self.avoid_locations(avoid)
 
-        self.log("Sending request JSON to %s: %s" % (self.entrypoint,
-                                                     request_json))
-        response = requests.post(
-            "http://%s/route" % self.entrypoint,
-            json = request_json,
-            timeout = self.timeout
-        )
-        data = response.content.decode()
-        self.log("Response: %s" % data)
+        if (self.lean):
+            request_json["directions_options"]["directions_type"] = "none"
 
-        if (response.status_code == 200):
-            content = json.loads(data)
+        return ("POST", "http://%s/route" % self.entrypoint, request_json)
+
+    def parse_route_response(self, status_code, data):
+        """ Parses the API's response to a request built for self.route
+
+        Args:
+            status_code: The HTTP status code of the response.
+            data: The body of the response as bytes.
+
+        Returns:
+            A dictionary containing the total duration in the "duration" key and
+                the total distance in the "distance" key if there are no errors;
+                False if there are errors. Distance is in meters; duration is in
+                seconds.
+        """
+
+        if (status_code == 200):
+            content = self.json_loads(data)
             if (not "error" in content):
-                return {
-                    "distance": content["trip"]["legs"][0]["summary"]["length"] * 1000,
-                    "duration": content["trip"]["legs"][0]["summary"]["time"],
-                    "response": content
-                }
+                return self.route_result(
+                    distance = content["trip"]["legs"][0]["summary"]["length"] * 1000,
+                    duration = content["trip"]["legs"][0]["summary"]["time"],
+                    response = content
+                )
 
         return False
 
+    def chain_limit(self, mode):
+        """ The most locations a /route request may contain
+
+        Args:
+            mode: The mode the chain is routed in.
+
+        Returns:
+            self.max_locations.
+        """
+
+        return self.max_locations
+
+    def build_chain_request(self, points, mode = "walk", avoid = []):
+        """ Builds the request sent by self.route_chain for a run of points
+
+        Args:
+            points: A list of (long, lat) points.
+            mode: A key of the self.mode_map dictionary that will be remapped to
+                a different string and passed to the API.
+            avoid: An array of (long, lat) pairs to be avoided.
+
+        Returns:
+            A (method, url, request_json) tuple.
+        """
+
+        request_json = {
+            "locations": [{"lon": point[0], "lat": point[1]}
+                          for point in points],
+            "costing": self.map_mode(mode),
+            "directions_options": {
+                "units": "kilometers",
+                "directions_type": "none"
+            }
+        }
+
+        if (len(avoid) > 0):
+            request_json["avoid_locations"] = self.avoid_locations(avoid)
+
+        return ("POST", "http://%s/route" % self.entrypoint, request_json)
+
+    def parse_chain_response(self, status_code, data):
+        """ Parses the API's response to a request built for self.route_chain
+
+        Args:
+            status_code: The HTTP status code of the response.
+            data: The body of the response as bytes.
+
+        Returns:
+            A list of (distance, duration) tuples, one per leg, if there are no
+                errors; False if there are errors.
+        """
+
+        if (status_code == 200):
+            content = self.json_loads(data)
+            if (not "error" in content):
+                return [(leg["summary"]["length"] * 1000,
+                         leg["summary"]["time"])
+                        for leg in content["trip"]["legs"]]
+
+        return False
+
+    def matrix(self, origins, destinations, mode = "walk", avoid = []):
+        """ Routes the distances between many origins and destinations
+
+        The matrix is split into tiles that fit the server's matrix service
+        limits, with one /sources_to_targets request sent per tile.
+
+        Args:
+            origins: An iterable containing (long, lat) tuples or lists.
+            destinations: An iterable containing (long, lat) tuples or lists.
+            mode: A key of the self.mode_map dictionary that will be remapped to
+                a different string and passed to the API.
+            avoid: An array of (long, lat) pairs to be avoided.
+
+        Returns:
+            A dictionary containing rows of durations in the "duration" key and
+                rows of distances in the "distance" key, where row i, column j
+                describes the route from origins[i] to destinations[j]. Cells
+                that could not be routed are None. Distance is in meters;
+                duration is in seconds.
+
+        Raises:
+            requests.HTTPError: A matrix request was rejected by the server.
+        """
+
+        origins = list(origins)
+        destinations = list(destinations)
+
+        durations = [[None] * len(destinations) for origin in origins]
+        distances = [[None] * len(destinations) for origin in origins]
+
+        request_base = {
+            "costing": self.map_mode(mode),
+            "units": "kilometers"
+        }
+        if (len(avoid) > 0):
+            request_base["avoid_locations"] = self.avoid_locations(avoid)
+
+        tile_rows, tile_cols = matrix_tile_shape(
+            len(origins), len(destinations),
+            max_rows = self.max_matrix_locations,
+            max_cols = self.max_matrix_locations,
+            max_elements = self.max_matrix_location_pairs
+        )
+
+        for (row_start, row_end, col_start, col_end) in matrix_tiles(
+                len(origins), len(destinations), tile_rows, tile_cols):
+            request_json = dict(request_base)
+            request_json["sources"] = [
+                {"lon": coord[0], "lat": coord[1]}
+                for coord in origins[row_start:row_end]
+            ]
+            request_json["targets"] = [
+                {"lon": coord[0], "lat": coord[1]}
+                for coord in destinations[col_start:col_end]
+            ]
+
+            self.log("Sending request JSON to %s: %s", self.entrypoint,
+                     request_json)
+            response = self.http_request(
+                "POST",
+                "http://%s/sources_to_targets" % self.entrypoint,
+                json = request_json
+            )
+            data = response.content
+            self.log("Response: %s", ResponseText(data))
+            response.raise_for_status()
+
+            content = self.json_loads(data)
+            for row in content["sources_to_targets"]:
+                for cell in row:
+                    i = row_start + cell["from_index"]
+                    j = col_start + cell["to_index"]
+                    if (cell.get("time") is not None):
+                        durations[i][j] = cell["time"]
+                    if (cell.get("distance") is not None):
+                        distances[i][j] = cell["distance"] * 1000
+
+        return {
+            "duration": durations,
+            "distance": distances
+        }
+
 class GraphHopperDistances(Distances):
     """ Subclass of Distances that uses GraphHopper as a backend """
 
-    def __init__(self, entrypoint = DEFAULT_ENTRYPOINT, *args, **kwargs):
+    def __init__(self, entrypoint = DEFAULT_ENTRYPOINT, *args,
+                 max_waypoints = None,
+                 max_matrix_locations =
+                     DEFAULT_GRAPHHOPPER_MAX_MATRIX_LOCATIONS,
+                 max_url_length = DEFAULT_MAX_URL_LENGTH, **kwargs):
         """ Initializes the GraphHopperDistances class
 
         Args:
-            entrypoint: The base URL containing the API entrypoint.
+            entrypoint: The base URL containing the API entrypoint, or
+                several replicas of it; see Distances.set_entrypoint.
+            max_waypoints: The most points the server accepts in a route
+                request, or None for no limit.
+            max_matrix_locations: The most origins, and the most
+                destinations, to send in one matrix request. None disables
+                the limit.
+            max_url_length: The longest URL the server accepts. Longer matrix
+                requests are sent as POST requests instead.
         """
 
         Distances.__init__(self, *args, **kwargs)
-        self.entrypoint = entrypoint
+        self.set_entrypoint(entrypoint)
+        self.max_waypoints = max_waypoints
+        self.max_matrix_locations = max_matrix_locations
+        self.max_url_length = max_url_length
         self.mode_map = {
             "bike": "bike",
             "drive": "car",
@@ -641,6 +2387,21 @@ class GraphHopperDistances(Distances):
                 seconds.
         """
 
+        return self.send_route_request(self.build_route_request(
+            from_long, from_lat, to_long, to_lat, mode
+        ))
+
+    def build_route_request(self, from_long, from_lat, to_long, to_lat,
+                            mode = "walk", *args, **kwargs):
+        """ Builds the request sent by self.route
+
+        Args:
+            See self.route.
+
+        Returns:
+            A (method, url, request_json) tuple describing the request to send
+                to the API for self.route.
+        """
 
         url = ("http://%s/route?"
                "point=%f,%f&point=%f,%f"
@@ -650,18 +2411,204 @@ class GraphHopperDistances(Distances):
             self.map_mode(mode)
         ))
 
-        self.log("Sending request: %s" % url)
-        response = requests.get(url, timeout = self.timeout)
-        data = response.content.decode()
-        self.log("Response: %s" % data)
+        if (self.lean):
+            url += "&instructions=false&calc_points=false"
 
-        if (response.status_code == 200):
-            content = json.loads(data)
+        return ("GET", url, None)
+
+    def parse_route_response(self, status_code, data):
+        """ Parses the API's response to a request built for self.route
+
+        Args:
+            status_code: The HTTP status code of the response.
+            data: The body of the response as bytes.
+
+        Returns:
+            A dictionary containing the total duration in the "duration" key and
+                the total distance in the "distance" key if there are no errors;
+                False if there are errors. Distance is in meters; duration is in
+                seconds.
+        """
+
+        if (status_code == 200):
+            content = self.json_loads(data)
             if (not "error" in content):
-                return {
-                    "distance": content["paths"][0]["distance"],
-                    "duration": content["paths"][0]["time"] / 1000,
-                    "response": content
-                }
+                return self.route_result(
+                    distance = content["paths"][0]["distance"],
+                    duration = content["paths"][0]["time"] / 1000,
+                    response = content
+                )
 
         return False
+
+    def chain_limit(self, mode):
+        """ The most points a /route request may contain
+
+        Args:
+            mode: The mode the chain is routed in.
+
+        Returns:
+            The number of points that fit in self.max_url_length, or
+                self.max_waypoints if that is smaller.
+        """
+
+        # Each point costs at most "&point=-90.000000,-180.000000"
+        base_length = len(self.build_chain_request([], mode)[1])
+        limit = (self.max_url_length - base_length) // 29
+        if (self.max_waypoints is not None):
+            limit = min(limit, self.max_waypoints)
+        return limit
+
+    def build_chain_request(self, points, mode = "walk"):
+        """ Builds the request sent by self.route_chain for a run of points
+
+        Per-leg times and distances are read from the leg_time and
+        leg_distance path details, which GraphHopper 4 and later provide.
+
+        Args:
+            points: A list of (long, lat) points.
+            mode: A key of the self.mode_map dictionary that will be remapped to
+                a different string and passed to the API.
+
+        Returns:
+            A (method, url, request_json) tuple.
+        """
+
+        url = ("http://%s/route?%s&vehicle=%s&instructions=false"
+               "&details=leg_time&details=leg_distance" % (
+            self.entrypoint,
+            "&".join(["point=%f,%f" % (point[1], point[0])
+                      for point in points]),
+            self.map_mode(mode)
+        ))
+
+        return ("GET", url, None)
+
+    def parse_chain_response(self, status_code, data):
+        """ Parses the API's response to a request built for self.route_chain
+
+        Args:
+            status_code: The HTTP status code of the response.
+            data: The body of the response as bytes.
+
+        Returns:
+            A list of (distance, duration) tuples, one per leg, if there are no
+                errors; False if there are errors.
+        """
+
+        if (status_code == 200):
+            content = self.json_loads(data)
+            if (not "error" in content and "paths" in content):
+                path = content["paths"][0]
+                details = path.get("details", {})
+                if ("leg_time" in details and "leg_distance" in details):
+                    return [
+                        (distance[2], time[2] / 1000)
+                        for (distance, time) in zip(details["leg_distance"],
+                                                    details["leg_time"])
+                    ]
+                # Servers without leg details can still route a single leg
+                return [(path["distance"], path["time"] / 1000)]
+
+        return False
+
+    def build_matrix_request(self, origins, destinations, mode = "walk"):
+        """ Builds a /matrix request for one tile of self.matrix
+
+        The request is a GET request if its URL fits in self.max_url_length,
+        and a POST request otherwise.
+
+        Args:
+            origins: A list of (long, lat) points.
+            destinations: A list of (long, lat) points.
+            mode: A key of the self.mode_map dictionary that will be remapped to
+                a different string and passed to the API.
+
+        Returns:
+            A (method, url, request_json) tuple.
+        """
+
+        url = ("http://%s/matrix?%s&%s&vehicle=%s"
+               "&out_array=times&out_array=distances&fail_fast=false" % (
+            self.entrypoint,
+            "&".join(["from_point=%f,%f" % (point[1], point[0])
+                      for point in origins]),
+            "&".join(["to_point=%f,%f" % (point[1], point[0])
+                      for point in destinations]),
+            self.map_mode(mode)
+        ))
+
+        if (len(url) <= self.max_url_length):
+            return ("GET", url, None)
+
+        # Points in a POST request are [long, lat], unlike in a GET request
+        return ("POST", "http://%s/matrix" % self.entrypoint, {
+            "from_points": [[point[0], point[1]] for point in origins],
+            "to_points": [[point[0], point[1]] for point in destinations],
+            "vehicle": self.map_mode(mode),
+            "out_arrays": ["times", "distances"],
+            "fail_fast": False
+        })
+
+    def matrix(self, origins, destinations, mode = "walk"):
+        """ Routes the distances between many origins and destinations
+
+        The matrix is split into tiles of at most self.max_matrix_locations
+        origins and destinations, with one /matrix request sent per tile.
+
+        Args:
+            origins: An iterable containing (long, lat) tuples or lists.
+            destinations: An iterable containing (long, lat) tuples or lists.
+            mode: A key of the self.mode_map dictionary that will be remapped to
+                a different string and passed to the API.
+
+        Returns:
+            A dictionary containing rows of durations in the "duration" key and
+                rows of distances in the "distance" key, where row i, column j
+                describes the route from origins[i] to destinations[j]. Cells
+                that could not be routed are None. Distance is in meters;
+                duration is in seconds.
+
+        Raises:
+            requests.HTTPError: A matrix request was rejected by the server.
+        """
+
+        origins = list(origins)
+        destinations = list(destinations)
+
+        durations = [[None] * len(destinations) for origin in origins]
+        distances = [[None] * len(destinations) for origin in origins]
+
+        tile_rows, tile_cols = matrix_tile_shape(
+            len(origins), len(destinations),
+            max_rows = self.max_matrix_locations,
+            max_cols = self.max_matrix_locations
+        )
+
+        for (row_start, row_end, col_start, col_end) in matrix_tiles(
+                len(origins), len(destinations), tile_rows, tile_cols):
+            (method, url, request_json) = self.build_matrix_request(
+                origins[row_start:row_end], destinations[col_start:col_end],
+                mode
+            )
+
+            if (request_json is None):
+                self.log("Sending request: %s", url)
+            else:
+                self.log("Sending request JSON to %s: %s", url, request_json)
+            response = self.http_request(method, url, json = request_json)
+            data = response.content
+            self.log("Response: %s", ResponseText(data))
+            response.raise_for_status()
+
+            # Unlike /route, /matrix reports times in seconds
+            content = self.json_loads(data)
+            for (i, row) in enumerate(content["times"]):
+                durations[row_start + i][col_start:col_end] = row
+            for (i, row) in enumerate(content["distances"]):
+                distances[row_start + i][col_start:col_end] = row
+
+        return {
+            "duration": durations,
+            "distance": distances
+        }
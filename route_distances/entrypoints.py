@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# Load balancing and failover across replicas of a self-hosted backend
+
+import logging
+import threading
+import time
+
+import requests
+
+# Strategies EntrypointPool can dispatch requests with
+LEAST_OUTSTANDING = "least_outstanding"
+WEIGHTED_ROUND_ROBIN = "weighted_round_robin"
+
+# Default number of consecutive failures after which a replica is ejected
+DEFAULT_FAILURE_THRESHOLD = 3
+
+# Default number of seconds an ejected replica is left out of rotation
+DEFAULT_EJECT_TIME = 30
+
+# Default path requested by health checks; any response below 500 passes
+DEFAULT_HEALTH_PATH = "/"
+
+# Default timeout, in seconds, of a health check request
+DEFAULT_HEALTH_TIMEOUT = 5
+
+logger = logging.getLogger("route_distances")
+
+class EntrypointPool(object):
+    """ Dispatches requests across several replicas of a backend
+
+    Each request is sent to the replica chosen by the pool's strategy:
+    LEAST_OUTSTANDING picks the replica with the fewest requests in flight
+    relative to its weight, and WEIGHTED_ROUND_ROBIN cycles through replicas
+    in proportion to their weights. A replica that fails failure_threshold
+    requests in a row, or fails a health check, is ejected for eject_time
+    seconds; after that it is put back in rotation, and ejected again by its
+    next failure. If every replica is ejected, the one that is due back
+    soonest is used rather than failing outright.
+
+    If health_check_interval is given, a daemon thread requests
+    health_path from every replica that often.
+
+    The pool is safe to share between threads and between Distances
+    instances.
+
+    Attributes:
+        entrypoints: The list of replica entrypoints, e.g. "host:port".
+        weights: A dictionary mapping entrypoints to their weights.
+        strategy: LEAST_OUTSTANDING or WEIGHTED_ROUND_ROBIN.
+        failure_threshold: The number of consecutive failures after which a
+            replica is ejected.
+        eject_time: The number of seconds an ejected replica is left out.
+        health_path: The path requested by health checks.
+        health_check_interval: The number of seconds between health checks,
+            or None if they are only run by calling check_health.
+    """
+
+    def __init__(self, entrypoints, strategy = LEAST_OUTSTANDING,
+                 failure_threshold = DEFAULT_FAILURE_THRESHOLD,
+                 eject_time = DEFAULT_EJECT_TIME,
+                 health_path = DEFAULT_HEALTH_PATH,
+                 health_check_interval = None,
+                 health_timeout = DEFAULT_HEALTH_TIMEOUT):
+        """ Initializes the EntrypointPool class
+
+        Args:
+            entrypoints: A list of entrypoints, or a dictionary mapping
+                entrypoints to positive weights. Entrypoints in a list have a
+                weight of 1.
+            strategy: LEAST_OUTSTANDING or WEIGHTED_ROUND_ROBIN.
+            failure_threshold: The number of consecutive failures after which
+                a replica is ejected.
+            eject_time: The number of seconds an ejected replica is left out.
+            health_path: The path requested by health checks.
+            health_check_interval: The number of seconds between background
+                health checks, or None for no background checks.
+            health_timeout: The timeout, in seconds, of a health check.
+        """
+
+        if (not isinstance(entrypoints, dict)):
+            entrypoints = dict((entrypoint, 1) for entrypoint in entrypoints)
+        if (len(entrypoints) == 0):
+            raise ValueError("An entrypoint pool needs at least one entrypoint")
+        if (strategy not in (LEAST_OUTSTANDING, WEIGHTED_ROUND_ROBIN)):
+            raise ValueError("Unknown strategy: %s" % strategy)
+
+        self.entrypoints = list(entrypoints)
+        self.weights = dict(entrypoints)
+        self.strategy = strategy
+        self.failure_threshold = failure_threshold
+        self.eject_time = eject_time
+        self.health_path = health_path
+        self.health_check_interval = health_check_interval
+        self.health_timeout = health_timeout
+
+        self.lock = threading.Lock()
+        self.outstanding = dict((entrypoint, 0) for entrypoint in entrypoints)
+        self.requests = dict((entrypoint, 0) for entrypoint in entrypoints)
+        self.failures = dict((entrypoint, 0) for entrypoint in entrypoints)
+        self.ejected_until = dict((entrypoint, 0) for entrypoint in entrypoints)
+        # Smooth weighted round robin state, as in nginx
+        self.current_weights = dict((entrypoint, 0)
+                                    for entrypoint in entrypoints)
+        self.next_index = 0
+
+        self._stop = threading.Event()
+        self._health_thread = None
+        if (health_check_interval is not None):
+            self._health_thread = threading.Thread(
+                target = self._health_loop, name = "route_distances-health",
+                daemon = True
+            )
+            self._health_thread.start()
+
+    def __len__(self):
+        return len(self.entrypoints)
+
+    def acquire(self, exclude = ()):
+        """ Chooses the replica to send a request to
+
+        Every call must be matched by a call to self.release.
+
+        Args:
+            exclude: A collection of entrypoints not to choose, e.g. those a
+                request has already failed on.
+
+        Returns:
+            An entrypoint, or None if every entrypoint is excluded.
+        """
+
+        now = time.time()
+
+        with self.lock:
+            candidates = [entrypoint for entrypoint in self.entrypoints
+                          if entrypoint not in exclude]
+            if (len(candidates) == 0):
+                return None
+
+            healthy = [entrypoint for entrypoint in candidates
+                       if self.ejected_until[entrypoint] <= now]
+
+            if (len(healthy) == 0):
+                chosen = min(candidates,
+                             key = lambda entrypoint:
+                                 self.ejected_until[entrypoint])
+            elif (self.strategy == LEAST_OUTSTANDING):
+                # Rotate the starting point so ties are spread evenly
+                start = self.next_index % len(healthy)
+                self.next_index += 1
+                rotated = healthy[start:] + healthy[:start]
+                chosen = min(rotated,
+                             key = lambda entrypoint:
+                                 self.outstanding[entrypoint]
+                                 / self.weights[entrypoint])
+            else:
+                total = 0
+                for entrypoint in healthy:
+                    self.current_weights[entrypoint] += \
+                        self.weights[entrypoint]
+                    total += self.weights[entrypoint]
+                chosen = max(healthy,
+                             key = lambda entrypoint:
+                                 self.current_weights[entrypoint])
+                self.current_weights[chosen] -= total
+
+            self.outstanding[chosen] += 1
+            self.requests[chosen] += 1
+            return chosen
+
+    def release(self, entrypoint, success):
+        """ Records the outcome of a request sent to a replica
+
+        Args:
+            entrypoint: An entrypoint returned by self.acquire.
+            success: A boolean telling whether the replica answered normally.
+                Connection errors, timeouts and overloaded responses are
+                failures. None releases the replica without recording an
+                outcome, for requests abandoned for other reasons.
+        """
+
+        with self.lock:
+            self.outstanding[entrypoint] -= 1
+            if (success is not None):
+                self._record(entrypoint, success)
+
+    def _record(self, entrypoint, success):
+        """ Updates a replica's health; self.lock must be held """
+
+        if (success):
+            self.failures[entrypoint] = 0
+            self.ejected_until[entrypoint] = 0
+            return
+
+        self.failures[entrypoint] += 1
+        if (self.failures[entrypoint] >= self.failure_threshold):
+            if (self.ejected_until[entrypoint] <= time.time()):
+                logger.warning("Ejecting %s after %d failures", entrypoint,
+                               self.failures[entrypoint])
+            self.ejected_until[entrypoint] = time.time() + self.eject_time
+
+    def check_health(self, session = None):
+        """ Requests self.health_path from every replica, ejecting those that
+        fail and restoring those that pass
+
+        Args:
+            session: A requests.Session to send the checks with, or None.
+
+        Returns:
+            A dictionary mapping entrypoints to booleans telling whether they
+                passed.
+        """
+
+        session = session or requests
+        results = {}
+
+        for entrypoint in self.entrypoints:
+            try:
+                response = session.get(
+                    "http://%s%s" % (entrypoint, self.health_path),
+                    timeout = self.health_timeout
+                )
+                healthy = response.status_code < 500
+            except requests.RequestException:
+                healthy = False
+
+            with self.lock:
+                if (healthy):
+                    self._record(entrypoint, True)
+                else:
+                    self.failures[entrypoint] = max(
+                        self.failures[entrypoint], self.failure_threshold - 1
+                    )
+                    self._record(entrypoint, False)
+            results[entrypoint] = healthy
+
+        return results
+
+    def _health_loop(self):
+        """ Runs health checks until self.close is called """
+
+        with requests.Session() as session:
+            while (not self._stop.wait(self.health_check_interval)):
+                self.check_health(session)
+
+    def is_ejected(self, entrypoint):
+        """ Tells whether a replica is currently left out of rotation """
+
+        return self.ejected_until[entrypoint] > time.time()
+
+    def stats(self):
+        """ Returns a dictionary of per-replica counters """
+
+        with self.lock:
+            return dict(
+                (entrypoint, {
+                    "weight": self.weights[entrypoint],
+                    "outstanding": self.outstanding[entrypoint],
+                    "requests": self.requests[entrypoint],
+                    "failures": self.failures[entrypoint],
+                    "ejected": self.is_ejected(entrypoint)
+                })
+                for entrypoint in self.entrypoints
+            )
+
+    def close(self):
+        """ Stops background health checks, if any """
+
+        self._stop.set()
+        if (self._health_thread is not None):
+            self._health_thread.join()
+            self._health_thread = None
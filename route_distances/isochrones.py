@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# Isochrone geometries and vectorized reachability queries
+
+from shapely import geometry
+import numpy
+import shapely
+
+class Isochrones(object):
+    """ Nested isochrones around one origin for several travel time cutoffs
+
+    The geometries are prepared when the object is created, so repeated
+    reachability queries against them are fast.
+
+    Attributes:
+        origin: The (long, lat) of the origin.
+        cutoffs: A sorted list of travel time cutoffs, in seconds.
+        geometries: A list of shapely (Multi)Polygons, one per cutoff, in the
+            same order as cutoffs. Geometries for cutoffs with no reachable
+            area are empty.
+    """
+
+    def __init__(self, origin, cutoffs, geometries):
+        """ Initializes the Isochrones class
+
+        Args:
+            origin: The (long, lat) of the origin.
+            cutoffs: An iterable of cutoffs, in seconds.
+            geometries: An iterable of shapely geometries, one per cutoff.
+        """
+
+        pairs = sorted(zip(cutoffs, geometries), key = lambda pair: pair[0])
+
+        self.origin = tuple(origin)
+        self.cutoffs = [cutoff for (cutoff, geom) in pairs]
+        self.geometries = [geom for (cutoff, geom) in pairs]
+
+        for geom in self.geometries:
+            shapely.prepare(geom)
+
+    @classmethod
+    def from_geojson(cls, origin, features, cutoffs):
+        """ Builds isochrones from the features of an OTP isochrone response
+
+        Args:
+            origin: The (long, lat) of the origin.
+            features: A list of GeoJSON features, each with a "time" property
+                giving its cutoff in seconds.
+            cutoffs: The cutoffs that were requested, used to fill in cutoffs
+                OTP returned no feature for.
+
+        Returns:
+            An Isochrones object.
+        """
+
+        by_cutoff = dict(
+            (cutoff, geometry.MultiPolygon()) for cutoff in cutoffs
+        )
+
+        for feature in features:
+            cutoff = int(feature["properties"]["time"])
+            if (len(feature["geometry"]["coordinates"]) > 0):
+                by_cutoff[cutoff] = geometry.shape(feature["geometry"])
+
+        return cls(origin, by_cutoff.keys(), by_cutoff.values())
+
+    def to_geojson(self):
+        """ Returns the isochrones as a list of GeoJSON features
+
+        The features have the same form as those of an OTP isochrone response,
+        so from_geojson can rebuild the object from them.
+        """
+
+        return [
+            {
+                "type": "Feature",
+                "properties": {"time": cutoff},
+                "geometry": geometry.mapping(geom)
+            }
+            for (cutoff, geom) in self
+        ]
+
+    def __len__(self):
+        return len(self.cutoffs)
+
+    def __getitem__(self, cutoff):
+        """ Returns the geometry for a cutoff, in seconds """
+
+        return self.geometries[self.cutoffs.index(cutoff)]
+
+    def __iter__(self):
+        return iter(zip(self.cutoffs, self.geometries))
+
+    def reachable(self, points, cutoff = None):
+        """ Tests which points lie within the isochrones
+
+        Points are tested against every band at once with shapely's vectorized
+        predicates. Since the bands are nested, each smaller band is only
+        tested against the points inside the next larger one.
+
+        Args:
+            points: An array-like of (long, lat) pairs with shape (n, 2).
+            cutoff: A cutoff, in seconds, to test against, or None to test
+                against every cutoff.
+
+        Returns:
+            If cutoff is given, a boolean numpy array telling whether each
+                point is within that cutoff. Otherwise, a float numpy array
+                giving for each point the smallest cutoff it is within, or NaN
+                if it is outside every isochrone.
+        """
+
+        points = numpy.asarray(points, dtype = float).reshape(-1, 2)
+
+        if (cutoff is not None):
+            return shapely.contains_xy(self[cutoff], points[:, 0],
+                                       points[:, 1])
+
+        result = numpy.full(len(points), numpy.nan)
+        candidates = numpy.arange(len(points))
+
+        for (cutoff, geom) in reversed(list(self)):
+            # An empty band says nothing about the smaller bands inside it
+            if (geom.is_empty):
+                continue
+            inside = shapely.contains_xy(geom, points[candidates, 0],
+                                         points[candidates, 1])
+            candidates = candidates[inside]
+            result[candidates] = cutoff
+            if (len(candidates) == 0):
+                break
+
+        return result
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# Streaming, resumable routing of origin-destination files
+
+import collections
+import csv
+import json
+import os
+
+try:
+    from . import distances
+except:
+    import distances
+
+# Default number of routed pairs between checkpoints
+DEFAULT_CHECKPOINT_EVERY = 1000
+
+# Columns of an input file, and the order of coordinates passed to route
+PAIR_FIELDS = ["orig_long", "orig_lat", "dest_long", "dest_lat"]
+
+# Columns of an output file
+OUTPUT_FIELDS = ["index", "id", "distance", "duration", "error"]
+
+def file_format(path):
+    """ Guesses whether a file is CSV or JSON Lines from its extension
+
+    Args:
+        path: The path of the file.
+
+    Returns:
+        "jsonl" if the path ends in .jsonl, .ndjson or .json; "csv" otherwise.
+    """
+
+    if (os.path.splitext(path)[1].lower() in (".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    return "csv"
+
+def read_pairs(path, input_format = None, skip = 0):
+    """ Streams origin-destination pairs from a CSV or JSON Lines file
+
+    Each row or object must have orig_long, orig_lat, dest_long and dest_lat
+    fields, and may have an id field. Only one row is held in memory at a time.
+
+    Args:
+        path: The path of the file.
+        input_format: "csv" or "jsonl", or None to guess from the extension.
+        skip: The number of pairs at the start of the file to skip.
+
+    Yields:
+        (index, id, (orig_long, orig_lat, dest_long, dest_lat)) tuples, where
+            index counts pairs from 0 and id defaults to index.
+    """
+
+    input_format = input_format or file_format(path)
+
+    with open(path, newline = "") as f:
+        if (input_format == "csv"):
+            records = csv.DictReader(f)
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+
+        for (index, record) in enumerate(records):
+            if (index < skip):
+                continue
+            yield (index, record.get("id", index),
+                   tuple(float(record[field]) for field in PAIR_FIELDS))
+
+class Checkpoint(object):
+    """ Records how far a job has written its output
+
+    The checkpoint is a small JSON file next to the output file. It records
+    the number of pairs completed and the size of the output file after they
+    were written, so a restarted job can drop any partially written rows and
+    skip the completed pairs.
+
+    Attributes:
+        path: The path of the checkpoint file.
+        completed: The number of pairs completed.
+        output_size: The size of the output file, in bytes, after the
+            completed pairs were written.
+    """
+
+    def __init__(self, path):
+        """ Initializes the Checkpoint class, loading the file if it exists
+
+        Args:
+            path: The path of the checkpoint file.
+        """
+
+        self.path = path
+        self.completed = 0
+        self.output_size = 0
+
+        if (os.path.exists(path)):
+            with open(path) as f:
+                state = json.load(f)
+            self.completed = state["completed"]
+            self.output_size = state["output_size"]
+
+    def save(self, completed, output_size):
+        """ Atomically replaces the checkpoint file
+
+        Args:
+            completed: The number of pairs completed.
+            output_size: The size of the output file, in bytes.
+        """
+
+        self.completed = completed
+        self.output_size = output_size
+
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"completed": completed, "output_size": output_size}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+def run_job(calculator, input_path, output_path, mode = "walk",
+            workers = distances.DEFAULT_WORKERS,
+            checkpoint_every = DEFAULT_CHECKPOINT_EVERY, input_format = None,
+            output_format = None, log = None, **kwargs):
+    """ Routes every pair in an input file, writing results as it goes
+
+    Pairs are streamed from the input file and routed with
+    calculator.distance_batch_iter, and results are appended to the output
+    file in input order. Every checkpoint_every pairs, and when the job stops
+    on an exception, the output file is flushed to disk and a checkpoint is
+    saved to output_path + ".checkpoint".
+    If a checkpoint exists when the job starts, the job resumes after the last
+    checkpointed pair; otherwise any existing output file is replaced.
+
+    Args:
+        calculator: An instance of a Distances subclass.
+        input_path: The path of a CSV or JSON Lines file of pairs; see
+            read_pairs.
+        output_path: The path of the CSV or JSON Lines file to write results
+            to, with the columns in OUTPUT_FIELDS. A pair with no route has an
+            empty distance and duration; a pair that failed also has an
+            error message.
+        mode: A key of calculator.mode_map.
+        workers: The number of pairs to route concurrently.
+        checkpoint_every: The number of pairs between checkpoints.
+        input_format: "csv" or "jsonl", or None to guess from the extension.
+        output_format: "csv" or "jsonl", or None to guess from the extension.
+        log: A function that progress messages are passed to, or None to
+            log them to the route_distances logger at the INFO level.
+        **kwargs: Extra arguments passed to calculator.route, e.g.
+            departure_time.
+
+    Returns:
+        The total number of pairs completed, including those completed by
+            earlier runs.
+    """
+
+    if (log is None):
+        log = distances.logger.info
+
+    output_format = output_format or file_format(output_path)
+    checkpoint = Checkpoint(output_path + ".checkpoint")
+
+    if (checkpoint.completed > 0):
+        log("Resuming after %d completed pairs" % checkpoint.completed)
+        output = open(output_path, "r+", newline = "")
+        output.truncate(checkpoint.output_size)
+        output.seek(checkpoint.output_size)
+    else:
+        output = open(output_path, "w", newline = "")
+
+    # Ids of pairs handed to the calculator, in order, waiting for results
+    pending_ids = collections.deque()
+
+    def pairs():
+        for (index, record_id, pair) in read_pairs(
+                input_path, input_format, skip = checkpoint.completed):
+            pending_ids.append((index, record_id))
+            yield pair
+
+    completed = checkpoint.completed
+
+    with output:
+        if (output_format == "csv"):
+            writer = csv.writer(output)
+            if (completed == 0):
+                writer.writerow(OUTPUT_FIELDS)
+            write = writer.writerow
+        else:
+            write = lambda row: output.write(
+                json.dumps(dict(zip(OUTPUT_FIELDS, row))) + "\n"
+            )
+
+        try:
+            for result in calculator.distance_batch_iter(
+                    pairs(), mode = mode, workers = workers,
+                    return_exceptions = True, **kwargs):
+                (index, record_id) = pending_ids.popleft()
+
+                if (isinstance(result, Exception)):
+                    write([index, record_id, None, None, str(result) or
+                           type(result).__name__])
+                elif (result):
+                    write([index, record_id, result["distance"],
+                           result["duration"], None])
+                else:
+                    write([index, record_id, None, None, None])
+
+                completed += 1
+                if (completed % checkpoint_every == 0):
+                    output.flush()
+                    os.fsync(output.fileno())
+                    checkpoint.save(completed, output.tell())
+                    log("Completed %d pairs" % completed)
+        finally:
+            # Also checkpoint the rows written before an interruption, e.g.
+            # KeyboardInterrupt, so a rerun does not route them again
+            output.flush()
+            os.fsync(output.fileno())
+            checkpoint.save(completed, output.tell())
+
+    log("Finished after %d pairs" % completed)
+    return completed
@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+# Memory-mapped origin-destination matrices that are filled incrementally
+#
+# A store is a directory holding the origins and destinations as append-only
+# files of float64 (long, lat) pairs, and the matrix split into square blocks.
+# Every block is three .npy files under duration/, distance/ and filled/: two
+# float32 arrays and a bitmap of the cells that hold a result. Blocks are only
+# created once a cell in them is written, so adding origins or destinations
+# never rewrites existing data, and other processes can memory-map the same
+# files read-only while the store is being filled.
+
+import collections
+import json
+import os
+
+import numpy
+
+try:
+    from . import distances
+    from . import sharding
+except:
+    import distances
+    import sharding
+
+# Default number of rows and columns per block, a multiple of 8
+DEFAULT_BLOCK_SIZE = 1024
+
+# Default number of blocks a store keeps memory-mapped at once
+DEFAULT_OPEN_BLOCKS = 256
+
+# Arrays stored per block: travel times and distances, and the filled bitmap
+KINDS = ("duration", "distance")
+FILLED = "filled"
+
+class MatrixStore(object):
+    """ An origins x destinations matrix in memory-mapped blocks
+
+    Durations (seconds) and distances (meters) are float32. A cell is filled
+    once a result, or NaN for pairs without a route, has been written to it;
+    fill computes only cells that are not, so it resumes after an
+    interruption, and only routes the new rows and columns after origins or
+    destinations are added.
+
+    Only one process should write to a store at a time; any number may read
+    it, e.g. with MatrixStore(path, readonly = True).
+
+    Attributes:
+        path: The directory the store is kept in.
+        block_size: The number of rows and columns per block.
+        readonly: Whether the store was opened read-only.
+    """
+
+    def __init__(self, path, block_size = DEFAULT_BLOCK_SIZE,
+                 readonly = False, open_blocks = DEFAULT_OPEN_BLOCKS):
+        """ Opens a store, creating it if it does not exist
+
+        Args:
+            path: The directory to keep the store in.
+            block_size: The number of rows and columns per block, used when
+                the store is created; an existing store keeps its own.
+            readonly: A boolean that toggles opening the store read-only. A
+                read-only store must already exist.
+            open_blocks: The number of blocks to keep memory-mapped at once.
+
+        Raises:
+            ValueError: block_size is not a positive multiple of 8.
+        """
+
+        self.path = path
+        self.readonly = readonly
+        self.open_blocks = open_blocks
+        self._blocks = collections.OrderedDict()
+
+        meta_path = os.path.join(path, "meta.json")
+        if (os.path.exists(meta_path) or readonly):
+            with open(meta_path) as f:
+                block_size = json.load(f)["block_size"]
+        else:
+            if (block_size <= 0 or block_size % 8 != 0):
+                raise ValueError("block_size must be a positive multiple of 8")
+            for directory in (FILLED,) + KINDS:
+                os.makedirs(os.path.join(path, directory), exist_ok = True)
+            for name in ("origins", "destinations"):
+                open(os.path.join(path, name + ".f8"), "ab").close()
+            with open(meta_path, "w") as f:
+                json.dump({"block_size": block_size}, f)
+
+        self.block_size = block_size
+
+    def _points_path(self, name):
+        return os.path.join(self.path, name + ".f8")
+
+    def _points(self, name):
+        return numpy.fromfile(self._points_path(name),
+                              dtype = numpy.float64).reshape(-1, 2)
+
+    @property
+    def origins(self):
+        """ A numpy array of the (long, lat) origins, with shape (n, 2) """
+
+        return self._points("origins")
+
+    @property
+    def destinations(self):
+        """ A numpy array of the (long, lat) destinations, with shape (n, 2)
+        """
+
+        return self._points("destinations")
+
+    @property
+    def shape(self):
+        """ The (number of origins, number of destinations) """
+
+        return tuple(os.path.getsize(self._points_path(name)) // 16
+                     for name in ("origins", "destinations"))
+
+    def _add_points(self, name, points):
+        if (self.readonly):
+            raise ValueError("The store is read-only")
+
+        points = numpy.asarray(points, dtype = numpy.float64).reshape(-1, 2)
+        start = os.path.getsize(self._points_path(name)) // 16
+        with open(self._points_path(name), "ab") as f:
+            f.write(points.tobytes())
+        return range(start, start + len(points))
+
+    def add_origins(self, points):
+        """ Appends origins, as new rows to be filled
+
+        Args:
+            points: An iterable of (long, lat) points.
+
+        Returns:
+            A range of the new rows' indices.
+        """
+
+        return self._add_points("origins", points)
+
+    def add_destinations(self, points):
+        """ Appends destinations, as new columns to be filled
+
+        Args:
+            points: An iterable of (long, lat) points.
+
+        Returns:
+            A range of the new columns' indices.
+        """
+
+        return self._add_points("destinations", points)
+
+    def block(self, kind, block_row, block_col, create = False):
+        """ Memory-maps one block of an array
+
+        Args:
+            kind: "duration", "distance" or "filled".
+            block_row: The block's row, i.e. its first row // self.block_size.
+            block_col: The block's column.
+            create: A boolean that toggles creating the block if it does not
+                exist yet.
+
+        Returns:
+            A numpy.memmap, read-only if the store is, with shape
+                (block_size, block_size) for durations and distances and
+                (block_size, block_size // 8) of packed bits for the filled
+                bitmap; None if the block does not exist and create is False.
+                Unfilled cells of durations and distances hold arbitrary
+                values.
+        """
+
+        key = (kind, block_row, block_col)
+        if (key in self._blocks):
+            self._blocks.move_to_end(key)
+            return self._blocks[key]
+
+        path = os.path.join(self.path, kind, "%d_%d.npy" % (block_row,
+                                                           block_col))
+        if (os.path.exists(path)):
+            array = numpy.load(path, mmap_mode = "r" if self.readonly
+                                                 else "r+")
+        elif (create and not self.readonly):
+            # Files are created sparse, so untouched cells take no disk space
+            if (kind == FILLED):
+                shape = (self.block_size, self.block_size // 8)
+                dtype = numpy.uint8
+            else:
+                shape = (self.block_size, self.block_size)
+                dtype = numpy.float32
+            array = numpy.lib.format.open_memmap(path, mode = "w+",
+                                                 dtype = dtype, shape = shape)
+        else:
+            return None
+
+        self._blocks[key] = array
+        while (len(self._blocks) > self.open_blocks):
+            (evicted_key, evicted) = self._blocks.popitem(last = False)
+            if (not self.readonly):
+                evicted.flush()
+        return array
+
+    def _blocks_of(self, indices):
+        """ Groups sorted indices by block
+
+        Yields:
+            (block, local_indices, positions) tuples, where positions index
+                into indices.
+        """
+
+        indices = numpy.asarray(indices, dtype = numpy.int64)
+        blocks = indices // self.block_size
+        for block in numpy.unique(blocks):
+            positions = numpy.flatnonzero(blocks == block)
+            yield (int(block), indices[positions] - block * self.block_size,
+                   positions)
+
+    def _index(self, selection, length):
+        if (selection is None):
+            return numpy.arange(length)
+        if (isinstance(selection, slice)):
+            return numpy.arange(length)[selection]
+        return numpy.asarray(selection, dtype = numpy.int64).reshape(-1)
+
+    def filled(self, rows = None, cols = None):
+        """ Reads which cells of a region are filled
+
+        Args:
+            rows: A slice, or an iterable of row indices, or None for all.
+            cols: A slice, or an iterable of column indices, or None for all.
+
+        Returns:
+            A boolean numpy array with one row per selected row and one column
+                per selected column.
+        """
+
+        (n_rows, n_cols) = self.shape
+        rows = self._index(rows, n_rows)
+        cols = self._index(cols, n_cols)
+        result = numpy.zeros((len(rows), len(cols)), dtype = bool)
+
+        for (block_row, local_rows, row_positions) in self._blocks_of(rows):
+            for (block_col, local_cols, col_positions) in \
+                    self._blocks_of(cols):
+                bitmap = self.block(FILLED, block_row, block_col)
+                if (bitmap is None):
+                    continue
+                bits = numpy.unpackbits(bitmap[local_rows], axis = 1)
+                result[numpy.ix_(row_positions, col_positions)] = \
+                    bits[:, local_cols].astype(bool)
+
+        return result
+
+    def get(self, kind, rows = None, cols = None):
+        """ Reads a region of durations or distances
+
+        Args:
+            kind: "duration" or "distance".
+            rows: A slice, or an iterable of row indices, or None for all.
+            cols: A slice, or an iterable of column indices, or None for all.
+
+        Returns:
+            A float32 numpy array with one row per selected row and one column
+                per selected column, NaN where cells are not filled or have
+                no route.
+        """
+
+        (n_rows, n_cols) = self.shape
+        rows = self._index(rows, n_rows)
+        cols = self._index(cols, n_cols)
+        result = numpy.full((len(rows), len(cols)), numpy.nan,
+                            dtype = numpy.float32)
+
+        for (block_row, local_rows, row_positions) in self._blocks_of(rows):
+            for (block_col, local_cols, col_positions) in \
+                    self._blocks_of(cols):
+                bitmap = self.block(FILLED, block_row, block_col)
+                if (bitmap is None):
+                    continue
+                values = self.block(kind, block_row, block_col)
+                filled = numpy.unpackbits(bitmap[local_rows],
+                                          axis = 1)[:, local_cols]
+                result[numpy.ix_(row_positions, col_positions)] = numpy.where(
+                    filled.astype(bool), values[numpy.ix_(local_rows,
+                                                          local_cols)],
+                    numpy.nan
+                )
+
+        return result
+
+    def put(self, rows, cols, durations, distances):
+        """ Writes results for every pair of some rows and columns
+
+        Args:
+            rows: An iterable of row indices.
+            cols: An iterable of column indices.
+            durations: An array-like with one row per row index and one
+                column per column index, with None or NaN for pairs without a
+                route.
+            distances: The same as durations.
+        """
+
+        if (self.readonly):
+            raise ValueError("The store is read-only")
+
+        values = {
+            "duration": numpy.array(durations, dtype = numpy.float32),
+            "distance": numpy.array(distances, dtype = numpy.float32)
+        }
+
+        for (block_row, local_rows, row_positions) in self._blocks_of(rows):
+            for (block_col, local_cols, col_positions) in \
+                    self._blocks_of(cols):
+                for kind in KINDS:
+                    self.block(kind, block_row, block_col, True)[
+                        numpy.ix_(local_rows, local_cols)
+                    ] = values[kind][numpy.ix_(row_positions, col_positions)]
+                # Set the filled bits last, so readers never see a cell as
+                # filled before its values are written
+                self._set_filled(block_row, block_col, local_rows, local_cols,
+                                 True)
+
+    def _set_filled(self, block_row, block_col, local_rows, local_cols,
+                    value):
+        bitmap = self.block(FILLED, block_row, block_col, value)
+        if (bitmap is None):
+            return
+        bits = numpy.unpackbits(bitmap[local_rows], axis = 1)
+        bits[:, local_cols] = value
+        bitmap[local_rows] = numpy.packbits(bits, axis = 1)
+
+    def invalidate(self, rows = None, cols = None):
+        """ Marks cells as not filled, so fill computes them again
+
+        Args:
+            rows: A slice, or an iterable of row indices, or None for all.
+            cols: A slice, or an iterable of column indices, or None for all.
+        """
+
+        if (self.readonly):
+            raise ValueError("The store is read-only")
+
+        (n_rows, n_cols) = self.shape
+        for (block_row, local_rows, row_positions) in self._blocks_of(
+                self._index(rows, n_rows)):
+            for (block_col, local_cols, col_positions) in self._blocks_of(
+                    self._index(cols, n_cols)):
+                self._set_filled(block_row, block_col, local_rows, local_cols,
+                                 False)
+
+    def missing(self):
+        """ Finds the cells that are not filled, as rectangles
+
+        Within each block, rows missing the same set of columns are grouped,
+        so new origins, new destinations and invalidated cells each become a
+        few rectangles rather than a recomputed block.
+
+        Yields:
+            (rows, cols) tuples of numpy arrays of row and column indices,
+                every pair of which is missing.
+        """
+
+        (n_rows, n_cols) = self.shape
+        size = self.block_size
+
+        for block_row in range(-(-n_rows // size)):
+            rows = numpy.arange(block_row * size,
+                                min((block_row + 1) * size, n_rows))
+            for block_col in range(-(-n_cols // size)):
+                cols = numpy.arange(block_col * size,
+                                    min((block_col + 1) * size, n_cols))
+                bitmap = self.block(FILLED, block_row, block_col)
+                if (bitmap is None):
+                    yield (rows, cols)
+                    continue
+
+                missing = ~numpy.unpackbits(
+                    bitmap[:len(rows)], axis = 1
+                )[:, :len(cols)].astype(bool)
+                groups = collections.OrderedDict()
+                for i in numpy.flatnonzero(missing.any(axis = 1)):
+                    groups.setdefault(missing[i].tobytes(), []).append(i)
+                for local_rows in groups.values():
+                    yield (rows[local_rows],
+                           cols[numpy.flatnonzero(missing[local_rows[0]])])
+
+    def fill(self, calculator, mode = "walk",
+             workers = distances.DEFAULT_WORKERS, log = None, **kwargs):
+        """ Routes every cell that is not filled yet
+
+        Missing cells are routed rectangle by rectangle (see self.missing)
+        with the backend's matrix method if it has one, and
+        distance_batch_iter otherwise, and each rectangle is written and
+        flushed before the next, so an interrupted fill loses at most one.
+        Pairs that fail (see sharding.route_tile) are left unfilled, so the
+        next fill retries them.
+
+        Args:
+            calculator: An instance of any distances.Distances subclass.
+            mode: A key of the backend's mode_map.
+            workers: The number of threads to route with, for backends without
+                a matrix method.
+            log: A function that progress messages are passed to, or None.
+            **kwargs: Extra arguments passed to the backend, e.g.
+                departure_time.
+
+        Returns:
+            The number of cells filled, not counting those that failed.
+        """
+
+        origins = self.origins
+        destinations = self.destinations
+        cells = 0
+
+        for (rows, cols) in list(self.missing()):
+            result = sharding.route_tile(
+                calculator, [tuple(point) for point in origins[rows]],
+                [tuple(point) for point in destinations[cols]], mode,
+                workers, kwargs
+            )
+            self.put(rows, cols,
+                     [[numpy.nan if value is None else value for value in row]
+                      for row in result["duration"]],
+                     [[numpy.nan if value is None else value for value in row]
+                      for row in result["distance"]])
+            for (i, j, error) in result["errors"]:
+                self.invalidate([rows[i]], [cols[j]])
+            self.flush()
+            cells += len(rows) * len(cols) - len(result["errors"])
+            if (log is not None):
+                log("Filled %d x %d cells, %d failed" % (
+                    len(rows), len(cols), len(result["errors"])
+                ))
+
+        return cells
+
+    def flush(self):
+        """ Writes every open block to disk """
+
+        if (not self.readonly):
+            for array in self._blocks.values():
+                array.flush()
+
+    def close(self):
+        """ Flushes and unmaps every open block """
+
+        self.flush()
+        self._blocks.clear()
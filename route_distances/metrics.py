@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# Hooks into routing events, and a metrics hook with Prometheus/JSON export
+
+import bisect
+import json
+import os
+import threading
+
+# Default upper bounds, in seconds, of latency histogram buckets
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+                           5, 10, 30)
+
+# Prefix of every metric name
+METRIC_PREFIX = "route_distances_"
+
+class Hooks(object):
+    """ Base class for objects notified of routing events
+
+    Instances passed as hooks to a Distances class have these methods called
+    as events happen. Each method does nothing here; subclasses override the
+    ones they need. Hooks are called from whichever thread the event happens
+    on, so they must be thread safe, and should return quickly.
+
+    backend is the name of the Distances class, e.g. "OSRMDistances".
+    """
+
+    def on_request(self, backend, endpoint, status, seconds):
+        """ Called after every HTTP request to a backend
+
+        Args:
+            backend: The name of the backend class.
+            endpoint: The URL path of the request without coordinates, e.g.
+                "/route/v1/driving".
+            status: The HTTP status code, or None if no response arrived.
+            seconds: The time the request took.
+        """
+
+    def on_route(self, backend, mode, outcome, seconds):
+        """ Called after every attempt of Distances.distance
+
+        Args:
+            backend: The name of the backend class.
+            mode: The mode passed to route.
+            outcome: "ok", "no_route" if the backend found no route, or
+                "error" if the attempt raised an exception.
+            seconds: The time the attempt took, including any requests made
+                on other replicas of an entrypoint pool.
+        """
+
+    def on_retry(self, backend, mode, attempt, error, delay):
+        """ Called when Distances.distance is about to retry
+
+        Args:
+            backend: The name of the backend class.
+            mode: The mode passed to route.
+            attempt: The index of the attempt that failed, starting at 0.
+            error: The exception the attempt raised.
+            delay: The number of seconds before the next attempt.
+        """
+
+    def on_failure(self, backend, mode, error):
+        """ Called when Distances.distance gives up on a route
+
+        Args:
+            backend: The name of the backend class.
+            mode: The mode passed to route.
+            error: The exception the last attempt raised.
+        """
+
+    def on_cache(self, backend, hit):
+        """ Called after every cache lookup of Distances.distance
+
+        Args:
+            backend: The name of the backend class.
+            hit: A boolean telling whether the result was cached.
+        """
+
+    def on_quota(self, backend, elements, period_used, quota):
+        """ Called when GoogleMapsDistances takes elements from its quota
+
+        Args:
+            backend: The name of the backend class.
+            elements: The number of elements taken.
+            period_used: The number of elements used this period.
+            quota: The number of elements allowed per period, or None.
+        """
+
+def endpoint_label(url):
+    """ Reduces a request URL to its path, without coordinates or a query
+
+    Path segments from the first one containing a comma onward are dropped,
+    so OSRM's /route/v1/driving/-71.1,42.3;-71.0,42.4 becomes
+    /route/v1/driving.
+    """
+
+    path = url.split("://", 1)[-1]
+    path = "/" + path.split("/", 1)[1] if "/" in path else "/"
+    path = path.split("?", 1)[0]
+
+    segments = []
+    for segment in path.split("/"):
+        if ("," in segment or ";" in segment):
+            break
+        segments.append(segment)
+    return "/".join(segments) or "/"
+
+class Metrics(Hooks):
+    """ Records counters and latency histograms from routing events
+
+    Metrics are kept in memory, labelled by backend, mode and endpoint, and
+    can be exported in the Prometheus text format or as a JSON snapshot. The
+    counters, gauges and histograms may also be updated directly with
+    increment, set and observe.
+
+    Recorded metrics, each prefixed with METRIC_PREFIX:
+        http_request_duration_seconds: Histogram of HTTP request latency, by
+            backend and endpoint.
+        http_requests_total: Counter of HTTP requests, by backend, endpoint
+            and status ("error" if no response arrived).
+        route_duration_seconds: Histogram of route attempt latency, by
+            backend and mode.
+        routes_total: Counter of route attempts, by backend, mode and
+            outcome.
+        retries_total: Counter of retries, by backend and mode.
+        failures_total: Counter of routes given up on, by backend, mode and
+            error type.
+        cache_lookups_total: Counter of cache lookups, by backend and result
+            ("hit" or "miss").
+        quota_elements_total: Counter of Google elements requested, by
+            backend.
+        quota_period_used: Gauge of Google elements used this period.
+        quota_period_limit: Gauge of Google elements allowed per period.
+
+    Attributes:
+        buckets: The upper bounds, in seconds, of the histogram buckets.
+    """
+
+    def __init__(self, buckets = DEFAULT_LATENCY_BUCKETS):
+        """ Initializes the Metrics class
+
+        Args:
+            buckets: An increasing sequence of histogram bucket upper bounds.
+        """
+
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def increment(self, name, amount = 1, **labels):
+        """ Adds to a counter """
+
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        """ Sets a gauge """
+
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        """ Adds an observation to a histogram """
+
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if (histogram is None):
+                histogram = self.histograms[key] = {
+                    "buckets": [0] * len(self.buckets),
+                    "sum": 0.0,
+                    "count": 0
+                }
+            index = bisect.bisect_left(self.buckets, value)
+            if (index < len(self.buckets)):
+                histogram["buckets"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def on_request(self, backend, endpoint, status, seconds):
+        self.observe("http_request_duration_seconds", seconds,
+                     backend = backend, endpoint = endpoint)
+        self.increment("http_requests_total", backend = backend,
+                       endpoint = endpoint,
+                       status = str(status) if status is not None else "error")
+
+    def on_route(self, backend, mode, outcome, seconds):
+        self.observe("route_duration_seconds", seconds, backend = backend,
+                     mode = mode)
+        self.increment("routes_total", backend = backend, mode = mode,
+                       outcome = outcome)
+
+    def on_retry(self, backend, mode, attempt, error, delay):
+        self.increment("retries_total", backend = backend, mode = mode)
+
+    def on_failure(self, backend, mode, error):
+        self.increment("failures_total", backend = backend, mode = mode,
+                       error = type(error).__name__)
+
+    def on_cache(self, backend, hit):
+        self.increment("cache_lookups_total", backend = backend,
+                       result = "hit" if hit else "miss")
+
+    def on_quota(self, backend, elements, period_used, quota):
+        self.increment("quota_elements_total", elements, backend = backend)
+        self.set("quota_period_used", period_used, backend = backend)
+        if (quota is not None):
+            self.set("quota_period_limit", quota, backend = backend)
+
+    def snapshot(self):
+        """ Returns every metric as a JSON-serializable dictionary
+
+        Returns:
+            A dictionary with "counters", "gauges" and "histograms" keys, each
+                a list of dictionaries with "name" and "labels" keys and
+                either a "value" key or "buckets", "sum" and "count" keys.
+                Histogram buckets map upper bounds to cumulative counts.
+        """
+
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted((key, dict(histogram, buckets =
+                                           list(histogram["buckets"])))
+                                for (key, histogram) in
+                                self.histograms.items())
+
+        def cumulative(counts):
+            total = 0
+            result = []
+            for (bound, count) in zip(self.buckets, counts):
+                total += count
+                result.append([bound, total])
+            return result
+
+        return {
+            "counters": [{"name": name, "labels": dict(labels),
+                          "value": value}
+                         for ((name, labels), value) in counters],
+            "gauges": [{"name": name, "labels": dict(labels), "value": value}
+                       for ((name, labels), value) in gauges],
+            "histograms": [{"name": name, "labels": dict(labels),
+                            "buckets": cumulative(histogram["buckets"]),
+                            "sum": histogram["sum"],
+                            "count": histogram["count"]}
+                           for ((name, labels), histogram) in histograms]
+        }
+
+    def prometheus(self):
+        """ Returns every metric in the Prometheus text exposition format """
+
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+
+        def format_labels(labels):
+            if (len(labels) == 0):
+                return ""
+            return "{%s}" % ",".join(
+                '%s="%s"' % (key, str(value).replace("\\", "\\\\")
+                             .replace('"', '\\"').replace("\n", "\\n"))
+                for (key, value) in sorted(labels.items())
+            )
+
+        def declare(name, metric_type):
+            if (name not in typed):
+                typed.add(name)
+                lines.append("# TYPE %s %s" % (name, metric_type))
+
+        for (kind, metric_type) in (("counters", "counter"),
+                                    ("gauges", "gauge")):
+            for metric in snapshot[kind]:
+                name = METRIC_PREFIX + metric["name"]
+                declare(name, metric_type)
+                lines.append("%s%s %r" % (name,
+                                          format_labels(metric["labels"]),
+                                          metric["value"]))
+
+        for metric in snapshot["histograms"]:
+            name = METRIC_PREFIX + metric["name"]
+            declare(name, "histogram")
+            for (bound, count) in metric["buckets"] + [["+Inf",
+                                                        metric["count"]]]:
+                labels = dict(metric["labels"], le = bound)
+                lines.append("%s_bucket%s %d" % (name, format_labels(labels),
+                                                 count))
+            lines.append("%s_sum%s %r" % (name,
+                                          format_labels(metric["labels"]),
+                                          metric["sum"]))
+            lines.append("%s_count%s %d" % (name,
+                                            format_labels(metric["labels"]),
+                                            metric["count"]))
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """ Atomically writes the metrics to a file
+
+        Files ending in .json get a JSON snapshot; any other file, e.g. one
+        read by node_exporter's textfile collector, gets the Prometheus text
+        format.
+
+        Args:
+            path: The path of the file.
+        """
+
+        if (path.endswith(".json")):
+            data = json.dumps(self.snapshot())
+        else:
+            data = self.prometheus()
+
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def reset(self):
+        """ Clears every metric """
+
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# Travel time profiles of origin-destination pairs across departure times
+
+import warnings
+
+import numpy
+
+# Percentiles summarized by DepartureProfiles.summary by default
+DEFAULT_PERCENTILES = (10, 25, 75, 90)
+
+class DepartureProfiles(object):
+    """ Travel times of many pairs over a range of departure times
+
+    Row i of durations is the profile of pairs[i]: the travel time, in
+    seconds, when leaving at each of departures, including any wait at the
+    origin. Cells are NaN where no route was found.
+
+    Attributes:
+        pairs: The list of (orig_long, orig_lat, dest_long, dest_lat) pairs.
+        departures: The list of departure times, as datetime.datetime objects.
+        durations: A numpy float array with shape (len(pairs),
+            len(departures)).
+        requests: The number of requests sent to build the profiles.
+        errors: A dictionary mapping the indices of pairs whose profiles could
+            not be completed to the exception raised. Their rows are NaN from
+            the first departure that failed.
+    """
+
+    def __init__(self, pairs, departures, durations, requests = 0,
+                 errors = None):
+        self.pairs = pairs
+        self.departures = departures
+        self.durations = durations
+        self.requests = requests
+        self.errors = errors if errors is not None else {}
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def __getitem__(self, pair):
+        """ Returns the profile of one pair, by index """
+
+        return self.durations[pair]
+
+    def summary(self, percentiles = DEFAULT_PERCENTILES):
+        """ Summarizes each pair's profile
+
+        Departures with no route are ignored; pairs with no route at any
+        departure are summarized as NaN.
+
+        Args:
+            percentiles: The percentiles, from 0 to 100, to include after the
+                minimum and median.
+
+        Returns:
+            A numpy array with one row per pair and the columns min, median,
+                then each of percentiles, in seconds.
+        """
+
+        columns = [50] + list(percentiles)
+
+        with warnings.catch_warnings():
+            # All-NaN rows are expected for pairs that were never routable
+            warnings.simplefilter("ignore", RuntimeWarning)
+            minimum = numpy.nanmin(self.durations, axis = 1)
+            values = numpy.nanpercentile(self.durations, columns, axis = 1)
+
+        return numpy.column_stack([minimum] + list(values))
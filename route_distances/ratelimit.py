@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# Token bucket rate limiting that can be shared between threads and processes
+
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+class RateLimiter(object):
+    """ Limits the rate of requests with a token bucket and a period quota
+
+    Every request takes tokens from a bucket that refills at rate tokens per
+    second and holds at most burst tokens; a request waits until the bucket has
+    enough tokens. Independently, at most quota tokens may be taken per period
+    of period_length seconds, with the period starting at the first request.
+
+    The limiter is safe to share between threads. If state_path is given, the
+    limiter's state is kept in that file instead of in memory, and access to it
+    is serialized with an exclusive file lock, so limiters in several processes
+    that use the same state_path share one rate and one quota.
+
+    Attributes:
+        rate: The number of tokens added to the bucket per second, or None for
+            no rate limit.
+        burst: The maximum number of tokens the bucket holds.
+        quota: The maximum number of tokens taken per period, or None for no
+            quota.
+        period_length: The length of a period, in seconds.
+        state_path: The path of the file the state is shared through, or None.
+    """
+
+    def __init__(self, rate = None, burst = None, quota = None,
+                 period_length = 60*60*24, period_used = 0,
+                 state_path = None):
+        """ Initializes the RateLimiter class
+
+        Args:
+            rate: The number of tokens per second, or None.
+            burst: The capacity of the bucket. Defaults to one second's worth
+                of tokens, and at least one token.
+            quota: The maximum number of tokens per period, or None.
+            period_length: The length of a period, in seconds.
+            period_used: The number of tokens already taken this period.
+            state_path: The path of a file to share state through, or None.
+
+        Raises:
+            RuntimeError: state_path was given on a platform without fcntl.
+        """
+
+        if (state_path is not None and fcntl is None):
+            raise RuntimeError("Sharing a rate limiter between processes "
+                               "requires fcntl")
+
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, rate or 1)
+        self.quota = quota
+        self.period_length = period_length
+        self.state_path = state_path
+        self.lock = threading.Lock()
+
+        self.state = {
+            "tokens": self.burst,
+            "updated": None,
+            "period_start": None,
+            "period_used": period_used
+        }
+
+    def acquire(self, tokens = 1):
+        """ Takes tokens, waiting until they are available
+
+        A request for more tokens than the bucket holds is let through once
+        the bucket is full, leaving it in debt, so large requests are not
+        stalled forever.
+
+        Args:
+            tokens: The number of tokens to take.
+
+        Returns:
+            The number of seconds spent waiting.
+        """
+
+        waited = 0
+
+        while (True):
+            wait = self._update(lambda state: self._take(state, tokens))
+            if (wait <= 0):
+                return waited
+
+            time.sleep(wait)
+            waited += wait
+
+    def _update(self, function):
+        """ Calls a function with the state dictionary, then saves the state
+
+        The state is read from and written back to self.state_path, under an
+        exclusive file lock, if it is set.
+
+        Returns:
+            The function's return value.
+        """
+
+        with self.lock:
+            if (self.state_path is None):
+                return function(self.state)
+
+            with open(self.state_path, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    data = f.read()
+                    state = json.loads(data) if data else self.state
+                    result = function(state)
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self.state = state
+                    return result
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _take(self, state, tokens):
+        """ Takes tokens from a state dictionary if they are available
+
+        Returns:
+            0 if the tokens were taken; otherwise the number of seconds to wait
+                before trying again.
+        """
+
+        now = time.time()
+
+        # The first period starts with the tokens already used, as passed to
+        # the constructor; later periods start empty
+        if (state["period_start"] is None):
+            state["period_start"] = now
+        elif (now >= state["period_start"] + self.period_length):
+            state["period_start"] = now
+            state["period_used"] = 0
+
+        if (self.quota is not None and state["period_used"] > 0
+                and state["period_used"] + tokens > self.quota):
+            return state["period_start"] + self.period_length - now
+
+        if (self.rate is not None):
+            if (state["updated"] is not None):
+                state["tokens"] = min(
+                    self.burst,
+                    state["tokens"] + (now - state["updated"]) * self.rate
+                )
+            state["updated"] = now
+
+            needed = min(tokens, self.burst)
+            if (state["tokens"] < needed):
+                return (needed - state["tokens"]) / self.rate
+
+            state["tokens"] -= tokens
+
+        state["period_used"] += tokens
+        return 0
+
+    @property
+    def period_used(self):
+        """ The number of tokens taken in the current period """
+
+        if (self.state_path is None):
+            return self.state["period_used"]
+        return self._update(lambda state: state["period_used"])
+
+    @period_used.setter
+    def period_used(self, value):
+        def set_period_used(state):
+            state["period_used"] = value
+        self._update(set_period_used)
+
+    @property
+    def period_start(self):
+        """ The Unix time the current period started at, or None """
+
+        return self.state["period_start"]
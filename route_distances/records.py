@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# Compact containers for large numbers of route results
+
+import array
+import math
+
+class RouteRecord(object):
+    """ The distance and duration of one route, without the backend's response
+
+    Supports record["distance"] and record["duration"] so it can be used
+    wherever a result dictionary is expected.
+
+    Attributes:
+        distance: The distance of the route in meters.
+        duration: The duration of the route in seconds.
+    """
+
+    __slots__ = ("distance", "duration")
+
+    def __init__(self, distance, duration):
+        self.distance = distance
+        self.duration = duration
+
+    def __getitem__(self, key):
+        if (key not in self.__slots__):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __eq__(self, other):
+        try:
+            return (self.distance == other["distance"]
+                    and self.duration == other["duration"])
+        except (KeyError, TypeError):
+            return False
+
+    def __repr__(self):
+        return "RouteRecord(distance=%r, duration=%r)" % (self.distance,
+                                                          self.duration)
+
+    def to_dict(self):
+        """ Returns the record as a result dictionary """
+
+        return {"distance": self.distance, "duration": self.duration}
+
+class RouteRecords(object):
+    """ Array-backed list of route results
+
+    Distances and durations are stored in two array.array("d") objects, which
+    take 16 bytes per result, with NaN marking results that could not be
+    routed. Exceptions returned by failed routes are kept in a separate
+    dictionary keyed by index.
+
+    Attributes:
+        distances: An array.array of distances in meters.
+        durations: An array.array of durations in seconds.
+        errors: A dictionary mapping indices to exceptions.
+    """
+
+    def __init__(self, results = ()):
+        """ Initializes the RouteRecords class
+
+        Args:
+            results: An iterable of results to append.
+        """
+
+        self.distances = array.array("d")
+        self.durations = array.array("d")
+        self.errors = {}
+
+        for result in results:
+            self.append(result)
+
+    def append(self, result):
+        """ Appends a result
+
+        Args:
+            result: A result dictionary or RouteRecord, False if there was no
+                route, or an exception if routing failed.
+        """
+
+        if (isinstance(result, Exception)):
+            self.errors[len(self.distances)] = result
+            result = False
+
+        if (result):
+            self.distances.append(result["distance"])
+            self.durations.append(result["duration"])
+        else:
+            self.distances.append(math.nan)
+            self.durations.append(math.nan)
+
+    def __len__(self):
+        return len(self.distances)
+
+    def __getitem__(self, index):
+        """ Returns a RouteRecord, False, or the exception of a failed route """
+
+        if (index < 0):
+            index += len(self)
+        if (index in self.errors):
+            return self.errors[index]
+
+        distance = self.distances[index]
+        if (math.isnan(distance)):
+            return False
+        return RouteRecord(distance, self.durations[index])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# Retry policies and circuit breakers for routing requests
+
+import random
+import requests
+import sys
+import threading
+import time
+
+# Default number of attempts to make before abandoning a calculation
+DEFAULT_MAX_ATTEMPTS = 5
+
+# Default delay, in seconds, before the first retry; it doubles on each retry
+DEFAULT_BASE_DELAY = 0.5
+
+# Default upper bound, in seconds, of the delay before a retry
+DEFAULT_MAX_DELAY = 30
+
+# Default number of consecutive transient failures that open a circuit breaker
+DEFAULT_FAILURE_THRESHOLD = 10
+
+# Default number of seconds a circuit breaker stays open before letting a
+# trial request through
+DEFAULT_RESET_TIMEOUT = 30
+
+# HTTP status codes that indicate the backend is overloaded or unhealthy
+RETRYABLE_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+# API statuses that indicate a request may succeed if repeated later
+RETRYABLE_API_STATUSES = frozenset(["OVER_QUERY_LIMIT", "UNKNOWN_ERROR"])
+
+class CircuitOpenError(Exception):
+    """ Raised instead of sending a request while a circuit breaker is open """
+
+class RetryPolicy(object):
+    """ Decides which failed requests are retried, and when
+
+    Only transient errors are retried: timeouts, connection errors, HTTP
+    statuses in RETRYABLE_STATUS_CODES and API statuses in
+    RETRYABLE_API_STATUSES. Retries are delayed by exponential backoff with
+    full jitter. A policy may be shared between instances; each instance builds
+    its own circuit breaker from it.
+
+    Attributes:
+        max_attempts: The number of attempts to make before giving up.
+        base_delay: The delay, in seconds, before the first retry.
+        max_delay: The upper bound, in seconds, of the delay before a retry.
+        jitter: A boolean that toggles whether delays are drawn uniformly from
+            zero up to the backoff delay, which keeps clients that failed
+            together from retrying together.
+        failure_threshold: The number of consecutive transient failures that
+            open a circuit breaker, or None to never open it.
+        reset_timeout: The number of seconds a circuit breaker stays open.
+    """
+
+    def __init__(self, max_attempts = DEFAULT_MAX_ATTEMPTS,
+                 base_delay = DEFAULT_BASE_DELAY, max_delay = DEFAULT_MAX_DELAY,
+                 jitter = True, failure_threshold = DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout = DEFAULT_RESET_TIMEOUT):
+        """ Initializes the RetryPolicy class
+
+        Args:
+            max_attempts: The number of attempts to make before giving up.
+            base_delay: The delay, in seconds, before the first retry.
+            max_delay: The upper bound, in seconds, of the delay before a retry.
+            jitter: A boolean that toggles jitter.
+            failure_threshold: The number of consecutive transient failures
+                that open a circuit breaker, or None.
+            reset_timeout: The number of seconds a circuit breaker stays open.
+        """
+
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+    def is_retryable(self, error):
+        """ Tells whether a request that raised an exception may be retried
+
+        Args:
+            error: The exception raised by the request.
+
+        Returns:
+            True if error is a transient error; False otherwise.
+        """
+
+        if (isinstance(error, CircuitOpenError)):
+            return False
+
+        if (isinstance(error, (requests.Timeout, requests.ConnectionError))):
+            return True
+        if (isinstance(error, requests.HTTPError)):
+            return (error.response is not None and
+                    error.response.status_code in RETRYABLE_STATUS_CODES)
+
+        # Only classify errors from libraries that have already been imported
+        googlemaps = sys.modules.get("googlemaps.exceptions")
+        if (googlemaps is not None):
+            if (isinstance(error, (googlemaps.Timeout,
+                                   googlemaps.TransportError))):
+                return True
+            if (isinstance(error, googlemaps.HTTPError)):
+                return error.status_code in RETRYABLE_STATUS_CODES
+            if (isinstance(error, googlemaps.ApiError)):
+                return error.status in RETRYABLE_API_STATUSES
+
+        aiohttp = sys.modules.get("aiohttp")
+        if (aiohttp is not None):
+            if (isinstance(error, aiohttp.ClientResponseError)):
+                return error.status in RETRYABLE_STATUS_CODES
+            if (isinstance(error, aiohttp.ClientConnectionError)):
+                return True
+
+        return isinstance(error, TimeoutError)
+
+    def delay(self, attempt):
+        """ Returns the number of seconds to wait before retrying
+
+        Args:
+            attempt: The index of the attempt that failed, starting at 0.
+        """
+
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        if (self.jitter):
+            return random.uniform(0, delay)
+        return delay
+
+    def circuit_breaker(self):
+        """ Builds a CircuitBreaker configured by this policy """
+
+        return CircuitBreaker(self.failure_threshold, self.reset_timeout)
+
+class CircuitBreaker(object):
+    """ Stops requests to a backend that keeps failing
+
+    The breaker opens after failure_threshold consecutive transient failures.
+    While it is open, requests fail immediately with CircuitOpenError. After
+    reset_timeout seconds, a single trial request is let through; the breaker
+    closes if it succeeds and opens again if it fails.
+
+    Attributes:
+        failure_threshold: The number of consecutive failures that open the
+            breaker, or None to never open it.
+        reset_timeout: The number of seconds the breaker stays open.
+        failures: The number of consecutive failures recorded.
+        opened_at: The time.monotonic() time the breaker opened at, or None
+            if it is closed.
+    """
+
+    def __init__(self, failure_threshold = DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout = DEFAULT_RESET_TIMEOUT):
+        """ Initializes the CircuitBreaker class
+
+        Args:
+            failure_threshold: The number of consecutive failures that open the
+                breaker, or None.
+            reset_timeout: The number of seconds the breaker stays open.
+        """
+
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def before_request(self):
+        """ Checks that a request may be sent
+
+        Raises:
+            CircuitOpenError: The breaker is open.
+        """
+
+        with self.lock:
+            if (self.opened_at is None):
+                return
+
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if (remaining > 0 or self.trial_in_flight):
+                raise CircuitOpenError(
+                    "Backend unhealthy after %d consecutive failures; "
+                    "retrying in %.1f seconds" % (self.failures,
+                                                  max(remaining, 0))
+                )
+
+            self.trial_in_flight = True
+
+    def record_success(self):
+        """ Records a request that succeeded, closing the breaker """
+
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        """ Records a request that failed with a transient error """
+
+        with self.lock:
+            self.failures += 1
+            if (self.trial_in_flight or (
+                    self.failure_threshold is not None
+                    and self.failures >= self.failure_threshold)):
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+    def release(self):
+        """ Records a request that failed for reasons unrelated to the
+        backend's health, such as an invalid mode """
+
+        with self.lock:
+            self.trial_in_flight = False
+
+    @property
+    def is_open(self):
+        """ Whether requests are currently being stopped """
+
+        return self.opened_at is not None
@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+# Sharded origin-destination matrices: python -m route_distances.sharding ...
+#
+# An origins x destinations job is split into tiles, and tiles are dealt out
+# to shards round-robin, so every process or machine given the same inputs and
+# shard count computes the same, disjoint set of tiles. Each shard builds its
+# own backend instance from a JSON config and writes one JSON Lines file, and
+# a merge step combines the shard files into one matrix.
+
+import argparse
+import concurrent.futures
+import csv
+import glob
+import hashlib
+import json
+import os
+
+import numpy
+
+try:
+    from . import backends
+    from . import cache
+    from . import distances
+    from . import jobs
+except:
+    import backends
+    import cache
+    import distances
+    import jobs
+
+# Default number of origins and destinations per tile
+DEFAULT_TILE_ROWS = 100
+DEFAULT_TILE_COLS = 100
+
+# Name of the file shard shard_index of shard_count writes to
+SHARD_FILE_NAME = "shard-%05d-of-%05d.jsonl"
+
+def read_points(path, input_format = None):
+    """ Reads (long, lat) points from a CSV or JSON Lines file
+
+    Args:
+        path: The path of a file whose rows or objects have long and lat
+            fields.
+        input_format: "csv" or "jsonl", or None to guess from the extension.
+
+    Returns:
+        A list of (long, lat) tuples.
+    """
+
+    input_format = input_format or jobs.file_format(path)
+
+    with open(path, newline = "") as f:
+        if (input_format == "csv"):
+            records = csv.DictReader(f)
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+        return [(float(record["long"]), float(record["lat"]))
+                for record in records]
+
+def build_calculator(config):
+    """ Builds a backend instance from a JSON-serializable config
+
+    Args:
+        config: A dictionary with a "backend" key naming a backend, as in
+            backends.get_backend; every other key is passed to the class as a
+            keyword argument. A "cache" key holds the path of a
+            cache.RouteCache database.
+
+    Returns:
+        An instance of a Distances subclass.
+    """
+
+    kwargs = dict(config)
+    backend = kwargs.pop("backend")
+    if (kwargs.get("cache")):
+        kwargs["cache"] = cache.RouteCache(kwargs["cache"])
+
+    return backends.get_backend(backend, **kwargs)
+
+def plan_fingerprint(origins, destinations, tile_rows, tile_cols):
+    """ Hashes the inputs of a job, so shards of different jobs are not merged
+
+    Returns:
+        A hexadecimal string.
+    """
+
+    digest = hashlib.sha256()
+    digest.update(json.dumps([origins, destinations, tile_rows, tile_cols])
+                  .encode())
+    return digest.hexdigest()
+
+def shard_tiles(n_origins, n_destinations, shard_index, shard_count,
+                tile_rows = DEFAULT_TILE_ROWS, tile_cols = DEFAULT_TILE_COLS):
+    """ Lists the tiles a shard is responsible for
+
+    Args:
+        n_origins: The number of origins.
+        n_destinations: The number of destinations.
+        shard_index: The index of the shard, from 0 to shard_count - 1.
+        shard_count: The total number of shards.
+        tile_rows: The number of origins per tile.
+        tile_cols: The number of destinations per tile.
+
+    Returns:
+        A list of (row_start, row_end, col_start, col_end) tuples; see
+            distances.matrix_tiles.
+    """
+
+    if (not 0 <= shard_index < shard_count):
+        raise ValueError("shard_index must be between 0 and shard_count - 1")
+
+    return [
+        tile for (index, tile) in enumerate(distances.matrix_tiles(
+            n_origins, n_destinations, tile_rows, tile_cols
+        ))
+        if (index % shard_count == shard_index)
+    ]
+
+def route_tile(calculator, origins, destinations, mode, workers, kwargs):
+    """ Routes every origin of a tile to every destination
+
+    The backend's matrix method is used if it has one, retried under the
+    calculator's retry policy and circuit breaker like any other request, and
+    distance_batch_iter otherwise. A failed matrix request raises; a pair
+    that fails in distance_batch_iter is listed in the "errors" key, so it is
+    not mistaken for a pair with no route. With fail_fast off, the calculator
+    itself answers failed pairs with False, and they cannot be told apart.
+
+    Returns:
+        A dictionary with "duration" and "distance" rows (see
+            Distances.matrix), and an "errors" list of (row, column,
+            exception) tuples for the pairs that failed.
+    """
+
+    if (hasattr(calculator, "matrix")):
+        # The blocking retry loop, as matrix blocks even in the asyncio
+        # classes
+        matrix = distances.Distances.call_with_retries(
+            calculator, mode, calculator.matrix, origins, destinations,
+            mode = mode, **kwargs
+        )
+        return {"duration": matrix["duration"],
+                "distance": matrix["distance"], "errors": []}
+
+    pairs = [tuple(origin) + tuple(destination)
+             for origin in origins for destination in destinations]
+    results = list(calculator.distance_batch_iter(
+        pairs, mode = mode, workers = workers, return_exceptions = True,
+        **kwargs
+    ))
+
+    rows = {"duration": [], "distance": [], "errors": []}
+    for (index, result) in enumerate(results):
+        if (isinstance(result, Exception)):
+            rows["errors"].append((index // len(destinations),
+                                   index % len(destinations), result))
+    for start in range(0, len(results), len(destinations)):
+        row = [result if not isinstance(result, Exception) else False
+               for result in results[start:start + len(destinations)]]
+        for key in ("duration", "distance"):
+            rows[key].append([result[key] if result else None
+                              for result in row])
+    return rows
+
+def run_shard(config, origins, destinations, output_dir, shard_index,
+              shard_count, mode = "walk", tile_rows = DEFAULT_TILE_ROWS,
+              tile_cols = DEFAULT_TILE_COLS,
+              workers = distances.DEFAULT_WORKERS, log = None, **kwargs):
+    """ Computes one shard's tiles, appending each to the shard's file
+
+    The shard file starts with a header line describing the job, followed by
+    one line per tile. Rerunning a shard skips the tiles already in its file,
+    so an interrupted shard resumes where it stopped. A tile with pairs that
+    failed (see route_tile) is not written, so a rerun routes it again.
+
+    Args:
+        config: A backend config; see build_calculator.
+        origins: A list of (long, lat) origins.
+        destinations: A list of (long, lat) destinations.
+        output_dir: The directory to write the shard file to.
+        shard_index: The index of the shard, from 0 to shard_count - 1.
+        shard_count: The total number of shards.
+        mode: A key of the backend's mode_map.
+        tile_rows: The number of origins per tile.
+        tile_cols: The number of destinations per tile.
+        workers: The number of threads to route with, for backends without
+            a matrix method.
+        log: A function that progress messages are passed to, or None to
+            log them to the route_distances logger at the INFO level.
+        **kwargs: Extra arguments passed to the backend, e.g. departure_time.
+
+    Returns:
+        The path of the shard file.
+
+    Raises:
+        RuntimeError: Some tiles failed; the others were written.
+    """
+
+    if (log is None):
+        log = distances.logger.info
+
+    origins = [tuple(origin) for origin in origins]
+    destinations = [tuple(destination) for destination in destinations]
+    header = {
+        "fingerprint": plan_fingerprint(origins, destinations, tile_rows,
+                                        tile_cols),
+        "shard_index": shard_index,
+        "shard_count": shard_count,
+        "n_origins": len(origins),
+        "n_destinations": len(destinations)
+    }
+
+    os.makedirs(output_dir, exist_ok = True)
+    path = os.path.join(output_dir, SHARD_FILE_NAME % (shard_index,
+                                                       shard_count))
+    (done, size) = read_shard(path, header["fingerprint"])
+
+    tiles = [tile for tile in shard_tiles(len(origins), len(destinations),
+                                          shard_index, shard_count,
+                                          tile_rows, tile_cols)
+             if tile not in done]
+    if (len(done) > 0):
+        log("Shard %d resuming with %d tiles left" % (shard_index,
+                                                      len(tiles)))
+
+    calculator = build_calculator(config)
+    failed = []
+
+    try:
+        with open(path, "r+" if size else "w") as output:
+            output.truncate(size)
+            output.seek(size)
+            if (size == 0):
+                output.write(json.dumps(header) + "\n")
+
+            for (count, tile) in enumerate(tiles, 1):
+                (row_start, row_end, col_start, col_end) = tile
+                rows = route_tile(calculator,
+                                  origins[row_start:row_end],
+                                  destinations[col_start:col_end],
+                                  mode, workers, kwargs)
+                if (rows["errors"]):
+                    failed.append(tile)
+                    log("Shard %d failed to route %d pairs of tile %d of %d: "
+                        "%s" % (shard_index, len(rows["errors"]), count,
+                                len(tiles), rows["errors"][0][2]))
+                    continue
+                output.write(json.dumps({"tile": tile,
+                                         "duration": rows["duration"],
+                                         "distance": rows["distance"]})
+                             + "\n")
+                output.flush()
+                log("Shard %d completed tile %d of %d" % (shard_index, count,
+                                                          len(tiles)))
+            os.fsync(output.fileno())
+    finally:
+        calculator.close()
+
+    if (failed):
+        raise RuntimeError("Shard %d failed to route %d of %d tiles; rerun "
+                           "it to retry them" % (shard_index, len(failed),
+                                                 len(tiles)))
+
+    return path
+
+def read_shard(path, fingerprint = None):
+    """ Finds the tiles already written to a shard file
+
+    A partially written last line is ignored.
+
+    Args:
+        path: The path of the shard file.
+        fingerprint: The fingerprint the file's header must have, or None.
+
+    Returns:
+        A tuple (tiles, size) of the set of completed tiles and the size, in
+            bytes, of the file's complete lines.
+
+    Raises:
+        ValueError: The file belongs to a different job.
+    """
+
+    tiles = set()
+    size = 0
+
+    if (not os.path.exists(path)):
+        return (tiles, size)
+
+    with open(path, "rb") as f:
+        for line in f:
+            if (not line.endswith(b"\n")):
+                break
+            record = json.loads(line)
+            if ("fingerprint" in record):
+                if (fingerprint is not None
+                        and record["fingerprint"] != fingerprint):
+                    raise ValueError("%s belongs to a different job" % path)
+            else:
+                tiles.add(tuple(record["tile"]))
+            size += len(line)
+
+    return (tiles, size)
+
+def merge_shards(output_dir, n_origins = None, n_destinations = None):
+    """ Combines the shard files in a directory into one matrix
+
+    Args:
+        output_dir: The directory the shard files were written to.
+        n_origins: The expected number of origins, or None.
+        n_destinations: The expected number of destinations, or None.
+
+    Returns:
+        A dictionary with "duration" and "distance" numpy arrays of shape
+            (n_origins, n_destinations), with NaN for pairs with no route.
+
+    Raises:
+        ValueError: The shard files are missing, incomplete or belong to
+            different jobs.
+    """
+
+    paths = sorted(glob.glob(os.path.join(output_dir, "shard-*-of-*.jsonl")))
+    if (len(paths) == 0):
+        raise ValueError("No shard files in %s" % output_dir)
+
+    header = None
+    result = None
+    seen = set()
+
+    for path in paths:
+        with open(path, "rb") as f:
+            for line in f:
+                if (not line.endswith(b"\n")):
+                    break
+                record = json.loads(line)
+
+                if ("fingerprint" in record):
+                    if (header is None):
+                        header = record
+                        n_origins = n_origins or header["n_origins"]
+                        n_destinations = (n_destinations
+                                          or header["n_destinations"])
+                        result = {
+                            "duration": numpy.full(
+                                (n_origins, n_destinations), numpy.nan
+                            ),
+                            "distance": numpy.full(
+                                (n_origins, n_destinations), numpy.nan
+                            )
+                        }
+                    elif ((record["fingerprint"], record["shard_count"]) !=
+                          (header["fingerprint"], header["shard_count"])):
+                        raise ValueError("%s belongs to a different job"
+                                         % path)
+                    continue
+
+                (row_start, row_end, col_start, col_end) = record["tile"]
+                for key in result:
+                    result[key][row_start:row_end, col_start:col_end] = \
+                        numpy.array(record[key], dtype = float)
+                seen.add(tuple(record["tile"]))
+
+    missing = header["shard_count"] - len(paths)
+    if (missing > 0):
+        raise ValueError("%d shard files are missing" % missing)
+
+    cells = sum((row_end - row_start) * (col_end - col_start)
+                for (row_start, row_end, col_start, col_end) in seen)
+    if (cells != n_origins * n_destinations):
+        raise ValueError("Shards cover %d of %d pairs; rerun the incomplete "
+                         "shards" % (cells, n_origins * n_destinations))
+
+    return result
+
+def write_matrix(result, path):
+    """ Writes a merged matrix to a .npz file, or to a CSV file with one row
+    per pair """
+
+    if (path.endswith(".npz")):
+        numpy.savez(path, **result)
+        return
+
+    with open(path, "w", newline = "") as f:
+        writer = csv.writer(f)
+        writer.writerow(["origin", "destination", "distance", "duration"])
+        (n_origins, n_destinations) = result["duration"].shape
+        for origin in range(n_origins):
+            for destination in range(n_destinations):
+                distance = result["distance"][origin, destination]
+                duration = result["duration"][origin, destination]
+                writer.writerow([
+                    origin, destination,
+                    None if numpy.isnan(distance) else distance,
+                    None if numpy.isnan(duration) else duration
+                ])
+
+def run_local(config, origins, destinations, output_dir, processes,
+              **kwargs):
+    """ Runs every shard of a job in its own process on this machine
+
+    Args:
+        config: A backend config; see build_calculator.
+        origins: A list of (long, lat) origins.
+        destinations: A list of (long, lat) destinations.
+        output_dir: The directory to write shard files to.
+        processes: The number of processes, which is also the number of
+            shards.
+        **kwargs: Extra arguments passed to run_shard. They are sent to the
+            worker processes, so they must be picklable.
+
+    Returns:
+        The merged result; see merge_shards.
+    """
+
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        futures = [
+            executor.submit(run_shard, config, origins, destinations,
+                            output_dir, shard_index, processes, **kwargs)
+            for shard_index in range(processes)
+        ]
+        for future in futures:
+            future.result()
+
+    return merge_shards(output_dir, len(origins), len(destinations))
+
+def parse_args(argv = None):
+    """ Parses command line arguments
+
+    Args:
+        argv: A list of arguments, or None to use sys.argv.
+
+    Returns:
+        An argparse.Namespace object.
+    """
+
+    parser = argparse.ArgumentParser(
+        prog = "python -m route_distances.sharding",
+        description = "Compute an origins x destinations matrix in "
+                      "deterministic shards across processes or machines."
+    )
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    def add_job_args(command):
+        command.add_argument("config",
+                             help = "JSON file with a \"backend\" key and "
+                                    "keyword arguments for its class")
+        command.add_argument("origins",
+                             help = "CSV or JSON Lines file of long, lat")
+        command.add_argument("destinations",
+                             help = "CSV or JSON Lines file of long, lat")
+        command.add_argument("output_dir", help = "directory of shard files")
+        command.add_argument("--mode", default = "walk",
+                             choices = ["bike", "drive", "transit", "walk"])
+        command.add_argument("--tile-rows", type = int,
+                             default = DEFAULT_TILE_ROWS)
+        command.add_argument("--tile-cols", type = int,
+                             default = DEFAULT_TILE_COLS)
+        command.add_argument("--workers", type = int,
+                             default = distances.DEFAULT_WORKERS,
+                             help = "threads per shard, for backends without "
+                                    "a matrix method")
+
+    run = commands.add_parser("run", help = "compute one shard")
+    add_job_args(run)
+    run.add_argument("--shard-index", type = int, required = True)
+    run.add_argument("--shard-count", type = int, required = True)
+
+    local = commands.add_parser("local", help = "compute every shard in "
+                                                "parallel processes and merge")
+    add_job_args(local)
+    local.add_argument("--processes", type = int, default = os.cpu_count())
+    local.add_argument("--output", required = True,
+                       help = "merged .npz or .csv file to write")
+
+    merge = commands.add_parser("merge", help = "merge shard files")
+    merge.add_argument("output_dir", help = "directory of shard files")
+    merge.add_argument("output", help = "merged .npz or .csv file to write")
+
+    return parser.parse_args(argv)
+
+def main(argv = None):
+    """ Runs the command described by command line arguments
+
+    Args:
+        argv: A list of arguments, or None to use sys.argv.
+    """
+
+    args = parse_args(argv)
+
+    if (args.command == "merge"):
+        write_matrix(merge_shards(args.output_dir), args.output)
+        return
+
+    with open(args.config) as f:
+        config = json.load(f)
+    origins = read_points(args.origins)
+    destinations = read_points(args.destinations)
+    job_kwargs = {
+        "mode": args.mode,
+        "tile_rows": args.tile_rows,
+        "tile_cols": args.tile_cols,
+        "workers": args.workers,
+        "log": print
+    }
+
+    if (args.command == "run"):
+        run_shard(config, origins, destinations, args.output_dir,
+                  args.shard_index, args.shard_count, **job_kwargs)
+    else:
+        write_matrix(run_local(config, origins, destinations,
+                               args.output_dir, args.processes,
+                               **job_kwargs),
+                     args.output)
+
+if (__name__ == "__main__"):
+    main()
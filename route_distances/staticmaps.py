@@ -1,27 +1,74 @@
 #!/usr/bin/env python3
 # Small library for generating URLs of visualizations
 
+# Base URL of Google Static Maps API requests
+BASE_URL = "https://maps.googleapis.com/maps/api/staticmap?size=%s"
+
+# Longest URL the Google Static Maps API accepts
+DEFAULT_MAX_URL_LENGTH = 16384
+
+# Simplification tolerance, in degrees, first tried when a URL is too long; it
+# is doubled until the URL fits or MAX_TOLERANCE is reached
+MIN_TOLERANCE = 0.00001
+MAX_TOLERANCE = 1.0
+
+def encode_polyline(coords):
+    """ Encodes coordinates with Google's encoded polyline algorithm
+
+    Args:
+        coords: An iterable of (longitude, latitude) pairs.
+
+    Returns:
+        The encoded polyline, with a precision of five decimal places.
+    """
+
+    chunks = []
+    previous = (0, 0)
+
+    for coord in coords:
+        point = (int(round(coord[1] * 1e5)), int(round(coord[0] * 1e5)))
+        for (value, last) in zip(point, previous):
+            value -= last
+            value = ~(value << 1) if value < 0 else value << 1
+            while (value >= 0x20):
+                chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+        previous = point
+
+    return "".join(chunks)
+
 class Constructor(object):
     """ Constructs Google Static Maps API URLs
 
     Constructs requests for the Google Static Maps API by storing substrings of
     the overall URL which are created by the add_coords function. The
-    generate_url function returns the full, assembled URL.
+    generate_url function returns the full, assembled URL. Paths and polygons
+    are stored as encoded polylines, and simplified with shapely if the URL
+    would be longer than max_url_length.
 
     Attributes:
         parameters: A an array of strings, each of which is an additional
             parameter that will be appended to the base Static Maps API request
             URL.
+        shapes: A list with one entry per parameter: a (style, coords) tuple
+            for paths and polygons, kept so that they can be simplified, and
+            None for markers.
+        max_url_length: The longest URL generate_url aims to return.
     """
 
-    def __init__(self):
+    def __init__(self, max_url_length = DEFAULT_MAX_URL_LENGTH):
         self.parameters = []
+        self.shapes = []
+        self.max_url_length = max_url_length
 
     def generate_url(self, size = "400x400"):
         """ Combine stored shapes into a single URL
 
         Joins the base url with shapes specified by the user with an ampersand
-        in between.
+        in between. If the URL is longer than self.max_url_length, paths and
+        polygons are simplified with increasing tolerance until it fits, or
+        until the tolerance reaches MAX_TOLERANCE.
 
         Args:
             size: The size of the image to be generated.
@@ -29,7 +76,32 @@ class Constructor(object):
         Returns:
             A string of the API request's URL
         """
-        return "&".join(["https://maps.googleapis.com/maps/api/staticmap?size=%s" % size] + self.parameters)
+
+        url = "&".join([BASE_URL % size] + self.parameters)
+        if (len(url) <= self.max_url_length):
+            return url
+
+        import shapely
+
+        # shapely needs at least two points to simplify a shape
+        indices = [i for (i, shape) in enumerate(self.shapes)
+                   if (shape is not None and len(shape[1]) >= 2)]
+        if (len(indices) == 0):
+            return url
+        lines = [shapely.LineString(self.shapes[i][1]) for i in indices]
+        parameters = list(self.parameters)
+        tolerance = MIN_TOLERANCE
+
+        while (len(url) > self.max_url_length and tolerance <= MAX_TOLERANCE):
+            for (i, line) in zip(indices, shapely.simplify(lines, tolerance)):
+                parameters[i] = "%s|enc:%s" % (
+                    self.shapes[i][0],
+                    encode_polyline(shapely.get_coordinates(line))
+                )
+            url = "&".join([BASE_URL % size] + parameters)
+            tolerance *= 2
+
+        return url
 
     def add_coords(self, new_coords, _type = "markers", color = "0x00ff0066"):
         """ Add coordinates to the current static map
@@ -47,17 +119,24 @@ class Constructor(object):
         """
 
         if (_type == "markers"):
-            new_parameters = "markers=color:%s|size:tiny" % color
-        elif (_type == "path"):
-            new_parameters = "path=color:%s|weight:5" % color
-        elif (_type == "polygon"):
-            new_parameters = "path=color:0x00000000|fillcolor:%s|weight:5" % color
+            self.parameters.append("|".join(
+                ["markers=color:%s|size:tiny" % color]
+                + ["%.5f,%.5f" % (coord[1], coord[0]) for coord in new_coords]
+            ))
+            self.shapes.append(None)
+            return
 
-        for coord in new_coords:
-            new_parameters += "|%f,%f" % (coord[1], coord[0])
+        if (_type == "path"):
+            style = "path=color:%s|weight:5" % color
+        elif (_type == "polygon"):
+            style = "path=color:0x00000000|fillcolor:%s|weight:5" % color
 
-        self.parameters.append(new_parameters)
+        coords = [(coord[0], coord[1]) for coord in new_coords]
+        self.shapes.append((style, coords))
+        self.parameters.append("%s|enc:%s" % (style,
+                                              encode_polyline(coords)))
 
     def reset(self):
         """ Clears all stored paramters """
         self.parameters = []
+        self.shapes = []
@@ -9,5 +9,13 @@ setuptools.setup(
     description = "Classes for getting the distance of a route between two"
                   "places using various different services",
     packages = ["route_distances"],
-    install_requires = ["googlemaps", "requests", "shapely"]
+    install_requires = ["googlemaps", "numpy", "requests", "shapely>=2"],
+    extras_require = {
+        "async": ["aiohttp"]
+    },
+    entry_points = {
+        "console_scripts": [
+            "route_distances = route_distances.__main__:main"
+        ]
+    }
 )
@@ -0,0 +1,45 @@
+import os
+import socket
+import sys
+
+import pytest
+
+# Import this checkout of the package and the benchmark stubs
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import stubs
+import route_distances
+
+@pytest.fixture
+def retry_policy():
+    """ A retry policy that does not slow the tests down """
+
+    return route_distances.RetryPolicy(base_delay = 0.001, max_delay = 0.01)
+
+@pytest.fixture
+def stub_server(request):
+    """ Starts stub servers, stopping them when the test ends
+
+    Call the fixture with a backend name, and optionally the keyword
+    arguments of stubs.StubServer.
+    """
+
+    servers = []
+
+    def start(backend, **kwargs):
+        server = stubs.StubServer(backend, **kwargs)
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.close()
+
+@pytest.fixture
+def dead_entrypoint():
+    """ An entrypoint nothing listens on, so connections to it are refused """
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return "127.0.0.1:%d" % s.getsockname()[1]
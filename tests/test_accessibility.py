@@ -0,0 +1,96 @@
+import numpy
+import pytest
+
+from benchmarks import stubs
+import route_distances
+
+CUTOFFS = [300, 600]
+ORIGINS = [(-122.42, 37.77), (-122.41, 37.78), (-122.30, 37.90)]
+
+def stub_cutoff(origin, destination):
+    """ Returns the smallest cutoff whose stub isochrone around origin
+    contains destination, or None """
+
+    offset = max(abs(destination[0] - origin[0]),
+                 abs(destination[1] - origin[1]))
+    for cutoff in CUTOFFS:
+        if (offset < stubs.isochrone_radius(cutoff)):
+            return cutoff
+    return None
+
+def destinations(size = 20):
+    rng = numpy.random.default_rng(0)
+    radius = stubs.isochrone_radius(max(CUTOFFS)) * 1.5
+    return rng.uniform((-122.42 - radius, 37.77 - radius),
+                       (-122.41 + radius, 37.78 + radius), (size, 2))
+
+def check_rows(result, points):
+    for (i, origin) in enumerate(ORIGINS):
+        expected = [(j, stub_cutoff(origin, point))
+                    for (j, point) in enumerate(points)
+                    if (stub_cutoff(origin, point) is not None)]
+        (indices, times) = result[i]
+        assert list(zip(indices.tolist(), times.tolist())) == expected
+
+def test_accessibility_rows(stub_server, retry_policy):
+    server = stub_server("otp")
+    calculator = route_distances.OTPDistances(server.entrypoint,
+                                              retry_policy = retry_policy)
+    points = destinations()
+    engine = route_distances.AccessibilityEngine(calculator, points)
+
+    result = engine.run(ORIGINS, [600, 300], workers = 2)
+
+    assert server.requests == len(ORIGINS)
+    assert len(result) == len(ORIGINS)
+    assert result.cutoffs == CUTOFFS
+    assert result.errors == {}
+    assert result.indptr[0] == 0 and result.indptr[-1] == len(result.indices)
+    check_rows(result, points)
+    # The last origin is too far away to reach anything
+    assert result.counts().tolist()[-1] == 0
+    assert (result.counts(300) <= result.counts()).all()
+    assert result.counts(300).sum() == (result.times == 300).sum() > 0
+
+def test_accessibility_records_failed_origins(stub_server, retry_policy):
+    server = stub_server("otp", error_rate = 1)
+    calculator = route_distances.OTPDistances(server.entrypoint,
+                                              retry_policy = retry_policy)
+    engine = route_distances.AccessibilityEngine(calculator, destinations())
+
+    result = engine.run(ORIGINS[:2], CUTOFFS)
+
+    assert sorted(result.errors) == [0, 1]
+    assert result.indptr.tolist() == [0, 0, 0]
+    assert len(result.indices) == len(result.times) == 0
+
+def test_accessibility_caches_isochrones(stub_server, retry_policy):
+    server = stub_server("otp")
+    calculator = route_distances.OTPDistances(server.entrypoint,
+                                              retry_policy = retry_policy)
+    points = destinations()
+    engine = route_distances.AccessibilityEngine(
+        calculator, points, cache = route_distances.RouteCache()
+    )
+
+    first = engine.run(ORIGINS, CUTOFFS)
+    second = engine.run(ORIGINS, CUTOFFS)
+
+    assert server.requests == len(ORIGINS)
+    check_rows(second, points)
+    assert second.indptr.tolist() == first.indptr.tolist()
+
+def test_to_scipy(stub_server, retry_policy):
+    pytest.importorskip("scipy")
+    server = stub_server("otp")
+    calculator = route_distances.OTPDistances(server.entrypoint,
+                                              retry_policy = retry_policy)
+    points = destinations()
+    engine = route_distances.AccessibilityEngine(calculator, points)
+
+    matrix = engine.run(ORIGINS, CUTOFFS).to_scipy()
+
+    assert matrix.shape == (len(ORIGINS), len(points))
+    for (i, origin) in enumerate(ORIGINS):
+        for (j, point) in enumerate(points):
+            assert matrix[i, j] == (stub_cutoff(origin, point) or 0)
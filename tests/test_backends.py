@@ -0,0 +1,55 @@
+import importlib.metadata
+
+import pytest
+
+import route_distances
+from route_distances import backends
+
+ENTRY_POINT = importlib.metadata.EntryPoint(
+    "stubosrm", "route_distances.distances:OSRMDistances",
+    backends.ENTRY_POINT_GROUP
+)
+
+@pytest.fixture
+def registry(monkeypatch):
+    """ Restores the backend registry after the test """
+
+    monkeypatch.setattr(backends, "_registry",
+                        dict(backends.BUILTIN_BACKENDS))
+    monkeypatch.setattr(backends, "_entry_points_loaded", False)
+
+def test_builtin_backends(registry):
+    assert set(backends.BUILTIN_BACKENDS) <= set(
+        route_distances.available_backends()
+    )
+    assert (route_distances.get_backend_class("osrm")
+            is route_distances.OSRMDistances)
+    with pytest.raises(ValueError):
+        route_distances.get_backend_class("nonexistent")
+
+def test_register_backend(registry):
+    route_distances.register_backend(
+        "mine", "route_distances.distances:ValhallaDistances"
+    )
+
+    assert "mine" in route_distances.available_backends()
+    calculator = route_distances.get_backend("mine", "localhost:8002")
+    assert isinstance(calculator, route_distances.ValhallaDistances)
+
+def test_entry_points(registry, monkeypatch):
+    def entry_points(group):
+        return [ENTRY_POINT] if group == backends.ENTRY_POINT_GROUP else []
+    monkeypatch.setattr(importlib.metadata, "entry_points", entry_points)
+
+    assert (route_distances.get_backend_class("stubosrm")
+            is route_distances.OSRMDistances)
+
+def test_entry_points_before_python_3_10(registry, monkeypatch):
+    # entry_points took no arguments and returned a dictionary of groups
+    def entry_points():
+        return {backends.ENTRY_POINT_GROUP: [ENTRY_POINT]}
+    monkeypatch.setattr(importlib.metadata, "entry_points", entry_points)
+
+    assert "stubosrm" in route_distances.available_backends()
+    assert (route_distances.get_backend_class("stubosrm")
+            is route_distances.OSRMDistances)
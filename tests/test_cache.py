@@ -0,0 +1,67 @@
+import asyncio
+import functools
+
+import pytest
+
+import route_distances
+
+PAIR = (-122.42, 37.77, -122.40, 37.79)
+
+def test_cache_hits(stub_server, retry_policy, tmp_path):
+    server = stub_server("osrm")
+    path = str(tmp_path / "routes.sqlite")
+    calculator = route_distances.OSRMDistances(
+        server.entrypoint, retry_policy = retry_policy, lean = True,
+        cache = route_distances.RouteCache(path)
+    )
+
+    first = calculator.distance(*PAIR)
+    assert calculator.distance(*PAIR) == first
+    assert server.requests == 1
+    assert calculator.cache.stats()["memory_hits"] == 1
+
+    # A new instance finds the result on disk
+    calculator = route_distances.OSRMDistances(
+        server.entrypoint, retry_policy = retry_policy, lean = True,
+        cache = route_distances.RouteCache(path)
+    )
+    assert calculator.distance(*PAIR) == first
+    assert server.requests == 1
+    assert calculator.cache.stats()["disk_hits"] == 1
+
+def test_no_route_is_not_cached(stub_server, retry_policy):
+    server = stub_server("osrm")
+    calculator = route_distances.OSRMDistances(
+        server.entrypoint, retry_policy = retry_policy,
+        cache = route_distances.RouteCache()
+    )
+    results = [False]
+    route = calculator.route
+
+    @functools.wraps(route)
+    def flaky_route(*args, **kwargs):
+        return results.pop() if results else route(*args, **kwargs)
+    calculator.route = flaky_route
+
+    assert calculator.distance(*PAIR) is False
+    assert calculator.distance(*PAIR)
+    assert calculator.distance(*PAIR)
+    assert server.requests == 1
+
+def test_async_cache_hits(stub_server, retry_policy):
+    aio = pytest.importorskip("route_distances.aio")
+    server = stub_server("osrm")
+
+    async def route():
+        calculator = aio.AsyncOSRMDistances(
+            server.entrypoint, retry_policy = retry_policy, lean = True,
+            cache = route_distances.RouteCache()
+        )
+        async with calculator:
+            first = await calculator.distance(*PAIR)
+            return (first, await calculator.distance(*PAIR))
+
+    (first, second) = asyncio.run(route())
+
+    assert first and second == first
+    assert server.requests == 1
@@ -0,0 +1,97 @@
+import asyncio
+import math
+
+import pytest
+
+from benchmarks import stubs
+import route_distances
+
+POINTS = [(-122.42 + i * 0.002, 37.77 + (i % 3) * 0.002) for i in range(8)]
+
+def check_chain(chain, points, tolerance = 0.01):
+    legs = [stubs.route_length(points[i], points[i + 1])
+            for i in range(len(points) - 1)]
+    assert len(chain["legs"]) == len(legs)
+    for (leg, (distance, duration)) in zip(chain["legs"], legs):
+        assert leg["distance"] == pytest.approx(distance, rel = tolerance)
+        assert leg["duration"] == pytest.approx(duration, rel = tolerance)
+    assert chain["distance"] == pytest.approx(
+        sum(leg["distance"] for leg in chain["legs"])
+    )
+    assert chain["duration"] == pytest.approx(
+        sum(leg["duration"] for leg in chain["legs"])
+    )
+
+@pytest.mark.parametrize(("backend", "kwargs"), [
+    ("osrm", {"max_viaroute_size": 3}),
+    ("valhalla", {"max_locations": 3}),
+    ("graphhopper", {"max_waypoints": 3})
+])
+def test_chain_is_split_into_overlapping_requests(stub_server, retry_policy,
+                                                  backend, kwargs):
+    server = stub_server(backend)
+    calculator = route_distances.get_backend(backend, server.entrypoint,
+                                             retry_policy = retry_policy,
+                                             **kwargs)
+
+    check_chain(calculator.route_chain(POINTS), POINTS)
+    # Seven legs, at most two per request
+    assert server.requests == math.ceil(7 / 2)
+
+@pytest.mark.parametrize("backend", ["osrm", "valhalla", "graphhopper"])
+def test_chain_in_one_request(stub_server, retry_policy, backend):
+    server = stub_server(backend)
+    calculator = route_distances.get_backend(backend, server.entrypoint,
+                                             retry_policy = retry_policy)
+
+    check_chain(calculator.route_chain(POINTS), POINTS)
+    assert server.requests == 1
+
+def test_chain_slices():
+    calculator = route_distances.OSRMDistances("localhost:5000",
+                                               max_viaroute_size = 4)
+    points = [(0, 0)] * 11
+
+    slices = calculator.chain_slices(points, "walk")
+
+    assert slices == [(0, 2), (2, 5), (5, 7), (7, 10)]
+
+def test_chain_without_multi_waypoint_requests(stub_server, retry_policy):
+    server = stub_server("otp")
+    calculator = route_distances.OTPDistances(server.entrypoint,
+                                              retry_policy = retry_policy)
+
+    chain = calculator.route_chain(POINTS[:4])
+
+    assert len(chain["legs"]) == 3
+    assert server.requests == 3
+
+def test_chain_retries_errors(stub_server, retry_policy):
+    server = stub_server("osrm", error_rate = 0.5, seed = 2)
+    calculator = route_distances.OSRMDistances(server.entrypoint,
+                                               retry_policy = retry_policy,
+                                               max_viaroute_size = 3)
+
+    for i in range(3):
+        check_chain(calculator.route_chain(POINTS), POINTS)
+    assert server.requests > 3 * 4
+
+def test_chain_needs_two_points():
+    calculator = route_distances.OSRMDistances("localhost:5000")
+
+    with pytest.raises(ValueError):
+        calculator.route_chain(POINTS[:1])
+
+def test_async_chain(stub_server, retry_policy):
+    aio = pytest.importorskip("route_distances.aio")
+    server = stub_server("valhalla")
+
+    async def chain():
+        calculator = aio.AsyncValhallaDistances(server.entrypoint,
+                                                retry_policy = retry_policy,
+                                                max_locations = 3)
+        async with calculator:
+            return await calculator.route_chain(POINTS)
+
+    check_chain(asyncio.run(chain()), POINTS)
+    assert server.requests == 4
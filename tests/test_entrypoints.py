@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+import requests
+
+import route_distances
+
+PAIR = (-122.42, 37.77, -122.40, 37.79)
+
+def osrm_calculator(pool, retry_policy):
+    return route_distances.OSRMDistances(pool, retry_policy = retry_policy)
+
+def test_fails_over_refused_connections(stub_server, dead_entrypoint,
+                                        retry_policy):
+    server = stub_server("osrm")
+    pool = route_distances.EntrypointPool([dead_entrypoint,
+                                           server.entrypoint])
+    calculator = osrm_calculator(pool, retry_policy)
+
+    for i in range(4):
+        assert calculator.distance(*PAIR)
+
+    assert server.requests == 4
+    assert pool.failures[dead_entrypoint] > 0
+    assert pool.failures[server.entrypoint] == 0
+    assert set(pool.outstanding.values()) == {0}
+
+def test_fails_over_overloaded_replicas(stub_server, retry_policy):
+    overloaded = stub_server("osrm", error_rate = 1)
+    server = stub_server("osrm")
+    pool = route_distances.EntrypointPool([overloaded.entrypoint,
+                                           server.entrypoint])
+    calculator = osrm_calculator(pool, retry_policy)
+
+    for i in range(4):
+        assert calculator.distance(*PAIR)
+
+    assert server.requests == 4
+    assert pool.failures[overloaded.entrypoint] > 0
+    assert set(pool.outstanding.values()) == {0}
+
+@pytest.mark.parametrize("error", [requests.exceptions.ChunkedEncodingError,
+                                   requests.exceptions.ContentDecodingError,
+                                   requests.exceptions.TooManyRedirects])
+def test_releases_replicas_on_other_errors(stub_server, retry_policy, error):
+    server = stub_server("osrm")
+    pool = route_distances.EntrypointPool([server.entrypoint])
+    calculator = osrm_calculator(pool, retry_policy)
+
+    def timed_request(method, url, **kwargs):
+        raise error()
+    calculator.timed_request = timed_request
+
+    with pytest.raises(error):
+        calculator.http_request("GET", "http://%s/" % server.entrypoint)
+
+    assert pool.outstanding[server.entrypoint] == 0
+    assert pool.failures[server.entrypoint] == 1
+
+def test_async_releases_cancelled_requests(stub_server, retry_policy):
+    aio = pytest.importorskip("route_distances.aio")
+    server = stub_server("osrm", latency = 1)
+    pool = route_distances.EntrypointPool([server.entrypoint])
+
+    async def cancel():
+        async with aio.AsyncOSRMDistances(
+                pool, retry_policy = retry_policy) as calculator:
+            task = asyncio.ensure_future(calculator.distance(*PAIR))
+            while (server.requests == 0):
+                await asyncio.sleep(0.01)
+            assert pool.outstanding[server.entrypoint] == 1
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    asyncio.run(cancel())
+
+    assert pool.outstanding[server.entrypoint] == 0
+    assert pool.failures[server.entrypoint] == 0
+
+def test_async_fails_over(stub_server, dead_entrypoint, retry_policy):
+    aio = pytest.importorskip("route_distances.aio")
+    server = stub_server("osrm")
+    pool = route_distances.EntrypointPool([dead_entrypoint,
+                                           server.entrypoint])
+
+    async def route():
+        async with aio.AsyncOSRMDistances(
+                pool, retry_policy = retry_policy) as calculator:
+            return await calculator.distance_batch(
+                [PAIR] * 4, return_exceptions = True
+            )
+
+    results = asyncio.run(route())
+
+    assert all(isinstance(result, dict) for result in results)
+    assert set(pool.outstanding.values()) == {0}
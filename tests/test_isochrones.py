@@ -0,0 +1,86 @@
+import math
+
+import numpy
+import pytest
+
+from benchmarks import stubs
+import route_distances
+from route_distances import isochrones
+
+ORIGIN = (-122.42, 37.77)
+CUTOFFS = [300, 600, 900]
+
+def stub_cutoff(point, origin = ORIGIN, cutoffs = CUTOFFS):
+    """ Returns the smallest cutoff whose stub isochrone contains a point, or
+    NaN """
+
+    offset = max(abs(point[0] - origin[0]), abs(point[1] - origin[1]))
+    for cutoff in cutoffs:
+        if (offset < stubs.isochrone_radius(cutoff)):
+            return cutoff
+    return math.nan
+
+def grid(origin = ORIGIN, size = 15):
+    radius = stubs.isochrone_radius(max(CUTOFFS)) * 1.2
+    steps = numpy.linspace(-radius, radius, size) + 1e-7
+    return numpy.array([(origin[0] + x, origin[1] + y) for x in steps
+                        for y in steps])
+
+def test_isochrones_in_one_request(stub_server, retry_policy):
+    server = stub_server("otp")
+    calculator = route_distances.OTPDistances(server.entrypoint,
+                                              retry_policy = retry_policy)
+
+    bands = calculator.isochrones(*ORIGIN, [900, 300, 600, 300])
+
+    assert server.requests == 1
+    assert bands.cutoffs == CUTOFFS
+    assert len(bands) == 3
+    areas = [geom.area for (cutoff, geom) in bands]
+    assert areas == sorted(areas)
+    assert bands[600].contains(bands[300])
+    assert bands[900].contains(bands[600])
+
+def test_reachable_matches_bands(stub_server, retry_policy):
+    server = stub_server("otp")
+    calculator = route_distances.OTPDistances(server.entrypoint,
+                                              retry_policy = retry_policy)
+    bands = calculator.isochrones(*ORIGIN, CUTOFFS)
+    points = grid()
+
+    expected = numpy.array([stub_cutoff(point) for point in points])
+    numpy.testing.assert_array_equal(bands.reachable(points), expected)
+    numpy.testing.assert_array_equal(bands.reachable(points, cutoff = 600),
+                                     expected <= 600)
+    assert numpy.isnan(expected).any()
+    assert (expected == 300).any()
+
+def test_geojson_round_trip():
+    box = {"type": "MultiPolygon",
+           "coordinates": [[[[0, 0], [2, 0], [2, 2], [0, 2], [0, 0]]]]}
+    features = [{"type": "Feature", "properties": {"time": 600},
+                 "geometry": box},
+                {"type": "Feature", "properties": {"time": 300},
+                 "geometry": {"type": "MultiPolygon", "coordinates": []}}]
+
+    bands = isochrones.Isochrones.from_geojson((1, 1), features,
+                                               [300, 600, 900])
+
+    assert bands.cutoffs == [300, 600, 900]
+    assert bands[300].is_empty and bands[900].is_empty
+    # Empty bands do not hide points from the bands around them
+    numpy.testing.assert_array_equal(
+        bands.reachable([(1, 1), (3, 3)]), [600, numpy.nan]
+    )
+
+    rebuilt = isochrones.Isochrones.from_geojson(
+        (1, 1), bands.to_geojson(), bands.cutoffs
+    )
+    assert rebuilt.cutoffs == bands.cutoffs
+    assert all(rebuilt[cutoff].equals(geom) for (cutoff, geom) in bands)
+
+def test_isochrones_need_cutoffs(stub_server):
+    calculator = route_distances.OTPDistances(stub_server("otp").entrypoint)
+
+    with pytest.raises(AssertionError):
+        calculator.isochrones(*ORIGIN, [])
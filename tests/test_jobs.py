@@ -0,0 +1,88 @@
+import collections
+import csv
+import functools
+import json
+import logging
+
+import pytest
+
+from route_distances import jobs
+import route_distances
+
+def test_run_job_logs_to_logger(stub_server, retry_policy, tmp_path, caplog,
+                                capsys):
+    server = stub_server("osrm")
+    calculator = route_distances.OSRMDistances(server.entrypoint,
+                                               retry_policy = retry_policy)
+    input_path = str(tmp_path / "pairs.csv")
+    output_path = str(tmp_path / "results.csv")
+    with open(input_path, "w", newline = "") as f:
+        writer = csv.writer(f)
+        writer.writerow(jobs.PAIR_FIELDS)
+        for i in range(5):
+            writer.writerow([-122.42, 37.77, -122.40, 37.77 + i * 0.01])
+
+    with caplog.at_level(logging.INFO, logger = "route_distances"):
+        assert jobs.run_job(calculator, input_path, output_path) == 5
+
+    assert "Finished after 5 pairs" in caplog.messages
+    assert capsys.readouterr().out == ""
+    with open(output_path, newline = "") as f:
+        rows = list(csv.DictReader(f))
+    assert [row["index"] for row in rows] == ["0", "1", "2", "3", "4"]
+    assert all(float(row["duration"]) > 0 for row in rows)
+
+@pytest.mark.parametrize("output_name", ["results.csv", "results.jsonl"])
+def test_run_job_resumes_after_interruption(stub_server, retry_policy,
+                                            tmp_path, output_name):
+    server = stub_server("osrm")
+    calculator = route_distances.OSRMDistances(server.entrypoint,
+                                               retry_policy = retry_policy)
+    input_path = str(tmp_path / "pairs.jsonl")
+    output_path = str(tmp_path / output_name)
+    with open(input_path, "w") as f:
+        for i in range(23):
+            f.write(json.dumps({
+                "id": "pair-%d" % i, "orig_long": -122.42, "orig_lat": 37.77,
+                "dest_long": -122.40, "dest_lat": 37.77 + i * 0.001
+            }) + "\n")
+
+    routed = collections.Counter()
+    route = calculator.route
+    interrupt_at = [17]
+
+    # Stands in for the process being killed while routing pair 17
+    @functools.wraps(route)
+    def counting_route(*args, **kwargs):
+        pair = round((args[3] - 37.77) / 0.001)
+        if (interrupt_at and pair >= interrupt_at[0]):
+            raise KeyboardInterrupt()
+        routed[pair] += 1
+        return route(*args, **kwargs)
+    calculator.route = counting_route
+
+    with pytest.raises(KeyboardInterrupt):
+        jobs.run_job(calculator, input_path, output_path, workers = 2,
+                     checkpoint_every = 5)
+    assert jobs.Checkpoint(output_path + ".checkpoint").completed == 17
+
+    # A row cut short by a hard kill after the checkpoint is dropped
+    with open(output_path, "a") as f:
+        f.write("17,pair-17,12")
+
+    interrupt_at.clear()
+    assert jobs.run_job(calculator, input_path, output_path, workers = 2,
+                        checkpoint_every = 5) == 23
+
+    # Every pair is routed exactly once across both runs
+    assert routed == collections.Counter(range(23))
+
+    with open(output_path, newline = "") as f:
+        if (output_name.endswith(".csv")):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f]
+    assert [int(row["index"]) for row in rows] == list(range(23))
+    assert [row["id"] for row in rows] == ["pair-%d" % i for i in range(23)]
+    assert all(float(row["duration"]) > 0 for row in rows)
+    assert all(not row["error"] for row in rows)
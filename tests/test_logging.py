@@ -0,0 +1,55 @@
+import json
+import logging
+
+import route_distances
+
+PAIR = (-122.42, 37.77, -122.40, 37.79)
+
+def test_verbose_leaves_logging_configuration_alone(stub_server):
+    server = stub_server("osrm")
+    logger = logging.getLogger("route_distances")
+    (handlers, level) = (list(logger.handlers), logger.level)
+
+    for i in range(3):
+        route_distances.OSRMDistances(server.entrypoint, verbose = True)
+
+    assert logger.handlers == handlers
+    assert logger.level == level
+
+def test_messages_are_logged_at_debug_level(stub_server, caplog):
+    server = stub_server("osrm")
+    calculator = route_distances.OSRMDistances(server.entrypoint,
+                                               verbose = True)
+
+    with caplog.at_level(logging.INFO, logger = "route_distances"):
+        calculator.distance(*PAIR)
+    assert caplog.records == []
+
+    with caplog.at_level(logging.DEBUG, logger = "route_distances"):
+        calculator.distance(*PAIR)
+    assert caplog.records
+    assert set(record.levelno for record in caplog.records) == {logging.DEBUG}
+    assert any(message.startswith("Sending request")
+               for message in caplog.messages)
+
+def test_json_loads_hook(stub_server):
+    server = stub_server("osrm")
+    parsed = []
+
+    def json_loads(data):
+        assert isinstance(data, bytes)
+        parsed.append(data)
+        return json.loads(data)
+
+    calculator = route_distances.OSRMDistances(server.entrypoint,
+                                               json_loads = json_loads)
+    result = calculator.distance(*PAIR)
+
+    assert result["duration"] > 0
+    assert len(parsed) == 1
+    assert result["response"] == json.loads(parsed[0])
+
+def test_response_text_is_formatted_lazily():
+    text = route_distances.ResponseText(b"\xe2\x9c\x93 ok")
+
+    assert str(text) == "✓ ok"
@@ -0,0 +1,91 @@
+import numpy
+import pytest
+
+from benchmarks import fake_googlemaps, stubs
+import route_distances
+
+ORIGINS = [(-122.42 + i * 0.003, 37.77 + (i % 3) * 0.002) for i in range(7)]
+DESTINATIONS = [(-122.40 - (i % 4) * 0.002, 37.78 + i * 0.003)
+                for i in range(5)]
+
+def stub_matrix(origins, destinations):
+    routes = [[stubs.route_length(origin, destination)
+               for destination in destinations] for origin in origins]
+    return {"distance": [[route[0] for route in row] for row in routes],
+            "duration": [[route[1] for route in row] for row in routes]}
+
+def check_matrix(matrix, origins, destinations, tolerance = 0.01):
+    expected = stub_matrix(origins, destinations)
+    for key in ("distance", "duration"):
+        assert numpy.shape(matrix[key]) == (len(origins), len(destinations))
+        numpy.testing.assert_allclose(matrix[key], expected[key],
+                                      rtol = tolerance)
+
+@pytest.mark.parametrize(("backend", "kwargs"), [
+    ("osrm", {"max_table_size": 3}),
+    ("valhalla", {"max_matrix_locations": 3,
+                  "max_matrix_location_pairs": 6}),
+    ("graphhopper", {"max_matrix_locations": 3})
+])
+def test_matrix_is_tiled_and_stitched(stub_server, retry_policy, backend,
+                                      kwargs):
+    server = stub_server(backend)
+    calculator = route_distances.get_backend(backend, server.entrypoint,
+                                             retry_policy = retry_policy,
+                                             **kwargs)
+
+    check_matrix(calculator.matrix(ORIGINS, DESTINATIONS), ORIGINS,
+                 DESTINATIONS)
+    assert server.requests > 1
+
+@pytest.mark.parametrize("backend", ["osrm", "valhalla", "graphhopper"])
+def test_matrix_in_one_request(stub_server, retry_policy, backend):
+    server = stub_server(backend)
+    calculator = route_distances.get_backend(backend, server.entrypoint,
+                                             retry_policy = retry_policy)
+
+    check_matrix(calculator.matrix(ORIGINS, DESTINATIONS), ORIGINS,
+                 DESTINATIONS)
+    assert server.requests == 1
+
+def test_google_matrix_is_tiled_and_stitched():
+    calculator = route_distances.GoogleMapsDistances(
+        api_key = "AIza" + "0" * 35, requests_per_period = None,
+        request_delay = 0
+    )
+    calculator.gmaps = fake_googlemaps.FakeClient()
+    origins = [(-122.42 + i * 0.001, 37.77) for i in range(30)]
+    destinations = [(-122.40, 37.77 + i * 0.001) for i in range(12)]
+
+    matrix = calculator.matrix(origins, destinations)
+
+    # The fake client rounds to whole meters and seconds
+    expected = stub_matrix(origins, destinations)
+    numpy.testing.assert_allclose(matrix["duration"], expected["duration"],
+                                  atol = 1)
+    numpy.testing.assert_allclose(matrix["distance"], expected["distance"],
+                                  atol = 1)
+    assert set(sum(matrix["status"], [])) == {"OK"}
+    assert calculator.gmaps.calls > 1
+    assert calculator.gmaps.elements == len(origins) * len(destinations)
+    assert calculator.requests_this_period == calculator.gmaps.elements
+
+def test_google_route_multi_uses_matrix():
+    calculator = route_distances.GoogleMapsDistances(
+        api_key = "AIza" + "0" * 35, requests_per_period = None,
+        request_delay = 0
+    )
+    calculator.gmaps = fake_googlemaps.FakeClient()
+    origin = (-122.42, 37.77)
+    destinations = [(-122.40, 37.77 + i * 0.001) for i in range(60)]
+
+    results = calculator.route_multi(*origin, destinations)
+
+    # At most 25 destinations per request
+    assert calculator.gmaps.calls == 3
+    assert calculator.requests_this_period == 60
+    expected = stub_matrix([origin], destinations)
+    numpy.testing.assert_allclose(
+        [result["duration"] for result in results], expected["duration"][0],
+        atol = 1
+    )
@@ -0,0 +1,129 @@
+import numpy
+
+from benchmarks import stubs
+import route_distances
+from route_distances import matrixstore
+
+ORIGINS = [(-122.42 + i * 0.002, 37.77) for i in range(10)]
+DESTINATIONS = [(-122.40, 37.77 + i * 0.002) for i in range(9)]
+
+def missing_cells(store):
+    return set((int(row), int(col)) for (rows, cols) in store.missing()
+               for row in rows for col in cols)
+
+def fill(store, rows, cols):
+    durations = [[float(row * 100 + col) for col in cols] for row in rows]
+    store.put(rows, cols, durations, durations)
+
+def new_store(tmp_path, n_origins = 10, n_destinations = 9):
+    store = matrixstore.MatrixStore(str(tmp_path / "store"), block_size = 8)
+    store.add_origins(ORIGINS[:n_origins])
+    store.add_destinations(DESTINATIONS[:n_destinations])
+    return store
+
+def test_new_store_is_missing_everything(tmp_path):
+    store = new_store(tmp_path)
+
+    assert store.shape == (10, 9)
+    assert not store.filled().any()
+    assert missing_cells(store) == set((row, col) for row in range(10)
+                                       for col in range(9))
+
+def test_put_fills_cells(tmp_path):
+    store = new_store(tmp_path)
+    fill(store, range(10), range(9))
+
+    assert store.filled().all()
+    assert missing_cells(store) == set()
+    assert store.get("duration", [9], [8])[0, 0] == 908
+
+def test_add_origins_and_destinations(tmp_path):
+    store = new_store(tmp_path, 6, 5)
+    fill(store, range(6), range(5))
+
+    assert list(store.add_origins(ORIGINS[6:])) == [6, 7, 8, 9]
+    filled = store.filled()
+    assert filled.shape == (10, 5)
+    assert filled[:6].all() and not filled[6:].any()
+    assert missing_cells(store) == set((row, col) for row in range(6, 10)
+                                       for col in range(5))
+
+    assert list(store.add_destinations(DESTINATIONS[5:])) == [5, 6, 7, 8]
+    filled = store.filled()
+    assert filled.shape == (10, 9)
+    assert filled[:6, :5].all()
+    assert not filled[6:].any() and not filled[:, 5:].any()
+    assert missing_cells(store) == (
+        set((row, col) for row in range(10) for col in range(9))
+        - set((row, col) for row in range(6) for col in range(5))
+    )
+
+    # Existing values are kept across blocks
+    assert store.get("duration", [5], [4])[0, 0] == 504
+    assert numpy.isnan(store.get("duration", [9], [8])[0, 0])
+
+def test_invalidate(tmp_path):
+    store = new_store(tmp_path)
+    fill(store, range(10), range(9))
+
+    store.invalidate([2, 9], slice(7, 9))
+    assert missing_cells(store) == {(2, 7), (2, 8), (9, 7), (9, 8)}
+    assert not store.filled([2, 9], [7, 8]).any()
+    assert store.filled().sum() == 90 - 4
+    assert numpy.isnan(store.get("duration", [2], [7])[0, 0])
+
+    store.invalidate(cols = [0])
+    assert missing_cells(store) == ({(2, 7), (2, 8), (9, 7), (9, 8)}
+                                    | set((row, 0) for row in range(10)))
+
+    fill(store, range(10), [0])
+    assert missing_cells(store) == {(2, 7), (2, 8), (9, 7), (9, 8)}
+
+def test_fill(stub_server, retry_policy, tmp_path):
+    server = stub_server("osrm")
+    calculator = route_distances.OSRMDistances(server.entrypoint,
+                                               retry_policy = retry_policy)
+    store = new_store(tmp_path)
+
+    assert store.fill(calculator) == 90
+    assert store.fill(calculator) == 0
+    expected = [[stubs.route_length(origin, destination)[1]
+                 for destination in DESTINATIONS] for origin in ORIGINS]
+    numpy.testing.assert_allclose(store.get("duration"), expected,
+                                  rtol = 0.01)
+
+def test_fill_leaves_failed_pairs_unfilled(stub_server, tmp_path):
+    failing = stub_server("otp", error_rate = 0.5, seed = 1)
+    calculator = route_distances.OTPDistances(
+        failing.entrypoint,
+        retry_policy = route_distances.RetryPolicy(max_attempts = 1,
+                                                   failure_threshold = None)
+    )
+    store = new_store(tmp_path, 3, 4)
+
+    filled = store.fill(calculator, workers = 1)
+    assert 0 < filled < 12
+    assert store.filled().sum() == filled
+    assert len(missing_cells(store)) == 12 - filled
+
+    # The next fill only routes the pairs that failed
+    server = stub_server("otp")
+    calculator = route_distances.OTPDistances(server.entrypoint)
+    assert store.fill(calculator) == 12 - filled
+    assert server.requests == 12 - filled
+    assert store.filled().all()
+    assert not numpy.isnan(store.get("duration")).any()
+
+def test_fill_after_circuit_breaker_opens(stub_server, tmp_path):
+    server = stub_server("otp", error_rate = 1)
+    calculator = route_distances.OTPDistances(
+        server.entrypoint,
+        retry_policy = route_distances.RetryPolicy(max_attempts = 1,
+                                                   failure_threshold = 2,
+                                                   reset_timeout = 60)
+    )
+    store = new_store(tmp_path, 2, 2)
+
+    assert store.fill(calculator, workers = 1) == 0
+    assert not store.filled().any()
+    assert len(missing_cells(store)) == 4
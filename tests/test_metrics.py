@@ -0,0 +1,148 @@
+import json
+
+from benchmarks import fake_googlemaps
+import route_distances
+from route_distances import metrics
+
+PAIR = (-122.42, 37.77, -122.40, 37.79)
+
+def counter(snapshot, name, **labels):
+    return sum(metric["value"] for metric in snapshot["counters"]
+               if (metric["name"] == name and
+                   all(metric["labels"].get(key) == value
+                       for (key, value) in labels.items())))
+
+def test_endpoint_label():
+    assert metrics.endpoint_label(
+        "http://localhost:5000/route/v1/driving/-71.1,42.3;-71.0,42.4"
+        "?overview=false"
+    ) == "/route/v1/driving"
+    assert metrics.endpoint_label("http://localhost:8002/route?json=1") \
+        == "/route"
+    assert metrics.endpoint_label("http://localhost:8002") == "/"
+
+def test_metrics_count_requests_retries_and_routes(stub_server,
+                                                   retry_policy):
+    server = stub_server("osrm", error_rate = 0.5, seed = 2)
+    recorder = route_distances.Metrics()
+    calculator = route_distances.OSRMDistances(server.entrypoint,
+                                               retry_policy = retry_policy,
+                                               hooks = [recorder])
+
+    for i in range(10):
+        assert calculator.distance(*PAIR)
+
+    snapshot = recorder.snapshot()
+    assert counter(snapshot, "http_requests_total") == server.requests
+    assert counter(snapshot, "http_requests_total", status = "200",
+                   endpoint = "/route/v1/foot") == 10
+    assert counter(snapshot, "routes_total", outcome = "ok",
+                   backend = "OSRMDistances", mode = "walk") == 10
+    assert counter(snapshot, "routes_total", outcome = "error") \
+        == counter(snapshot, "retries_total") == server.requests - 10
+    assert counter(snapshot, "failures_total") == 0
+
+    (histogram,) = [metric for metric in snapshot["histograms"]
+                    if (metric["name"] == "route_duration_seconds")]
+    assert histogram["count"] == server.requests
+    counts = [count for (bound, count) in histogram["buckets"]]
+    assert counts == sorted(counts)
+    assert counts[-1] <= histogram["count"]
+
+def test_metrics_count_failures_and_cache_lookups(stub_server):
+    server = stub_server("osrm", error_rate = 1)
+    recorder = route_distances.Metrics()
+    calculator = route_distances.OSRMDistances(
+        server.entrypoint, hooks = [recorder], fail_fast = False,
+        retry_policy = route_distances.RetryPolicy(max_attempts = 2,
+                                                   base_delay = 0.001,
+                                                   failure_threshold = None),
+        cache = route_distances.RouteCache()
+    )
+
+    assert calculator.distance(*PAIR) is False
+
+    snapshot = recorder.snapshot()
+    assert counter(snapshot, "failures_total", error = "HTTPError") == 1
+    assert counter(snapshot, "http_requests_total", status = "503") == 2
+    assert counter(snapshot, "cache_lookups_total", result = "miss") == 1
+
+def test_metrics_record_google_quota():
+    recorder = route_distances.Metrics()
+    calculator = route_distances.GoogleMapsDistances(
+        api_key = "AIza" + "0" * 35, requests_per_period = 1000,
+        request_delay = 0, hooks = [recorder]
+    )
+    calculator.gmaps = fake_googlemaps.FakeClient()
+
+    for i in range(3):
+        assert calculator.distance(*PAIR)
+
+    snapshot = recorder.snapshot()
+    assert counter(snapshot, "quota_elements_total") == 3
+    gauges = {metric["name"]: metric["value"]
+              for metric in snapshot["gauges"]}
+    assert gauges == {"quota_period_used": 3, "quota_period_limit": 1000}
+
+def test_prometheus_format():
+    recorder = route_distances.Metrics(buckets = (0.1, 1))
+    recorder.increment("routes_total", backend = "OSRMDistances",
+                       mode = "walk", outcome = "ok")
+    recorder.set("quota_period_used", 7, backend = 'A "quoted"\\name')
+    for seconds in (0.05, 0.5, 5):
+        recorder.observe("route_duration_seconds", seconds,
+                         backend = "OSRMDistances", mode = "walk")
+
+    assert recorder.prometheus().splitlines() == [
+        "# TYPE route_distances_routes_total counter",
+        'route_distances_routes_total{backend="OSRMDistances",mode="walk",'
+        'outcome="ok"} 1',
+        "# TYPE route_distances_quota_period_used gauge",
+        'route_distances_quota_period_used{backend="A \\"quoted\\"\\\\name"} '
+        '7',
+        "# TYPE route_distances_route_duration_seconds histogram",
+        'route_distances_route_duration_seconds_bucket{backend='
+        '"OSRMDistances",le="0.1",mode="walk"} 1',
+        'route_distances_route_duration_seconds_bucket{backend='
+        '"OSRMDistances",le="1",mode="walk"} 2',
+        'route_distances_route_duration_seconds_bucket{backend='
+        '"OSRMDistances",le="+Inf",mode="walk"} 3',
+        'route_distances_route_duration_seconds_sum{backend='
+        '"OSRMDistances",mode="walk"} 5.55',
+        'route_distances_route_duration_seconds_count{backend='
+        '"OSRMDistances",mode="walk"} 3'
+    ]
+
+def test_write_snapshot_and_prometheus(tmp_path):
+    recorder = route_distances.Metrics()
+    recorder.increment("retries_total", 2, backend = "OSRMDistances",
+                       mode = "walk")
+
+    recorder.write(str(tmp_path / "metrics.json"))
+    recorder.write(str(tmp_path / "metrics.prom"))
+
+    with open(str(tmp_path / "metrics.json")) as f:
+        assert json.load(f) == recorder.snapshot()
+    with open(str(tmp_path / "metrics.prom")) as f:
+        assert f.read() == recorder.prometheus()
+    assert sorted(path.name for path in tmp_path.iterdir()) \
+        == ["metrics.json", "metrics.prom"]
+
+    recorder.reset()
+    assert recorder.snapshot() == {"counters": [], "gauges": [],
+                                   "histograms": []}
+
+def test_failing_hook_does_not_break_routing(stub_server, retry_policy):
+    class BrokenHooks(route_distances.Hooks):
+        def on_route(self, backend, mode, outcome, seconds):
+            raise RuntimeError("broken hook")
+
+    server = stub_server("osrm")
+    recorder = route_distances.Metrics()
+    calculator = route_distances.OSRMDistances(
+        server.entrypoint, retry_policy = retry_policy,
+        hooks = [BrokenHooks(), recorder]
+    )
+
+    assert calculator.distance(*PAIR)
+    assert counter(recorder.snapshot(), "routes_total") == 1
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from benchmarks import stubs
+import route_distances
+
+ORIGIN = (-122.42, 37.77)
+CANDIDATES = [(-122.42 + 0.003 * (i % 7) - 0.01, 37.77 + 0.002 * (i % 5))
+              for i in range(40)]
+
+def expected(k):
+    durations = [(stubs.route_length(ORIGIN, candidate)[1], index)
+                 for (index, candidate) in enumerate(CANDIDATES)]
+    return [index for (duration, index) in sorted(durations)[:k]]
+
+@pytest.mark.parametrize("backend", ["osrm", "otp"])
+def test_nearest(stub_server, retry_policy, backend):
+    server = stub_server(backend)
+    calculator = route_distances.get_backend(backend, server.entrypoint,
+                                             retry_policy = retry_policy)
+
+    found = calculator.nearest(*ORIGIN, CANDIDATES, k = 3)
+
+    assert [index for (index, result) in found] == expected(3)
+
+@pytest.mark.parametrize("name", ["AsyncOSRMDistances", "AsyncOTPDistances"])
+def test_async_nearest(stub_server, retry_policy, name):
+    aio = pytest.importorskip("route_distances.aio")
+    server = stub_server("otp" if "OTP" in name else "osrm")
+
+    async def nearest():
+        calculator = getattr(aio, name)(server.entrypoint,
+                                        retry_policy = retry_policy)
+        async with calculator:
+            return await calculator.nearest(*ORIGIN, CANDIDATES, k = 3)
+
+    found = asyncio.run(nearest())
+
+    assert [index for (index, result) in found] == expected(3)
+
+def test_async_nearest_does_not_block_the_event_loop(stub_server,
+                                                     retry_policy):
+    aio = pytest.importorskip("route_distances.aio")
+    server = stub_server("osrm", latency = 0.3)
+
+    async def nearest():
+        ticks = 0
+        calculator = aio.AsyncOSRMDistances(server.entrypoint,
+                                            retry_policy = retry_policy)
+        async with calculator:
+            task = asyncio.ensure_future(
+                calculator.nearest(*ORIGIN, CANDIDATES, k = 3)
+            )
+            while (not task.done()):
+                await asyncio.sleep(0.01)
+                ticks += 1
+            return (await task, ticks)
+
+    (found, ticks) = asyncio.run(nearest())
+
+    assert [index for (index, result) in found] == expected(3)
+    # The matrix requests take at least 0.3 seconds each
+    assert ticks >= 15
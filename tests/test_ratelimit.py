@@ -0,0 +1,75 @@
+import time
+
+from benchmarks import fake_googlemaps
+import route_distances
+
+def google_calculator(**kwargs):
+    calculator = route_distances.GoogleMapsDistances(
+        api_key = "AIza" + "0" * 35, **kwargs
+    )
+    calculator.gmaps = fake_googlemaps.FakeClient()
+    return calculator
+
+def test_request_delay_spaces_requests_not_elements():
+    calculator = google_calculator(request_delay = 0.2)
+    points = [(-122.42 + i * 0.001, 37.77) for i in range(10)]
+
+    start = time.perf_counter()
+    calculator.matrix(points, points)
+    calculator.matrix(points, points)
+    seconds = time.perf_counter() - start
+
+    # Two 100-element requests wait for one request_delay, not for 200
+    # elements' worth of it
+    assert 0.2 <= seconds < 1
+    assert calculator.requests_this_period == 200
+
+def test_requests_per_second_charges_elements():
+    calculator = google_calculator(request_delay = 0,
+                                   requests_per_second = 100, burst = 10)
+
+    start = time.perf_counter()
+    for i in range(30):
+        calculator.rate_limit()
+    assert time.perf_counter() - start >= 0.15
+
+def test_quota_counts_elements():
+    limiter = route_distances.RateLimiter(quota = 10, period_length = 0.3)
+
+    assert limiter.acquire(6) == 0
+    assert limiter.acquire(4) == 0
+    assert limiter.acquire(1) > 0
+    assert limiter.period_used == 1
+
+def test_quota_keeps_period_already_used():
+    limiter = route_distances.RateLimiter(quota = 10, period_length = 0.3,
+                                          period_used = 9)
+
+    assert limiter.acquire() == 0
+    assert limiter.period_used == 10
+    assert limiter.acquire() > 0
+    assert limiter.period_used == 1
+
+def test_requests_this_period_is_carried_over():
+    calculator = google_calculator(request_delay = 0, requests_per_period = 10,
+                                   requests_this_period = 9,
+                                   period_length = 0.3)
+
+    calculator.rate_limit()
+    assert calculator.requests_this_period == 10
+    # The quota is used up, so the next request waits for the next period
+    start = time.perf_counter()
+    calculator.rate_limit()
+    assert time.perf_counter() - start >= 0.2
+    assert calculator.requests_this_period == 1
+
+def test_period_used_is_shared_through_the_state_file(tmp_path):
+    path = str(tmp_path / "limits.json")
+    first = route_distances.RateLimiter(quota = 10, state_path = path)
+    second = route_distances.RateLimiter(quota = 10, state_path = path)
+
+    first.acquire(3)
+    first.period_used = 8
+    assert second.period_used == 8
+    second.acquire(2)
+    assert first.period_used == 10
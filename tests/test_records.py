@@ -0,0 +1,97 @@
+import asyncio
+import math
+
+import pytest
+
+from benchmarks import stubs
+import route_distances
+
+PAIRS = [(-122.42 + i * 0.002, 37.77, -122.40, 37.79 - i * 0.002)
+         for i in range(6)]
+
+def test_route_records():
+    error = ValueError("failed")
+    results = route_distances.RouteRecords([
+        {"distance": 10.0, "duration": 1.0}, False, error,
+        route_distances.RouteRecord(20.0, 2.0)
+    ])
+
+    assert len(results) == 4
+    assert results[0] == {"distance": 10.0, "duration": 1.0}
+    assert results[1] is False
+    assert results[2] is error
+    assert results[-1] == route_distances.RouteRecord(20.0, 2.0)
+    assert results.errors == {2: error}
+    assert math.isnan(results.distances[2])
+    assert list(results) == [results[i] for i in range(4)]
+
+def test_route_record():
+    record = route_distances.RouteRecord(10.0, 1.0)
+
+    assert (record["distance"], record["duration"]) == (10.0, 1.0)
+    assert record.to_dict() == {"distance": 10.0, "duration": 1.0}
+    assert record != {"distance": 10.0}
+    assert record != None
+    with pytest.raises(KeyError):
+        record["response"]
+
+@pytest.mark.parametrize("backend", ["osrm", "valhalla", "graphhopper"])
+def test_lean_batch_returns_records(stub_server, retry_policy, backend):
+    server = stub_server(backend)
+    calculator = route_distances.get_backend(backend, server.entrypoint,
+                                             retry_policy = retry_policy,
+                                             lean = True)
+
+    results = calculator.distance_batch(PAIRS, workers = 2)
+
+    assert isinstance(results, route_distances.RouteRecords)
+    assert len(results) == len(PAIRS)
+    for (result, pair) in zip(results, PAIRS):
+        (distance, duration) = stubs.route_length(pair[:2], pair[2:])
+        assert result["distance"] == pytest.approx(distance, rel = 0.01)
+        assert result["duration"] == pytest.approx(duration, rel = 0.01)
+    assert calculator.distance(*PAIRS[0]).keys() == {"distance", "duration"}
+
+@pytest.mark.parametrize("backend", ["osrm", "valhalla", "graphhopper"])
+def test_lean_requests_leave_out_geometry(stub_server, retry_policy,
+                                          backend):
+    server = stub_server(backend)
+    full = route_distances.get_backend(backend, server.entrypoint,
+                                       retry_policy = retry_policy)
+    lean = route_distances.get_backend(backend, server.entrypoint,
+                                       retry_policy = retry_policy,
+                                       lean = True)
+
+    assert full.build_route_request(*PAIRS[0]) \
+        != lean.build_route_request(*PAIRS[0])
+    response = full.distance(*PAIRS[0])["response"]
+    assert "x" * stubs.RESPONSE_PADDING in str(response)
+
+def test_lean_batch_keeps_errors(stub_server, retry_policy):
+    server = stub_server("osrm", error_rate = 1)
+    calculator = route_distances.OSRMDistances(server.entrypoint,
+                                               retry_policy = retry_policy,
+                                               lean = True)
+
+    results = calculator.distance_batch(PAIRS, return_exceptions = True)
+
+    assert sorted(results.errors) == list(range(len(PAIRS)))
+    assert all(isinstance(result, Exception) for result in results)
+
+def test_async_lean_batch(stub_server, retry_policy):
+    aio = pytest.importorskip("route_distances.aio")
+    server = stub_server("osrm")
+
+    async def batch():
+        calculator = aio.AsyncOSRMDistances(server.entrypoint,
+                                            retry_policy = retry_policy,
+                                            lean = True)
+        async with calculator:
+            return await calculator.distance_batch(PAIRS)
+
+    results = asyncio.run(batch())
+
+    assert isinstance(results, route_distances.RouteRecords)
+    assert [result["distance"] for result in results] \
+        == pytest.approx([stubs.route_length(pair[:2], pair[2:])[0]
+                          for pair in PAIRS], rel = 0.01)
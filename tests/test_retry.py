@@ -0,0 +1,129 @@
+import time
+
+import pytest
+import requests
+
+from benchmarks import fake_googlemaps
+import route_distances
+
+PAIR = (-122.42, 37.77, -122.40, 37.79)
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(response = response)
+
+def test_is_retryable():
+    policy = route_distances.RetryPolicy()
+
+    assert policy.is_retryable(requests.ConnectionError())
+    assert policy.is_retryable(requests.Timeout())
+    assert policy.is_retryable(http_error(503))
+    assert not policy.is_retryable(http_error(400))
+    assert not policy.is_retryable(ValueError())
+    assert not policy.is_retryable(route_distances.CircuitOpenError())
+
+def test_delay_backs_off_up_to_max_delay():
+    policy = route_distances.RetryPolicy(base_delay = 1, max_delay = 5,
+                                         jitter = False)
+
+    assert [policy.delay(attempt) for attempt in range(5)] == [1, 2, 4, 5, 5]
+
+    policy.jitter = True
+    assert all(0 <= policy.delay(3) <= 5 for i in range(20))
+
+def test_circuit_breaker_opens_and_resets():
+    breaker = route_distances.CircuitBreaker(failure_threshold = 2,
+                                             reset_timeout = 0.1)
+
+    breaker.record_failure()
+    breaker.before_request()
+    breaker.record_failure()
+    assert breaker.is_open
+    with pytest.raises(route_distances.CircuitOpenError):
+        breaker.before_request()
+
+    # One trial request is let through once reset_timeout has passed
+    time.sleep(0.1)
+    breaker.before_request()
+    with pytest.raises(route_distances.CircuitOpenError):
+        breaker.before_request()
+    breaker.record_success()
+    assert not breaker.is_open
+    breaker.before_request()
+
+def test_distance_retries_transient_errors(stub_server, retry_policy):
+    server = stub_server("osrm", error_rate = 0.5, seed = 2)
+    calculator = route_distances.OSRMDistances(server.entrypoint,
+                                               retry_policy = retry_policy)
+
+    results = [calculator.distance(*PAIR) for i in range(10)]
+
+    assert all(results)
+    assert server.requests > 10
+    assert not calculator.circuit_breaker.is_open
+
+def test_distance_gives_up_after_max_attempts(stub_server):
+    server = stub_server("osrm", error_rate = 1)
+    calculator = route_distances.OSRMDistances(
+        server.entrypoint,
+        retry_policy = route_distances.RetryPolicy(max_attempts = 3,
+                                                   base_delay = 0.001,
+                                                   failure_threshold = None)
+    )
+
+    with pytest.raises(requests.HTTPError):
+        calculator.distance(*PAIR)
+    assert server.requests == 3
+
+    calculator.fail_fast = False
+    assert calculator.distance(*PAIR) is False
+    assert server.requests == 6
+
+def test_circuit_breaker_stops_requests(stub_server):
+    server = stub_server("osrm", error_rate = 1)
+    calculator = route_distances.OSRMDistances(
+        server.entrypoint, fail_fast = False,
+        retry_policy = route_distances.RetryPolicy(max_attempts = 2,
+                                                   base_delay = 0.001,
+                                                   failure_threshold = 3,
+                                                   reset_timeout = 60)
+    )
+
+    for i in range(5):
+        assert calculator.distance(*PAIR) is False
+
+    assert calculator.circuit_breaker.is_open
+    assert server.requests == 3
+
+def test_google_retries_transient_errors():
+    calculator = route_distances.GoogleMapsDistances(
+        api_key = "AIza" + "0" * 35, requests_per_period = None,
+        request_delay = 0,
+        retry_policy = route_distances.RetryPolicy(max_attempts = 6,
+                                                   base_delay = 0.001,
+                                                   failure_threshold = None)
+    )
+    calculator.gmaps = fake_googlemaps.FakeClient(error_rate = 1)
+
+    with pytest.raises(Exception) as error:
+        calculator.distance(*PAIR)
+    assert calculator.retry_policy.is_retryable(error.value)
+    assert calculator.gmaps.calls == 6
+
+    calculator.gmaps = fake_googlemaps.FakeClient(error_rate = 0.5, seed = 1)
+    assert all(calculator.distance(*PAIR) for i in range(5))
+    assert calculator.gmaps.calls > 5
+
+def test_failed_tile_is_retried_through_call_with_retries(stub_server,
+                                                          retry_policy):
+    server = stub_server("valhalla", error_rate = 0.5, seed = 5)
+    calculator = route_distances.ValhallaDistances(server.entrypoint,
+                                                   retry_policy = retry_policy)
+    points = [(-122.42 + i * 0.002, 37.77) for i in range(4)]
+
+    for i in range(5):
+        matrix = calculator.call_with_retries("walk", calculator.matrix,
+                                              points, points, mode = "walk")
+        assert all(value is not None for row in matrix["duration"]
+                   for value in row)
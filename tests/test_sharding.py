@@ -0,0 +1,65 @@
+import numpy
+import pytest
+
+from benchmarks import stubs
+import route_distances
+from route_distances import matrixstore, sharding
+
+ORIGINS = [(-122.42 + i * 0.002, 37.77) for i in range(5)]
+DESTINATIONS = [(-122.40, 37.77 + i * 0.002) for i in range(4)]
+
+def stub_durations(origins, destinations):
+    return [[stubs.route_length(origin, destination)[1]
+             for destination in destinations] for origin in origins]
+
+def test_route_tile_retries_matrix_errors(stub_server, retry_policy):
+    server = stub_server("osrm", error_rate = 0.5, seed = 3)
+    calculator = route_distances.OSRMDistances(server.entrypoint,
+                                               retry_policy = retry_policy)
+
+    for i in range(5):
+        rows = sharding.route_tile(calculator, ORIGINS, DESTINATIONS, "walk",
+                                   1, {})
+        numpy.testing.assert_allclose(
+            rows["duration"], stub_durations(ORIGINS, DESTINATIONS),
+            rtol = 0.01
+        )
+    assert server.requests > 5
+
+def test_matrix_store_fill_retries(stub_server, retry_policy, tmp_path):
+    server = stub_server("valhalla", error_rate = 0.5, seed = 3)
+    calculator = route_distances.ValhallaDistances(
+        server.entrypoint, retry_policy = retry_policy
+    )
+    store = matrixstore.MatrixStore(str(tmp_path / "store"), block_size = 8)
+    store.add_origins(ORIGINS)
+    store.add_destinations(DESTINATIONS)
+
+    assert store.fill(calculator) == len(ORIGINS) * len(DESTINATIONS)
+    assert store.filled().all()
+    numpy.testing.assert_allclose(store.get("duration"),
+                                  stub_durations(ORIGINS, DESTINATIONS),
+                                  rtol = 0.01)
+
+def test_run_shard_does_not_write_failed_tiles(stub_server, tmp_path):
+    failing = stub_server("otp", error_rate = 1)
+    config = {
+        "backend": "otp", "entrypoint": failing.entrypoint,
+        "retry_policy": route_distances.RetryPolicy(max_attempts = 1)
+    }
+    output_dir = str(tmp_path / "shards")
+
+    with pytest.raises(RuntimeError):
+        sharding.run_shard(config, ORIGINS, DESTINATIONS, output_dir, 0, 1,
+                           tile_rows = 2, tile_cols = 2)
+    with pytest.raises(ValueError):
+        sharding.merge_shards(output_dir)
+
+    # A rerun against a healthy server routes every tile again
+    server = stub_server("otp")
+    config["entrypoint"] = server.entrypoint
+    sharding.run_shard(config, ORIGINS, DESTINATIONS, output_dir, 0, 1,
+                       tile_rows = 2, tile_cols = 2)
+    assert server.requests == len(ORIGINS) * len(DESTINATIONS)
+    result = sharding.merge_shards(output_dir)
+    assert not numpy.isnan(result["duration"]).any()
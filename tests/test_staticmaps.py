@@ -0,0 +1,99 @@
+import math
+import urllib.parse
+
+import pytest
+
+import route_distances
+from route_distances import staticmaps
+
+def decode_polyline(encoded):
+    """ Decodes a Google encoded polyline into (long, lat) pairs """
+
+    values = []
+    (value, shift) = (0, 0)
+    for char in encoded:
+        chunk = ord(char) - 63
+        value |= (chunk & 0x1f) << shift
+        shift += 5
+        if (chunk < 0x20):
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            (value, shift) = (0, 0)
+
+    coords = []
+    (lat, long) = (0, 0)
+    for i in range(0, len(values), 2):
+        lat += values[i]
+        long += values[i + 1]
+        coords.append((long / 1e5, lat / 1e5))
+    return coords
+
+def shape_coords(url):
+    """ Returns the decoded coordinates of every path in a URL """
+
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+    return [decode_polyline(path.split("|enc:", 1)[1])
+            for path in query.get("path", [])]
+
+def flatten(coords):
+    return [value for coord in coords for value in coord]
+
+def ring(points, radius = 0.01, center = (-122.42, 37.77)):
+    return [(center[0] + radius * math.cos(2 * math.pi * i / points),
+             center[1] + radius * math.sin(2 * math.pi * i / points))
+            for i in range(points)] + [(center[0] + radius, center[1])]
+
+def test_encode_polyline():
+    # Google's example from the encoded polyline algorithm documentation
+    coords = [(-120.2, 38.5), (-120.95, 40.7), (-126.453, 43.252)]
+
+    assert staticmaps.encode_polyline(coords) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    assert staticmaps.encode_polyline([]) == ""
+    assert flatten(decode_polyline(staticmaps.encode_polyline(ring(50)))) \
+        == pytest.approx(flatten(ring(50)), abs = 1e-5)
+
+def test_markers_and_paths():
+    constructor = route_distances.Constructor()
+    constructor.add_coords([(-122.42, 37.77)], color = "red")
+    constructor.add_coords(ring(8), _type = "path")
+
+    url = constructor.generate_url("200x200")
+
+    (base, markers, path) = url.split("&")
+    assert base == staticmaps.BASE_URL % "200x200"
+    assert markers == "markers=color:red|size:tiny|37.77000,-122.42000"
+    assert path.startswith("path=color:0x00ff0066|weight:5|enc:")
+    assert flatten(shape_coords(url)[0]) \
+        == pytest.approx(flatten(ring(8)), abs = 1e-5)
+
+    constructor.reset()
+    assert constructor.generate_url() == staticmaps.BASE_URL % "400x400"
+
+def test_long_url_is_simplified():
+    constructor = route_distances.Constructor(max_url_length = 2000)
+    constructor.add_coords([(-122.42, 37.77)])
+    constructor.add_coords(ring(2000), _type = "polygon")
+    constructor.add_coords(ring(2000, radius = 0.005), _type = "polygon",
+                           color = "0xff000066")
+    full = "&".join([staticmaps.BASE_URL % "400x400"]
+                    + constructor.parameters)
+
+    url = constructor.generate_url()
+
+    assert len(full) > 2000 >= len(url)
+    assert url.split("&")[1] == full.split("&")[1]
+    for (coords, radius) in zip(shape_coords(url), (0.01, 0.005)):
+        assert 2 <= len(coords) < 2000
+        # Simplified rings keep their end points and stay near the circle
+        assert coords[0] == pytest.approx(coords[-1], abs = 1e-5)
+        for (long, lat) in coords:
+            assert math.hypot(long + 122.42, lat - 37.77) \
+                == pytest.approx(radius, abs = 1e-4)
+
+def test_markers_are_not_simplified():
+    constructor = route_distances.Constructor(max_url_length = 100)
+    constructor.add_coords(ring(20))
+
+    url = constructor.generate_url()
+
+    assert url == "&".join([staticmaps.BASE_URL % "400x400"]
+                           + constructor.parameters)
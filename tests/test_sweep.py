@@ -0,0 +1,66 @@
+import datetime
+import math
+
+import pytest
+
+from benchmarks import stubs
+import route_distances
+
+PAIR = (-122.42, 37.77, -122.40, 37.79)
+
+def expected_duration(departure):
+    """ Travel time in the OTP stub's timetable, including the wait """
+
+    timestamp = departure.timestamp()
+    first = math.ceil(timestamp / stubs.OTP_HEADWAY) * stubs.OTP_HEADWAY
+    ride = stubs.route_length(PAIR[:2], PAIR[2:])[1]
+    return first - timestamp + ride
+
+def sweep(calculator, **kwargs):
+    start = datetime.datetime(2026, 3, 2, 7, 0)
+    return calculator.departure_sweep(
+        [PAIR], start, start + datetime.timedelta(hours = 2), **kwargs
+    )
+
+def check_profiles(profiles):
+    assert profiles.errors == {}
+    assert profiles.durations.shape == (1, len(profiles.departures))
+    for (departure, duration) in zip(profiles.departures,
+                                     profiles.durations[0]):
+        assert duration == pytest.approx(expected_duration(departure))
+
+def test_sweep_reuses_itineraries(stub_server, retry_policy):
+    server = stub_server("otp")
+    calculator = route_distances.OTPDistances(server.entrypoint,
+                                              retry_policy = retry_policy)
+
+    profiles = sweep(calculator)
+
+    check_profiles(profiles)
+    assert profiles.requests < len(profiles.departures)
+    assert profiles.requests == server.requests
+
+def test_sweep_with_search_window(stub_server, retry_policy):
+    server = stub_server("otp")
+    calculator = route_distances.OTPDistances(server.entrypoint,
+                                              retry_policy = retry_policy)
+
+    profiles = sweep(calculator, num_itineraries = 3, search_window = 1800)
+
+    check_profiles(profiles)
+    assert profiles.requests < len(profiles.departures)
+
+def test_sweep_retries_errors(stub_server, retry_policy):
+    server = stub_server("otp", error_rate = 0.3, seed = 1)
+    calculator = route_distances.OTPDistances(server.entrypoint,
+                                              retry_policy = retry_policy)
+
+    check_profiles(sweep(calculator))
+
+def test_async_class_sweeps(stub_server, retry_policy):
+    aio = pytest.importorskip("route_distances.aio")
+    server = stub_server("otp")
+    calculator = aio.AsyncOTPDistances(server.entrypoint,
+                                       retry_policy = retry_policy)
+
+    check_profiles(sweep(calculator))